@@ -1,40 +1,265 @@
+import os
 import numpy as np
 import pandas as pd
+import joblib
 from sklearn.ensemble import IsolationForest
 from sklearn.cluster import DBSCAN
-from sklearn.preprocessing import StandardScaler
+from sky_index import valid_sky, radec_to_xyz, chord_length
+
+# Fitted models persisted per dataset/schema so rescoring skips the fit
+MODEL_DIR = os.getenv("MODEL_DIR", "model_store")
+# Rows used to fit the forest; scoring still covers every row
+FIT_SAMPLE_SIZE = 50000
+# Uniform pool kept while streaming a dataset, stratified down to
+# FIT_SAMPLE_SIZE by the detector so sparse regions stay represented
+FIT_POOL_SIZE = 4 * FIT_SAMPLE_SIZE
+SCORE_BATCH_SIZE = 100000
+FEATURE_COLUMNS = ['value', 'x', 'y']
+
+# Spatial clustering: neighbour radius on the sky, and the cap on occupied
+# grid cells (the work bound) before the grid is coarsened
+CLUSTER_EPS_DEG = 0.1
+CLUSTER_MIN_SAMPLES = 5
+CLUSTER_MAX_CELLS = 200000
+CLUSTER_SUMMARY_LIMIT = 100
+
+class SpatialClusterer:
+    """
+    Grid-bucketed density clustering that scales to full catalogs.
+
+    Points are accumulated into cells of half the neighbour radius (chunk by
+    chunk, so it can stream), then DBSCAN runs on the occupied cell centroids
+    weighted by their counts. Sky positions are clustered as unit vectors, so
+    chord distance stands in for the haversine metric and RA wrap-around and
+    the poles need no special cases. When more than `max_cells` cells are
+    occupied the grid is coarsened, which caps the work per request.
+    """
+
+    def __init__(self, eps=CLUSTER_EPS_DEG, min_samples=CLUSTER_MIN_SAMPLES,
+                 max_cells=CLUSTER_MAX_CELLS, sky=True, n_jobs=-1):
+        """
+        Args:
+            eps (float): Neighbour radius, degrees on the sky or position units otherwise
+            sky (bool): x/y are RA/Dec degrees (else planar, e.g. pixels)
+        """
+        self.sky = sky
+        self.eps = chord_length(eps) if sky else float(eps)
+        self.min_samples = min_samples
+        self.max_cells = max_cells
+        self.n_jobs = n_jobs
+        self.dims = 3 if sky else 2
+        self.cell = self.eps / 2
+        self.n_points = 0
+        self._keys = [f"k{i}" for i in range(self.dims)]
+        self._sums = [f"s{i}" for i in range(self.dims)]
+        self._cells = None
+
+    def update(self, x, y):
+        """Adds a chunk of positions (NaNs are skipped)."""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        points = radec_to_xyz(x, y) if self.sky else np.column_stack([x, y])
+        points = points[~np.isnan(points).any(axis=1)]
+        if len(points) == 0:
+            return
+        self.n_points += len(points)
+
+        frame = pd.DataFrame(np.floor(points / self.cell).astype(np.int64), columns=self._keys)
+        frame[self._sums] = points
+        frame["n"] = 1
+        cells = frame.groupby(self._keys).sum()
+        if self._cells is not None:
+            cells = pd.concat([self._cells, cells]).groupby(level=self._keys).sum()
+        self._cells = cells
+        while len(self._cells) > self.max_cells:
+            self._coarsen()
+
+    def _coarsen(self):
+        cells = self._cells.reset_index()
+        cells[self._keys] //= 2
+        self._cells = cells.groupby(self._keys).sum()
+        self.cell *= 2
+
+    def summaries(self, limit=CLUSTER_SUMMARY_LIMIT):
+        """
+        Per-cluster summaries, largest first: centroid (x/y, RA/Dec on the
+        sky), extent (max distance of a member from the centroid, same units
+        as eps) and member count.
+
+        Returns:
+            tuple: (total cluster count, list of up to `limit` summaries)
+        """
+        if self._cells is None:
+            return 0, []
+        counts = self._cells["n"].to_numpy()
+        sums = self._cells[self._sums].to_numpy()
+        centroids = sums / counts[:, None]
+
+        # A coarsened grid cannot resolve structure finer than its cells
+        eps = max(self.eps, self.cell * np.sqrt(self.dims))
+        labels = DBSCAN(
+            eps=eps, min_samples=self.min_samples, algorithm="kd_tree", n_jobs=self.n_jobs
+        ).fit(centroids, sample_weight=counts).labels_
+
+        keep = labels >= 0
+        if not keep.any():
+            return 0, []
+        labels, counts, sums, centroids = labels[keep], counts[keep], sums[keep], centroids[keep]
+        n_clusters = labels.max() + 1
+        members = np.bincount(labels, weights=counts, minlength=n_clusters)
+        centers = np.stack([np.bincount(labels, weights=sums[:, i], minlength=n_clusters)
+                            for i in range(self.dims)], axis=1) / members[:, None]
+        if self.sky:
+            centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+
+        extent = np.zeros(n_clusters)
+        np.maximum.at(extent, labels, np.linalg.norm(centroids - centers[labels], axis=1))
+        extent += self.cell * np.sqrt(self.dims) / 2
+        if self.sky:
+            extent = np.degrees(2 * np.arcsin(np.clip(extent / 2, 0, 1)))
+            cx = np.degrees(np.arctan2(centers[:, 1], centers[:, 0])) % 360.0
+            cy = np.degrees(np.arcsin(np.clip(centers[:, 2], -1, 1)))
+        else:
+            cx, cy = centers[:, 0], centers[:, 1]
+
+        order = np.argsort(-members, kind="stable")[:limit]
+        return int(n_clusters), [
+            {
+                "id": rank,
+                "members": int(members[i]),
+                "centroid_x": float(cx[i]),
+                "centroid_y": float(cy[i]),
+                "extent": float(extent[i])
+            }
+            for rank, i in enumerate(order)
+        ]
+
+def cluster_insight(n_clusters):
+    if n_clusters > 0:
+        return f"Detected {n_clusters} distinct spatial clusters of objects."
+    return None
 
 class AnomalyDetector:
     """
     AI-powered engine for detecting astronomical anomalies and patterns.
     """
     
-    def __init__(self, contamination=0.05):
+    def __init__(self, contamination=0.05, sample_size=FIT_SAMPLE_SIZE, n_jobs=-1):
         """
         Args:
             contamination (float): Expected proportion of outliers (default 5%)
+            sample_size (int): Max rows in the stratified fitting subsample
+            n_jobs (int): Parallel workers for the forest (-1 = all cores)
         """
         self.contamination = contamination
-        self.scaler = StandardScaler()
+        self.sample_size = sample_size
+        self.n_jobs = n_jobs
+        self.model = None
+        self.feature_cols = None
+
+    @staticmethod
+    def model_key(dataset_id, feature_cols):
+        return f"dataset_{dataset_id}__{'-'.join(feature_cols)}"
 
-    def analyze(self, data_list):
+    def save(self, key):
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        joblib.dump({"model": self.model, "feature_cols": self.feature_cols},
+                    os.path.join(MODEL_DIR, f"{key}.joblib"))
+
+    def load(self, key):
+        """Restores a persisted model. Returns False if none exists."""
+        path = os.path.join(MODEL_DIR, f"{key}.joblib")
+        if not os.path.exists(path):
+            return False
+        state = joblib.load(path)
+        self.model, self.feature_cols = state["model"], state["feature_cols"]
+        return True
+
+    def _stratified_sample(self, X):
+        """
+        Proportional stratified subsample: rows are bucketed on a coarse grid
+        over the position features (or value deciles) and every bucket
+        contributes its share, so sparse regions stay represented.
+        """
+        n = len(X)
+        if n <= self.sample_size:
+            return X
+        rng = np.random.default_rng(42)
+        strat_cols = X[:, 1:3] if X.shape[1] >= 3 else X[:, :1]
+        bins = 10 if strat_cols.shape[1] == 2 else 100
+        codes = np.zeros(n, dtype=np.int64)
+        for j in range(strat_cols.shape[1]):
+            edges = np.nanquantile(strat_cols[:, j], np.linspace(0, 1, bins + 1)[1:-1])
+            codes = codes * bins + np.searchsorted(edges, strat_cols[:, j])
+
+        # Random order, then take the first `quota` rows of each stratum
+        order = rng.permutation(n)
+        codes_perm = codes[order]
+        sort = np.argsort(codes_perm, kind="stable")
+        strata, starts, counts = np.unique(codes_perm[sort], return_index=True, return_counts=True)
+        quota = np.maximum(1, np.round(counts * self.sample_size / n).astype(np.int64))
+        rank = np.arange(n) - np.repeat(starts, counts)
+        keep = order[sort[rank < np.repeat(quota, counts)]]
+        return X[np.sort(keep)]
+
+    def fit(self, X, feature_cols=FEATURE_COLUMNS):
+        """
+        Fits the Isolation Forest on a stratified subsample of X.
+
+        Args:
+            X (np.ndarray): (n_rows, n_features) matrix; NaN rows are ignored.
+            feature_cols (list): Names of the columns of X.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        X = X[~np.isnan(X).any(axis=1)]
+        # Good for high-dimensional data, effective for "unusualness"
+        self.model = IsolationForest(contamination=self.contamination, random_state=42, n_jobs=self.n_jobs)
+        self.model.fit(self._stratified_sample(X))
+        self.feature_cols = list(feature_cols)
+        return self
+
+    def predict(self, X):
+        """
+        Vectorized batch scoring. Returns a boolean mask (True = anomaly);
+        rows with NaN features are never flagged.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        flags = np.zeros(len(X), dtype=bool)
+        valid = ~np.isnan(X).any(axis=1)
+        idx = np.nonzero(valid)[0]
+        for start in range(0, len(idx), SCORE_BATCH_SIZE):
+            batch = idx[start:start + SCORE_BATCH_SIZE]
+            # Returns -1 for outlier, 1 for inlier
+            flags[batch] = self.model.predict(X[batch]) == -1
+        return flags
+
+    def analyze(self, data, columns=None, cluster=True, max_cells=CLUSTER_MAX_CELLS):
         """
         Main analysis pipeline.
         
         Args:
-            data_list (list): List of dicts, e.g. [{'x':RA, 'y':Dec, 'value':Flux}, ...]
+            data (list | pd.DataFrame | np.ndarray): List of dicts, e.g.
+                [{'x':RA, 'y':Dec, 'value':Flux}, ...], a DataFrame, or an
+                array whose column names are given in `columns`.
+            columns (list): Column names when `data` is an array
+                (default ['value', 'x', 'y']).
+            cluster (bool): Run spatial clustering on x/y.
+            max_cells (int): Work cap for clustering (see SpatialClusterer).
             
         Returns:
             dict: {
                 "anomalies": [indices],
-                "clusters": [cluster_labels],
+                "clusters": [{"id", "members", "centroid_x", "centroid_y", "extent"}, ...],
                 "insights": ["Natural language string", ...]
             }
         """
-        if not data_list or len(data_list) < 10:
+        if data is None or len(data) < 10:
             return {"error": "Insufficient data for analysis"}
 
-        df = pd.DataFrame(data_list)
+        if isinstance(data, np.ndarray):
+            df = pd.DataFrame(data, columns=columns or FEATURE_COLUMNS[:data.shape[1]])
+        else:
+            df = pd.DataFrame(data).reset_index(drop=True)
         results = {"anomalies": [], "clusters": [], "insights": []}
 
         # Select Features for Analysis
@@ -51,29 +276,32 @@ class AnomalyDetector:
         if X.empty: return results
         
         # 1. Anomaly Detection (Isolation Forest)
-        # Good for high-dimensional data, effective for "unusualness"
-        iso = IsolationForest(contamination=self.contamination, random_state=42)
-        # Returns -1 for outlier, 1 for inlier
-        preds = iso.fit_predict(X)
+        # A model fitted (or loaded) for this schema is reused as-is
+        if self.model is None or self.feature_cols != feature_cols:
+            self.fit(X.to_numpy(), feature_cols)
+        preds = self.predict(X.to_numpy())
         
-        anomalies = X[preds == -1]
+        anomalies = X[preds]
         results["anomalies"] = anomalies.index.tolist()
         
-        # 2. Pattern/Cluster Detection (DBSCAN)
+        # 2. Pattern/Cluster Detection (grid-accelerated DBSCAN)
         # Good for finding spatial groups of stars/galaxies
         # We typically cluster on Position (x, y) only for Sky Maps
-        if 'x' in df.columns and 'y' in df.columns:
+        if cluster and 'x' in df.columns and 'y' in df.columns:
             pos_data = df[['x', 'y']].dropna()
-            # Standardize positions for DBSCAN (RA/Dec degrees can vary wildly)
-            pos_scaled = self.scaler.fit_transform(pos_data)
-            
-            # Epsilon 0.3std -> arbitrary heuristic for "close" on sky
-            db = DBSCAN(eps=0.3, min_samples=5).fit(pos_scaled)
-            results["clusters"] = db.labels_.tolist()
-            
-            n_clusters = len(set(db.labels_)) - (1 if -1 in db.labels_ else 0)
-            if n_clusters > 0:
-                results["insights"].append(f"Detected {n_clusters} distinct spatial clusters of objects.")
+            if not pos_data.empty:
+                sky = bool(valid_sky(pos_data['x'], pos_data['y']).all())
+                if sky:
+                    clusterer = SpatialClusterer(max_cells=max_cells)
+                else:
+                    # Planar (pixel) positions: 0.3 std heuristic for "close"
+                    spread = float(np.sqrt(pos_data.var(ddof=0).mean())) or 1.0
+                    clusterer = SpatialClusterer(eps=0.3 * spread, max_cells=max_cells, sky=False)
+                clusterer.update(pos_data['x'], pos_data['y'])
+                n_clusters, results["clusters"] = clusterer.summaries()
+                insight = cluster_insight(n_clusters)
+                if insight:
+                    results["insights"].append(insight)
 
         # 3. Generate Natural Language Insights
         self._generate_insights(df, anomalies, results)
@@ -0,0 +1,141 @@
+"""
+Query latency benchmark for the annotation/feed endpoints.
+
+Seeds a separate database (BENCHMARK_DATABASE_URL, default
+sqlite:///./benchmark.db) with millions of golden-record rows and
+annotations, then times each endpoint's query and fails if its median
+exceeds the budget:
+
+    python benchmark.py --rows 2000000 --annotations 100000
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+# Must be set before database.py builds its engine
+os.environ["DATABASE_URL"] = os.getenv("BENCHMARK_DATABASE_URL", "sqlite:///./benchmark.db")
+
+import numpy as np
+from sqlalchemy import text, func
+from database import engine, SessionLocal
+from migrations import prepare_database
+from sky_index import zone_of
+import models
+
+SEED_BATCH = 50000
+# Median latency budget per query (ms)
+BUDGETS_MS = {
+    "quality_feed": 25,
+    "dataset_annotations": 100,
+    "annotation_row_lookup": 5,
+    "demo_annotation_lookup": 5
+}
+
+def seed(n_datasets, n_rows, n_annotations, rng):
+    """Bulk-inserts datasets, standardized rows and annotations (skipped if already seeded)."""
+    with SessionLocal() as db:
+        if db.query(func.count(models.StandardizedData.id)).scalar() >= n_rows:
+            return
+    table_rows = models.StandardizedData.__table__
+    table_ann = models.Annotation.__table__
+    with engine.begin() as conn:
+        conn.execute(models.Dataset.__table__.insert(), [
+            {"filename": f"bench_{i}.csv", "format": "CSV", "file_path": ""} for i in range(n_datasets)
+        ])
+        dataset_ids = [r[0] for r in conn.execute(text("SELECT id FROM datasets ORDER BY id"))][-n_datasets:]
+
+    per_dataset = n_rows // n_datasets
+    for dataset_id in dataset_ids:
+        for start in range(0, per_dataset, SEED_BATCH):
+            n = min(SEED_BATCH, per_dataset - start)
+            ra, dec = rng.uniform(0, 360, n), rng.uniform(-90, 90, n)
+            # Rows carry their sky zone, as ingestion writes them
+            zones = zone_of(dec)
+            with engine.begin() as conn:
+                conn.execute(table_rows.insert(), [
+                    {"dataset_id": dataset_id, "original_id": str(start + i), "ra": float(r), "dec": float(d),
+                     "brightness": float(b), "sky_zone": int(z)}
+                    for i, (r, d, b, z) in enumerate(zip(ra, dec, rng.normal(15, 2, n), zones))
+                ])
+        print(f"seeded dataset {dataset_id}", flush=True)
+
+    now = datetime.utcnow()
+    for start in range(0, n_annotations, SEED_BATCH):
+        n = min(SEED_BATCH, n_annotations - start)
+        with engine.begin() as conn:
+            conn.execute(table_ann.insert(), [
+                {"dataset_id": int(d), "user_id": f"user{int(u)}", "flag_type": "comment",
+                 "comment": "seeded", "timestamp": now - timedelta(seconds=int(s))}
+                for d, u, s in zip(rng.choice(dataset_ids, n), rng.integers(0, 100, n),
+                                   rng.integers(0, 86400 * 365, n))
+            ])
+
+def timed(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--datasets", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--annotations", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    prepare_database()
+    rng = np.random.default_rng(0)
+    seed(args.datasets, args.rows, args.annotations, rng)
+
+    # Handlers are called directly: same queries, no HTTP overhead
+    from main import get_quality_feed, get_annotations
+    ann = models.Annotation
+    sd = models.StandardizedData
+    with SessionLocal() as db:
+        dataset_id = db.query(func.max(models.Dataset.id)).scalar()
+        per_dataset = args.rows // args.datasets
+        ids = [str(i) for i in rng.integers(0, per_dataset, 3)]
+        queries = {
+            "quality_feed": lambda: get_quality_feed(limit=10, db=db),
+            "dataset_annotations": lambda: get_annotations(dataset_id, db=db),
+            # create_annotation's (dataset_id, original_id) row lookup
+            "annotation_row_lookup": lambda: db.query(sd).filter(
+                sd.dataset_id == dataset_id, sd.original_id == ids[0]
+            ).first(),
+            # Ingestion's batched demo-annotation lookup
+            "demo_annotation_lookup": lambda: db.query(sd.original_id, sd.id).filter(
+                sd.dataset_id == dataset_id, sd.original_id.in_(ids)
+            ).all()
+        }
+        plans = {
+            "quality_feed": db.query(ann, models.Dataset.filename).join(
+                models.Dataset, ann.dataset_id == models.Dataset.id).order_by(ann.timestamp.desc()).limit(10),
+            "dataset_annotations": db.query(ann).filter(ann.dataset_id == dataset_id),
+            "annotation_row_lookup": db.query(sd).filter(sd.dataset_id == dataset_id, sd.original_id == ids[0]),
+        }
+
+        failed = []
+        for name, query in queries.items():
+            db.expire_all()
+            median = timed(query, args.repeats)
+            status = "ok" if median <= BUDGETS_MS[name] else "SLOW"
+            if status != "ok":
+                failed.append(name)
+            print(f"{name:<24} {median:8.2f} ms  (budget {BUDGETS_MS[name]} ms)  {status}")
+            if name in plans and engine.dialect.name == "sqlite":
+                statement = plans[name].statement.compile(engine, compile_kwargs={"literal_binds": True})
+                for row in db.execute(text(f"EXPLAIN QUERY PLAN {statement}")):
+                    print(f"{'':<26}{row[-1]}")
+
+    if failed:
+        print(f"Over budget: {', '.join(failed)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import os
+import shutil
+import numpy as np
+import pyarrow as pa
+from sky_index import valid_sky
+
+# Root of the per-dataset Arrow IPC files
+COLUMNAR_DIR = os.getenv("COLUMNAR_DIR", "columnar_store")
+# Sky partitions are REGION_DEG x REGION_DEG tiles in RA/Dec
+REGION_DEG = 30.0
+RA_REGIONS = int(360 // REGION_DEG)
+DEC_REGIONS = int(180 // REGION_DEG)
+# Rows without real sky coordinates (e.g. image pixels)
+NO_SKY_REGION = -1
+
+SCHEMA = pa.schema([
+    ("row_number", pa.int64()),
+    ("original_id", pa.string()),
+    ("ra", pa.float64()),
+    ("dec", pa.float64()),
+    ("brightness", pa.float64()),
+    ("temperature", pa.float64()),
+    ("velocity", pa.float64()),
+    ("redshift", pa.float64()),
+    ("pm_ra", pa.float64()),
+    ("pm_dec", pa.float64()),
+    ("epoch", pa.float64()),
+    ("brightness_unit", pa.string()),
+    ("object_type", pa.string()),
+    ("sky_zone", pa.int64())
+])
+NUMERIC_COLUMNS = [f.name for f in SCHEMA if pa.types.is_floating(f.type)]
+
+def dataset_dir(dataset_id):
+    return os.path.join(COLUMNAR_DIR, f"dataset={dataset_id}")
+
+def region_of(ra, dec):
+    """Sky partition of each position (vectorized); NO_SKY_REGION off the sky."""
+    ra = np.asarray(ra, dtype=np.float64)
+    dec = np.asarray(dec, dtype=np.float64)
+    on_sky = valid_sky(ra, dec)
+    ra_band = np.clip(np.floor(np.where(on_sky, ra, 0.0) / REGION_DEG), 0, RA_REGIONS - 1)
+    dec_band = np.clip(np.floor((np.where(on_sky, dec, 0.0) + 90.0) / REGION_DEG), 0, DEC_REGIONS - 1)
+    return np.where(on_sky, dec_band * RA_REGIONS + ra_band, NO_SKY_REGION).astype(np.int64)
+
+def regions_for_box(ra_min, ra_max, dec_min, dec_max):
+    """Sky partitions overlapping an RA/Dec box (ra_min > ra_max wraps through RA 0)."""
+    dec_bands = range(
+        int(np.clip((dec_min + 90.0) // REGION_DEG, 0, DEC_REGIONS - 1)),
+        int(np.clip((dec_max + 90.0) // REGION_DEG, 0, DEC_REGIONS - 1)) + 1
+    )
+    first = int(np.clip(ra_min // REGION_DEG, 0, RA_REGIONS - 1))
+    last = int(np.clip(ra_max // REGION_DEG, 0, RA_REGIONS - 1))
+    if ra_min <= ra_max:
+        ra_bands = list(range(first, last + 1))
+    else:
+        ra_bands = list(range(first, RA_REGIONS)) + list(range(0, last + 1))
+    return [d * RA_REGIONS + r for d in dec_bands for r in ra_bands]
+
+class ColumnarWriter:
+    """
+    Writes a dataset's golden-record rows as Arrow IPC files, one per sky
+    region (dataset=<id>/region=<n>/part-0.arrow). Chunks are appended as
+    record batches to the open file of their region, so ingestion memory
+    stays bounded by the chunk size.
+    """
+
+    def __init__(self, dataset_id, root=None):
+        self.dataset_id = dataset_id
+        self.path = dataset_dir(dataset_id) if root is None else os.path.join(root, f"dataset={dataset_id}")
+        self._writers = {}  # region -> (sink, RecordBatchFileWriter)
+        self.rows_written = 0
+        # Re-ingesting the same id starts from scratch
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def write(self, rows):
+        """Appends a frame laid out like StandardizedRowWriter.build_rows()."""
+        if len(rows) == 0:
+            return
+        frame = rows.assign(row_number=np.arange(self.rows_written, self.rows_written + len(rows)))
+        frame = frame[SCHEMA.names]
+        frame = frame.astype({"original_id": str})
+        regions = region_of(rows["ra"], rows["dec"])
+        for region in np.unique(regions):
+            part = frame[regions == region]
+            batch = pa.RecordBatch.from_pandas(part, schema=SCHEMA, preserve_index=False)
+            self._writer(int(region)).write_batch(batch)
+        self.rows_written += len(rows)
+
+    def _writer(self, region):
+        if region not in self._writers:
+            folder = os.path.join(self.path, f"region={region}")
+            os.makedirs(folder, exist_ok=True)
+            sink = pa.OSFile(os.path.join(folder, "part-0.arrow"), "wb")
+            self._writers[region] = (sink, pa.ipc.new_file(sink, SCHEMA))
+        return self._writers[region][1]
+
+    def close(self):
+        for sink, writer in self._writers.values():
+            writer.close()
+            sink.close()
+        self._writers = {}
+        return self.path
+
+class ColumnarDataset:
+    """
+    Read side of a dataset's columnar store. Files are memory-mapped, so
+    column scans read straight from the page cache without copying, and
+    region pruning skips the partitions a sky query cannot touch.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def regions(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(
+            int(name.split("=", 1)[1]) for name in os.listdir(self.path) if name.startswith("region=")
+        )
+
+    def _files(self, regions=None):
+        wanted = self.regions if regions is None else sorted(set(regions) & set(self.regions))
+        for region in wanted:
+            yield os.path.join(self.path, f"region={region}", "part-0.arrow")
+
+    def read(self, columns=None, regions=None):
+        """Memory-mapped pa.Table of the requested columns (all regions by default)."""
+        tables = []
+        for file_path in self._files(regions):
+            source = pa.memory_map(file_path, "r")
+            table = pa.ipc.open_file(source).read_all()
+            tables.append(table.select(columns) if columns else table)
+        if not tables:
+            schema = pa.schema([SCHEMA.field(c) for c in columns]) if columns else SCHEMA
+            return schema.empty_table()
+        return pa.concat_tables(tables)
+
+    def column(self, name, regions=None):
+        """One column as a NumPy array (zero-copy when it has no nulls)."""
+        chunked = self.read([name], regions).column(name)
+        if chunked.num_chunks == 1 and chunked.null_count == 0:
+            return chunked.chunk(0).to_numpy(zero_copy_only=False)
+        return chunked.to_numpy()
+
+def open_dataset(dataset):
+    """ColumnarDataset for a models.Dataset, or None if it has no columnar copy."""
+    if not dataset.columnar_path or not os.path.isdir(dataset.columnar_path):
+        return None
+    return ColumnarDataset(dataset.columnar_path)
@@ -0,0 +1,196 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from sklearn.neighbors import NearestNeighbors
+from sqlalchemy import bindparam, or_, and_
+import models
+from database import SessionLocal
+from sky_index import radec_to_xyz, chord_length
+
+# Rows written per executemany when storing matches
+MATCH_BATCH_SIZE = 20000
+MAS_PER_DEG = 3.6e6
+
+def propagate(ra, dec, pm_ra, pm_dec, epoch, target_epoch):
+    """
+    Linear proper-motion propagation of positions to target_epoch.
+    Rows without proper motion or epoch keep their catalogued position.
+
+    Args:
+        pm_ra (array): mas/yr, already multiplied by cos(dec)
+        pm_dec (array): mas/yr
+        epoch (array): Julian year of each position
+    """
+    dt = np.nan_to_num(target_epoch - np.asarray(epoch, dtype=np.float64))
+    pm_ra = np.nan_to_num(np.asarray(pm_ra, dtype=np.float64))
+    pm_dec = np.nan_to_num(np.asarray(pm_dec, dtype=np.float64))
+    cos_dec = np.maximum(np.cos(np.radians(dec)), 1e-9)
+    new_dec = np.clip(dec + pm_dec * dt / MAS_PER_DEG, -90.0, 90.0)
+    new_ra = (ra + pm_ra * dt / MAS_PER_DEG / cos_dec) % 360.0
+    return new_ra, new_dec
+
+def match_catalogs(ra_a, dec_a, ra_b, dec_b, radius, unique=True, n_jobs=-1):
+    """
+    Nearest-neighbour match of catalog A against catalog B on the sphere.
+
+    A k-d tree on unit vectors of B is queried for every A position at once
+    (parallel over n_jobs). Only pairs closer than `radius` degrees are kept;
+    with unique=True each B source keeps only its closest A source.
+
+    Returns:
+        tuple: (idx_a, idx_b, separation_deg) arrays
+    """
+    if len(ra_a) == 0 or len(ra_b) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0)
+
+    nn = NearestNeighbors(n_neighbors=1, algorithm="kd_tree", n_jobs=n_jobs)
+    nn.fit(radec_to_xyz(ra_b, dec_b))
+    chord, idx_b = nn.kneighbors(radec_to_xyz(ra_a, dec_a))
+    chord, idx_b = chord[:, 0], idx_b[:, 0]
+
+    idx_a = np.nonzero(chord <= chord_length(radius))[0]
+    idx_b, chord = idx_b[idx_a], chord[idx_a]
+    if unique and len(idx_a):
+        # Closest claim on each B source wins
+        order = np.lexsort((chord, idx_b))
+        _, first = np.unique(idx_b[order], return_index=True)
+        keep = np.sort(order[first])
+        idx_a, idx_b, chord = idx_a[keep], idx_b[keep], chord[keep]
+
+    separation = np.degrees(2 * np.arcsin(np.clip(chord / 2, 0, 1)))
+    return idx_a, idx_b, separation
+
+def _load_positions(db, dataset_id):
+    col = models.StandardizedData
+    query = db.query(
+        col.id, col.ra, col.dec, col.pm_ra, col.pm_dec, col.epoch
+    ).filter(col.dataset_id == dataset_id, col.sky_zone.isnot(None))
+    frame = pd.read_sql(query.statement, db.connection())
+    return frame.astype({"ra": "float64", "dec": "float64", "pm_ra": "float64",
+                         "pm_dec": "float64", "epoch": "float64"})
+
+def _assign_groups(ids_a, ids_b):
+    """
+    Match groups of the rows joined by pairs: connected components of the
+    pair graph, each labelled with its smallest row id.
+
+    Returns:
+        tuple: (row ids, group of each row) over every row that is in a pair
+    """
+    if len(ids_a) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+
+    rows, inverse = np.unique(np.concatenate([ids_a, ids_b]), return_inverse=True)
+    n, k = len(rows), len(ids_a)
+    graph = coo_matrix((np.ones(k), (inverse[:k], inverse[k:])), shape=(n, n))
+    _, component = connected_components(graph, directed=False)
+
+    # Smallest row id of each component becomes the group id
+    root = np.full(component.max() + 1, np.iinfo(np.int64).max)
+    np.minimum.at(root, component, rows)
+    return rows, root[component]
+
+def run_crossmatch(dataset_a, dataset_b, radius_arcsec=1.0, target_epoch=None,
+                   unique=True, job_id=None, progress_queue=None):
+    """
+    Cross-matches two stored datasets and writes the result back: pair rows
+    in cross_matches and a shared match_group on the matched objects.
+
+    Runs inside a worker process (see jobs.JobManager), so it owns its session.
+    """
+    def report(stage, progress):
+        if progress_queue is not None:
+            progress_queue.put({"job_id": job_id, "stage": stage, "progress": round(progress, 3)})
+
+    db = SessionLocal()
+    try:
+        report("loading", 0.0)
+        cat_a = _load_positions(db, dataset_a)
+        cat_b = _load_positions(db, dataset_b)
+
+        ra_a, dec_a = cat_a["ra"].to_numpy(), cat_a["dec"].to_numpy()
+        ra_b, dec_b = cat_b["ra"].to_numpy(), cat_b["dec"].to_numpy()
+        if target_epoch is not None:
+            ra_a, dec_a = propagate(ra_a, dec_a, cat_a["pm_ra"], cat_a["pm_dec"], cat_a["epoch"], target_epoch)
+            ra_b, dec_b = propagate(ra_b, dec_b, cat_b["pm_ra"], cat_b["pm_dec"], cat_b["epoch"], target_epoch)
+
+        report("matching", 0.3)
+        idx_a, idx_b, separation = match_catalogs(
+            ra_a, dec_a, ra_b, dec_b, radius_arcsec / 3600.0, unique=unique
+        )
+
+        ids_a = cat_a["id"].to_numpy()[idx_a]
+        ids_b = cat_b["id"].to_numpy()[idx_b]
+
+        report("grouping", 0.6)
+        # Re-running a pair replaces its previous matches
+        xm = models.CrossMatch
+        db.query(xm).filter(or_(
+            and_(xm.dataset_a_id == dataset_a, xm.dataset_b_id == dataset_b),
+            and_(xm.dataset_a_id == dataset_b, xm.dataset_b_id == dataset_a)
+        )).delete(synchronize_session=False)
+
+        # Groups touching either dataset are rebuilt from the pairs that are
+        # left plus the new ones, so groups only the old pairs held together
+        # split up again. Groups elsewhere are untouched.
+        col = models.StandardizedData
+        touched = (db.query(col.match_group)
+                   .filter(col.dataset_id.in_([dataset_a, dataset_b]), col.match_group.isnot(None))
+                   .distinct())
+        kept = pd.read_sql(
+            db.query(xm.id, xm.object_a_id, xm.object_b_id).filter(xm.match_group.in_(touched.subquery())).statement,
+            db.connection()
+        )
+        stale = [{"group": int(g)} for (g,) in touched]
+
+        rows, row_group = _assign_groups(
+            np.concatenate([kept["object_a_id"].to_numpy(dtype=np.int64), ids_a]),
+            np.concatenate([kept["object_b_id"].to_numpy(dtype=np.int64), ids_b])
+        )
+
+        report("writing", 0.7)
+        table = col.__table__
+        for start in range(0, len(stale), MATCH_BATCH_SIZE):
+            db.execute(table.update().where(table.c.match_group == bindparam("group")).values(match_group=None),
+                       stale[start:start + MATCH_BATCH_SIZE])
+
+        set_group = table.update().where(table.c.id == bindparam("row_id")).values(match_group=bindparam("group"))
+        for start in range(0, len(rows), MATCH_BATCH_SIZE):
+            stop = start + MATCH_BATCH_SIZE
+            db.execute(set_group, [{"row_id": int(r), "group": int(g)} for r, g in zip(rows[start:stop], row_group[start:stop])])
+
+        set_pair_group = xm.__table__.update().where(xm.__table__.c.id == bindparam("pair_id")).values(match_group=bindparam("group"))
+        kept_ids, kept_groups = kept["id"].to_numpy(), row_group[np.searchsorted(rows, kept["object_a_id"].to_numpy(dtype=np.int64))]
+        for start in range(0, len(kept_ids), MATCH_BATCH_SIZE):
+            stop = start + MATCH_BATCH_SIZE
+            db.execute(set_pair_group, [{"pair_id": int(p), "group": int(g)} for p, g in zip(kept_ids[start:stop], kept_groups[start:stop])])
+
+        groups = row_group[np.searchsorted(rows, ids_a)]
+        for start in range(0, len(ids_a), MATCH_BATCH_SIZE):
+            stop = start + MATCH_BATCH_SIZE
+            pairs = [
+                {"dataset_a_id": dataset_a, "dataset_b_id": dataset_b,
+                 "object_a_id": int(a), "object_b_id": int(b),
+                 "separation_arcsec": float(s * 3600.0), "match_group": int(g)}
+                for a, b, s, g in zip(ids_a[start:stop], ids_b[start:stop], separation[start:stop], groups[start:stop])
+            ]
+            db.execute(xm.__table__.insert(), pairs)
+            report("writing", 0.7 + 0.3 * min(1.0, stop / max(1, len(ids_a))))
+        db.commit()
+
+        return {
+            "dataset_a": dataset_a,
+            "dataset_b": dataset_b,
+            "radius_arcsec": radius_arcsec,
+            "target_epoch": target_epoch,
+            "sources_a": len(cat_a),
+            "sources_b": len(cat_b),
+            "matches": int(len(ids_a)),
+            "median_separation_arcsec": float(np.median(separation) * 3600.0) if len(separation) else None,
+            "groups": int(len(np.unique(row_group)))
+        }
+    finally:
+        db.close()
@@ -1,7 +1,9 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.ext.declarative import declarative_base
 from dotenv import load_dotenv
+import asyncio
 import os
 
 # Load environment variables from .env file
@@ -15,16 +17,113 @@ LLM_API_KEY = os.getenv("LLM_API_KEY")
 LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://openrouter.ai/api/v1")
 LLM_MODEL = os.getenv("LLM_MODEL", "allenai/molmo-2-8b:free")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# Connection pool (per process); API handlers run in the threadpool, so
+# size + overflow bounds how many of them hold a connection at once
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# SQLite: how long a writer waits for the lock (ms) and the page cache size (KiB)
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 30000))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", 65536))
+# Optional async engine (needs aiosqlite or asyncpg)
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() == "true"
+
+def _is_sqlite(url):
+    return url.startswith("sqlite")
+
+def _engine_options(url):
+    if _is_sqlite(url) and (":memory:" in url or url.rstrip("/").endswith("sqlite:")):
+        # One shared connection, or every checkout would see its own empty database
+        return {"connect_args": {"check_same_thread": False}, "poolclass": StaticPool}
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING
+    }
+    if _is_sqlite(url):
+        options["connect_args"] = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT / 1000}
+    return options
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets API readers run while an ingestion worker writes; NORMAL sync is
+    durable in WAL mode and avoids an fsync per commit.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def async_url(url):
+    """Async-driver form of a database URL (sqlite -> aiosqlite, postgresql -> asyncpg)."""
+    scheme, rest = url.split("://", 1)
+    base = scheme.split("+", 1)[0]
+    driver = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}.get(base)
+    return f"{base}+{driver}://{rest}" if driver else url
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **_engine_options(SQLALCHEMY_DATABASE_URL))
+if _is_sqlite(SQLALCHEMY_DATABASE_URL):
+    event.listen(engine, "connect", _sqlite_pragmas)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_url(SQLALCHEMY_DATABASE_URL)
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL))
+    if _is_sqlite(ASYNC_DATABASE_URL):
+        event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
+    # Sync dependency: FastAPI runs it (and plain `def` handlers) in its threadpool
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+async def run_db(func, *args):
+    """
+    Runs func(session, *args) without blocking the event loop, for handlers
+    that must stay async (they schedule jobs or await I/O). With DB_ASYNC the
+    sync ORM code runs on the async engine (AsyncSession.run_sync); otherwise
+    it runs in a worker thread on its own pooled session.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(func, *args)
+
+    def call():
+        with SessionLocal() as db:
+            return func(db, *args)
+    return await asyncio.to_thread(call)
+
+def sync_schema(base):
+    """
+    create_all() only creates missing tables, so existing databases also get
+    newly added (nullable) columns and indexes here.
+    """
+    base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in base.metadata.sorted_tables:
+            existing_cols = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_cols:
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+            existing_idx = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_idx:
+                    index.create(conn)
@@ -0,0 +1,236 @@
+import os
+import json
+import shutil
+import warnings
+import numpy as np
+import h5py
+from astropy.io import fits
+from astropy.wcs import WCS
+
+# Root of the per-dataset image pyramids
+TILES_DIR = os.getenv("TILES_DIR", "tile_store")
+TILE_SIZE = 256
+# Pixels read per block while building the pyramid; bounds memory for any image size
+BLOCK_PIXELS = 4_000_000
+# Largest cutout returned at full resolution; bigger boxes come from a coarser level
+CUTOUT_MAX_PIXELS = 16_000_000
+MANIFEST = "pyramid.json"
+
+class TileError(ValueError):
+    pass
+
+def dataset_dir(dataset_id):
+    return os.path.join(TILES_DIR, f"dataset={dataset_id}")
+
+def find_image(file_path, fmt):
+    """
+    Key of the first 2D+ numeric image in an uploaded file: the HDU index for
+    FITS, the dataset name for HDF5. None if the file holds no image.
+    """
+    if fmt == "FITS":
+        with fits.open(file_path, memmap=True) as hdul:
+            for i, hdu in enumerate(hdul):
+                if isinstance(hdu, (fits.PrimaryHDU, fits.ImageHDU)) and hdu.header.get("NAXIS", 0) >= 2 \
+                        and all(hdu.header.get(f"NAXIS{n}", 0) > 0 for n in (1, 2)):
+                    return i
+    elif fmt == "HDF5":
+        found = []
+        with h5py.File(file_path, "r") as f:
+            f.visititems(lambda name, obj: found.append(name) if isinstance(obj, h5py.Dataset)
+                         and obj.ndim >= 2 and obj.dtype.names is None
+                         and np.issubdtype(obj.dtype, np.number) and obj.size > 0 else None)
+        if found:
+            return found[0]
+    return None
+
+class ImageSource:
+    """
+    Full-resolution image plane (the first plane of a cube) read straight
+    from the uploaded file. FITS data is memory-mapped and HDF5 is read by
+    hyperslab, so a window only touches the pages/chunks it covers.
+    BSCALE/BZERO/BLANK are applied per window.
+    """
+
+    def __init__(self, file_path, fmt, key):
+        self.fmt = fmt
+        if fmt == "FITS":
+            self._file = fits.open(file_path, memmap=True, do_not_scale_image_data=True)
+            hdu = self._file[int(key)]
+            self._data = hdu.data
+            self.header = hdu.header
+            self._bscale = hdu.header.get("BSCALE", 1.0)
+            self._bzero = hdu.header.get("BZERO", 0.0)
+            self._blank = hdu.header.get("BLANK") if np.issubdtype(self._data.dtype, np.integer) else None
+        else:
+            self._file = h5py.File(file_path, "r")
+            self._data = self._file[key]
+            self.header = None
+            self._bscale, self._bzero, self._blank = 1.0, 0.0, None
+        self._lead = (0,) * (self._data.ndim - 2)
+        self.shape = tuple(int(n) for n in self._data.shape[-2:])
+
+    def read(self, y0, y1, x0, x1):
+        raw = np.asarray(self._data[self._lead + (slice(y0, y1), slice(x0, x1))])
+        window = raw.astype(np.float32)
+        if self._blank is not None:
+            window[raw == self._blank] = np.nan
+        if self._bscale != 1.0 or self._bzero != 0.0:
+            window = window * np.float32(self._bscale) + np.float32(self._bzero)
+        return window
+
+    def wcs(self):
+        """Celestial WCS of a FITS image, or None."""
+        if self.header is None:
+            return None
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            wcs = WCS(self.header, naxis=2)
+        return wcs if wcs.has_celestial else None
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _downsample(block):
+    """2x2 mean of a block (NaNs skipped; odd edges padded with NaN)."""
+    h, w = block.shape
+    if h % 2 or w % 2:
+        block = np.pad(block, ((0, h % 2), (0, w % 2)), constant_values=np.nan)
+        h, w = block.shape
+    quads = block.reshape(h // 2, 2, w // 2, 2)
+    finite = np.isfinite(quads)
+    total = np.where(finite, quads, 0).sum(axis=(1, 3), dtype=np.float32)
+    n = finite.sum(axis=(1, 3))
+    return np.divide(total, n, out=np.full(total.shape, np.nan, dtype=np.float32), where=n > 0)
+
+def _level_path(folder, level):
+    return os.path.join(folder, f"level={level}.npy")
+
+def build_pyramid(dataset_id, file_path, fmt, report=None):
+    """
+    Builds the mip pyramid of a dataset's image: level k is the image
+    downsampled by 2**k (2x2 means), written as a float32 .npy array so
+    tile reads can memory-map it. Level 0 is not copied; full-resolution
+    reads go to the uploaded file. Each level is built from the previous
+    one in row blocks, so memory stays bounded by BLOCK_PIXELS.
+
+    Returns:
+        str | None: The pyramid folder, or None if the file holds no image.
+    """
+    key = find_image(file_path, fmt)
+    if key is None:
+        return None
+    folder = dataset_dir(dataset_id)
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+
+    with ImageSource(file_path, fmt, key) as source:
+        height, width = source.shape
+        max_zoom = max(0, int(np.ceil(np.log2(max(height, width) / TILE_SIZE))))
+        read, shape = source.read, (height, width)
+        for level in range(1, max_zoom + 1):
+            out_shape = ((shape[0] + 1) // 2, (shape[1] + 1) // 2)
+            out = np.lib.format.open_memmap(_level_path(folder, level), mode="w+", dtype=np.float32, shape=out_shape)
+            # Even row count per block keeps 2x2 groups inside one block
+            step = max(2, (BLOCK_PIXELS // shape[1]) // 2 * 2)
+            for start in range(0, shape[0], step):
+                out[start // 2:(start + step + 1) // 2] = _downsample(read(start, start + step, 0, shape[1]))
+            out.flush()
+            del out
+            if report:
+                report(level / max_zoom)
+            previous = np.load(_level_path(folder, level), mmap_mode="r")
+            read, shape = (lambda y0, y1, x0, x1, a=previous: np.asarray(a[y0:y1, x0:x1])), out_shape
+
+    with open(os.path.join(folder, MANIFEST), "w") as f:
+        json.dump({
+            "format": fmt, "key": key, "width": width, "height": height,
+            "tile_size": TILE_SIZE, "max_zoom": max_zoom
+        }, f)
+    return folder
+
+class ImagePyramid:
+    """
+    Read side of a dataset's image pyramid. Zoom z follows the usual tile
+    convention: z=0 fits the whole image in one tile and z=max_zoom is full
+    resolution (level max_zoom - z).
+    """
+
+    def __init__(self, folder, file_path):
+        self.folder = folder
+        self.file_path = file_path
+        with open(os.path.join(folder, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.max_zoom = self.manifest["max_zoom"]
+        self.tile_size = self.manifest["tile_size"]
+
+    def level_shape(self, level):
+        factor = 2 ** level
+        return (-(-self.manifest["height"] // factor), -(-self.manifest["width"] // factor))
+
+    def _window(self, level, y0, y1, x0, x1):
+        if level == 0:
+            with ImageSource(self.file_path, self.manifest["format"], self.manifest["key"]) as source:
+                return source.read(y0, y1, x0, x1)
+        array = np.load(_level_path(self.folder, level), mmap_mode="r")
+        return np.array(array[y0:y1, x0:x1])
+
+    def tile(self, z, x, y):
+        """One tile (edge tiles are cropped to the image) as a float32 array."""
+        if not 0 <= z <= self.max_zoom:
+            raise TileError(f"z must be between 0 and {self.max_zoom}")
+        level = self.max_zoom - z
+        height, width = self.level_shape(level)
+        size = self.tile_size
+        if x < 0 or y < 0 or x * size >= width or y * size >= height:
+            raise TileError("Tile outside the image")
+        return self._window(level, y * size, min(height, (y + 1) * size), x * size, min(width, (x + 1) * size))
+
+    def pixel_box(self, ra_min, ra_max, dec_min, dec_max):
+        """Full-resolution pixel box (x0, x1, y0, y1) covering an RA/Dec box, via the FITS WCS."""
+        if self.manifest["format"] != "FITS":
+            raise TileError("World-coordinate cutouts need a FITS image with a WCS")
+        with ImageSource(self.file_path, "FITS", self.manifest["key"]) as source:
+            wcs = source.wcs()
+        if wcs is None:
+            raise TileError("Image has no celestial WCS")
+        # Edges are sampled, not just corners, since projected boxes curve
+        if ra_max < ra_min:
+            ra_max += 360.0
+        ra, dec = np.meshgrid(np.linspace(ra_min, ra_max, 9), np.linspace(dec_min, dec_max, 9))
+        px, py = wcs.celestial.all_world2pix(ra.ravel() % 360.0, dec.ravel(), 0)
+        ok = np.isfinite(px) & np.isfinite(py)
+        if not ok.any():
+            raise TileError("Box does not project onto the image")
+        return (int(np.floor(px[ok].min())), int(np.ceil(px[ok].max())) + 1,
+                int(np.floor(py[ok].min())), int(np.ceil(py[ok].max())) + 1)
+
+    def cutout(self, x0, x1, y0, y1, max_pixels=CUTOUT_MAX_PIXELS):
+        """
+        Pixel box (full-resolution coordinates, end-exclusive) clipped to the
+        image. Served from the finest level that keeps it within max_pixels.
+
+        Returns:
+            tuple: (float32 array, level, clipped box (x0, x1, y0, y1))
+        """
+        x0, x1 = max(0, x0), min(self.manifest["width"], x1)
+        y0, y1 = max(0, y0), min(self.manifest["height"], y1)
+        if x1 <= x0 or y1 <= y0:
+            raise TileError("Cutout does not overlap the image")
+        level = 0
+        while level < self.max_zoom and (x1 - x0) * (y1 - y0) / 4 ** level > max_pixels:
+            level += 1
+        factor = 2 ** level
+        window = self._window(level, y0 // factor, -(-y1 // factor), x0 // factor, -(-x1 // factor))
+        return window, level, (x0, x1, y0, y1)
+
+def open_pyramid(dataset):
+    """ImagePyramid of a Dataset row, or None if it has no image pyramid."""
+    if not dataset.tiles_path or not os.path.exists(os.path.join(dataset.tiles_path, MANIFEST)):
+        return None
+    return ImagePyramid(dataset.tiles_path, dataset.file_path)
@@ -0,0 +1,455 @@
+import glob
+import os
+import random
+import shutil
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, func
+import parsers.fits_parser as fits_parser
+import parsers.csv_parser as csv_parser
+import parsers.hdf5_parser as hdf5_parser
+from standardizer import ColumnStandardizer, cache_decisions, DECISION_CACHE_SIZE
+from ai_engine import AnomalyDetector, SpatialClusterer, cluster_insight, FIT_POOL_SIZE, SCORE_BATCH_SIZE, MODEL_DIR
+from parsers.streaming_stats import RowReservoir
+from predictor import DataCompleter
+from quality_assurance import QualityScorer
+from persistence import StandardizedRowWriter, write_predictions
+from columnar_store import ColumnarWriter, dataset_dir as columnar_dir
+from sky_lod import LodPyramid
+from image_tiles import build_pyramid, dataset_dir as tiles_dir
+from report_generator import count_annotations, row_count
+from sky_index import valid_sky
+from database import SessionLocal, engine
+import models
+
+SUPPORTED_EXTENSIONS = ('.fits', '.csv', '.h5', '.hdf5')
+
+def is_supported(filename):
+    return filename.endswith(SUPPORTED_EXTENSIONS)
+
+def find_cached_result(db, content_hash):
+    """Upload result of the latest completed ingestion of identical content, if any."""
+    dataset = db.query(models.Dataset).filter(
+        models.Dataset.content_hash == content_hash
+    ).order_by(models.Dataset.id.desc()).first()
+    if dataset and dataset.result_json:
+        return dataset.result_json
+    return None
+
+def init_worker():
+    """
+    Process-pool initializer: drop connections inherited from the parent so
+    each worker opens its own, then warm the standardizer cache.
+    """
+    engine.dispose(close=False)
+    with SessionLocal() as db:
+        warm_standardizer_cache(db)
+
+def warm_standardizer_cache(db, limit=DECISION_CACHE_SIZE):
+    """
+    Loads the most recent stored column decisions (one per normalized name
+    and threshold) into the process-wide standardizer cache, so schemas seen
+    before a restart still skip matching.
+    """
+    mm = models.MetadataMapping
+    latest = db.query(func.max(mm.id)).filter(
+        mm.fuzzy_threshold.isnot(None), mm.mapping_method != "override"
+    ).group_by(func.trim(func.lower(mm.original_column)), mm.fuzzy_threshold)
+    rows = db.query(
+        mm.original_column, mm.fuzzy_threshold, mm.standard_column, mm.mapping_method, mm.confidence_score
+    ).filter(mm.id.in_(latest.scalar_subquery())).order_by(mm.id.desc()).limit(limit).all()
+    # Oldest first, so the newest decisions end up most recently used
+    cache_decisions(tuple(r) for r in reversed(rows))
+
+def discard_dataset(db, dataset_id, columnar=None):
+    """
+    Removes everything a failed ingestion stored for a dataset (committed
+    row chunks, side tables, columnar copy, tiles, model), so partial rows
+    never show up in sky searches or cross-matches.
+    """
+    db.rollback()
+    for model in (models.Annotation, models.AnnotationCount, models.ImputedValue,
+                  models.MetadataMapping, models.StandardizedData):
+        db.query(model).filter(model.dataset_id == dataset_id).delete(synchronize_session=False)
+    db.query(models.Dataset).filter(models.Dataset.id == dataset_id).delete(synchronize_session=False)
+    db.commit()
+    # The id may be handed out again, so nothing keyed on it may survive
+    if columnar is not None:
+        columnar.close()
+    shutil.rmtree(columnar_dir(dataset_id), ignore_errors=True)
+    shutil.rmtree(tiles_dir(dataset_id), ignore_errors=True)
+    for path in glob.glob(os.path.join(MODEL_DIR, f"{AnomalyDetector.model_key(dataset_id, ['*'])}.joblib")):
+        os.remove(path)
+
+def run_ingestion(file_path, filename, content_hash=None, job_id=None, progress_queue=None):
+    """
+    Full ingestion pipeline for one uploaded file: parse, standardize, run the
+    AI/completion/QA passes chunk by chunk and persist everything.
+
+    Runs inside a worker process, so it owns its DB session. Stage progress
+    is pushed to `progress_queue` as {"job_id", "stage", "progress"} dicts.
+
+    Returns:
+        dict: The upload result (metadata, stats, preview, analyses, dataset id).
+    """
+    def report(stage, progress):
+        if progress_queue is not None:
+            progress_queue.put({"job_id": job_id, "stage": stage, "progress": round(progress, 3)})
+
+    db = SessionLocal()
+    dataset_id = columnar = stream = None
+    try:
+        # Determine file type and parse
+        report("parsing", 0.0)
+        result = {}
+        if filename.endswith('.fits'):
+            result = fits_parser.parse_fits(file_path, secondary_headers_only=True)
+        elif filename.endswith('.csv'):
+            # Statistics and row count fill in while the rows stream below
+            stream = csv_parser.CsvStream(file_path)
+            result = stream.result()
+            result["fit_sample"] = stream.fit_sample(FIT_POOL_SIZE)
+        elif filename.endswith('.h5') or filename.endswith('.hdf5'):
+            result = hdf5_parser.parse_hdf5(file_path)
+        else:
+            raise ValueError("Unsupported file format. Please upload FITS, CSV, or HDF5.")
+        # Stored under its content hash; report the name it was uploaded as
+        result["filename"] = filename
+
+        # Run Standardization Engine
+        report("standardizing", 0.1)
+        standardizer = ColumnStandardizer()
+
+        # Extract column names based on format
+        columns_to_process = []
+        if result.get("format") == "CSV" and "metadata" in result and "columns" in result["metadata"]:
+             columns_to_process = result["metadata"]["columns"]
+        elif result.get("format") == "FITS":
+             # For FITS, check if it's a table with columns
+             for hdu in result.get("hdus", []):
+                 if hdu.get("is_table") and hdu.get("columns"):
+                     columns_to_process = [c["name"] for c in hdu["columns"]]
+                     break
+        elif result.get("format") == "HDF5":
+             # Compound (table-like) HDF5 datasets expose their numeric fields
+             columns_to_process = result.get("statistics", {}).get("numeric_columns", [])
+
+        standardization_result = {}
+        if columns_to_process:
+             standardization_result = standardizer.standardize(columns_to_process)
+             result["standardization"] = standardization_result
+
+        # Rows flow through the pipeline in chunks: CSV files and FITS/HDF5
+        # tables stream every row, images hand over their sampled preview pixels
+        if result.get("format") == "CSV":
+            frames = stream.chunks()
+        elif result.get("format") == "FITS" and result.get("metadata", {}).get("columns"):
+            frames = fits_parser.iter_table_chunks(file_path)
+            result["fit_sample"] = fits_parser.table_fit_sample(file_path, FIT_POOL_SIZE)
+        elif result.get("format") == "HDF5" and result.get("statistics", {}).get("numeric_columns"):
+            dataset_name = result["statistics"]["dataset_name"]
+            frames = hdf5_parser.iter_table_chunks(file_path, dataset_name)
+            result["fit_sample"] = hdf5_parser.table_fit_sample(file_path, dataset_name, FIT_POOL_SIZE)
+        elif result.get("preview"):
+            frames = [pd.DataFrame(result["preview"])]
+        else:
+            frames = []
+
+        # Reports take the full-dataset row count from the stored statistics
+        if isinstance(result.get("statistics"), dict):
+            result["statistics"]["row_count"] = row_count(result.get("metadata"), result["statistics"])
+
+        # PROACTIVE: Save to DB
+        db_dataset = models.Dataset(
+            filename=filename,
+            format=result.get("format"),
+            file_path=file_path,
+            file_size=os.path.getsize(file_path),
+            content_hash=content_hash,
+            metadata_json=result.get("metadata"),
+            statistics_json=result.get("statistics")
+        )
+        db.add(db_dataset)
+        db.commit()
+        db.refresh(db_dataset)
+        dataset_id = db_dataset.id
+
+        # PROACTIVE: Save Metadata Mappings
+        if "standardization" in result and "log" in result["standardization"]:
+            for log_entry in result["standardization"]["log"]:
+                db_mapping = models.MetadataMapping(
+                    dataset_id=db_dataset.id,
+                    original_column=log_entry["original_column"],
+                    standard_column=log_entry["standardized_column"],
+                    confidence_score=log_entry["confidence_score"],
+                    mapping_method=log_entry["method"],
+                    fuzzy_threshold=standardizer.threshold
+                )
+                db.add(db_mapping)
+
+        # Column -> standard mapping is resolved once per dataset by the writer;
+        # rows go to SQL and to the dataset's columnar (Arrow) copy
+        columnar = ColumnarWriter(db_dataset.id)
+        row_writer = StandardizedRowWriter(
+            db, db_dataset.id, result.get("standardization"), result.get("metadata"), columnar=columnar
+        )
+
+        # One model per dataset: fitted on a stratified subsample of the parser's
+        # whole-file pool (else on the leading chunk), then every chunk is scored with it
+        detector = AnomalyDetector()
+        fit_sample = result.pop("fit_sample", None)
+        if fit_sample is not None and len(fit_sample) > 10:
+            detector.fit(fit_sample)
+        # Sky catalogs are clustered over every row as chunks stream past;
+        # anything else (pixel previews) is clustered inside analyze()
+        clusterer = None
+        # ...and binned into the HEALPix level-of-detail pyramid served to sky maps
+        lod = None
+        completer = DataCompleter()
+        scorer = QualityScorer()
+        ai_result = {}
+        # Predictions go to the imputed_values side table; the response only
+        # carries (columnar) the ones that touch preview rows
+        completion_result = {"has_missing": False, "missing_stats": {}, "stored": 0, "predictions": []}
+        preview_row_ids = np.array([row.get("id") for row in result.get("preview", [])])
+        preview_id_set = set(preview_row_ids.tolist())
+
+        total_rows = max(1, result.get("statistics", {}).get("row_count") or len(result.get("preview", [])))
+        rows_done = 0
+        report("analyzing", 0.15)
+
+        for frame in frames:
+            row_ids = frame["id"].to_numpy()
+
+            # Run AI Anomaly Detection (ids mapped back to global row ids)
+            chunk_anomalies = set()
+            if len(frame) > 10 and not ai_result:
+                positions = frame[["x", "y"]].dropna()
+                if len(positions) and valid_sky(positions["x"], positions["y"]).all():
+                    clusterer = SpatialClusterer()
+                    lod = LodPyramid()
+                # Insights describe the leading chunk, which holds the preview
+                chunk_ai = detector.analyze(frame, cluster=clusterer is None)
+                chunk_anomalies = set(row_ids[chunk_ai.get("anomalies", [])].tolist())
+                # Only the count and the preview rows' ids are kept; every
+                # flag is persisted with its row by the writer
+                ai_result = {
+                    "anomalies": [],
+                    "anomalies_count": 0,
+                    "clusters": chunk_ai.get("clusters", []),
+                    "insights": chunk_ai.get("insights", [])
+                }
+            elif detector.model is not None:
+                features = frame[detector.feature_cols].to_numpy(dtype=np.float64, na_value=np.nan)
+                chunk_anomalies = set(row_ids[detector.predict(features)].tolist())
+            if ai_result:
+                ai_result["anomalies_count"] += len(chunk_anomalies)
+                ai_result["anomalies"].extend(sorted(a for a in chunk_anomalies if a in preview_id_set))
+            if clusterer is not None:
+                clusterer.update(frame["x"], frame["y"])
+            if lod is not None:
+                lod.update(*(
+                    frame[c].to_numpy(dtype=np.float64, na_value=np.nan) if c in frame.columns else np.full(len(frame), np.nan)
+                    for c in ("x", "y", "value")
+                ))
+
+            # Run Predictive Completion (if gaps exist)
+            chunk_completion = completer.analyze_and_predict(frame.reset_index(drop=True), columnar=True)
+            if chunk_completion.get("has_missing"):
+                completion_result["has_missing"] = True
+                completion_result.setdefault("gap_type", chunk_completion["gap_type"])
+                for col, count in chunk_completion["missing_stats"].items():
+                    completion_result["missing_stats"][col] = completion_result["missing_stats"].get(col, 0) + count
+                predictions = chunk_completion["predictions"]
+                predictions["id"] = row_ids[predictions["id"]]
+                completion_result["stored"] += write_predictions(
+                    db, db_dataset.id, predictions, chunk_completion["gap_type"]
+                )
+                in_preview = np.isin(predictions["id"], preview_row_ids)
+                if in_preview.any():
+                    completion_result["predictions"].append({k: v[in_preview] for k, v in predictions.items()})
+
+            # Run Data Quality Assurance
+            scorer.update(frame)
+
+            # PROACTIVE: Save Standardized Data (rows) in bulk
+            row_writer.write_frame(frame, chunk_anomalies)
+
+            # Commit per chunk so the session never holds the whole file
+            db.commit()
+            rows_done += len(frame)
+            done = stream.progress if stream is not None else rows_done / total_rows
+            report("analyzing", 0.15 + 0.75 * min(1.0, done))
+
+        if stream is not None:
+            parsed = stream.result()
+            parsed["statistics"]["row_count"] = row_count(parsed["metadata"], parsed["statistics"])
+            result["metadata"], result["statistics"] = parsed["metadata"], parsed["statistics"]
+            db_dataset.metadata_json = result["metadata"]
+            db_dataset.statistics_json = result["statistics"]
+
+        db_dataset.columnar_path = columnar.close()
+        if lod is not None:
+            lod.write(db_dataset.columnar_path)
+
+        # Images get a mip pyramid so tiles/cutouts never touch more than a window
+        if result.get("format") in ("FITS", "HDF5"):
+            report("tiling", 0.9)
+            db_dataset.tiles_path = build_pyramid(
+                db_dataset.id, file_path, result["format"],
+                report=lambda done: report("tiling", 0.9 + 0.05 * done)
+            )
+
+        if clusterer is not None:
+            n_clusters, ai_result["clusters"] = clusterer.summaries()
+            insight = cluster_insight(n_clusters)
+            if insight:
+                ai_result["insights"].insert(0, insight)
+        if detector.model is not None:
+            detector.save(AnomalyDetector.model_key(db_dataset.id, detector.feature_cols))
+        if ai_result:
+            result["ai_analysis"] = ai_result
+        if completion_result["has_missing"]:
+            parts = completion_result["predictions"]
+            completion_result["predictions"] = {
+                key: np.concatenate([part[key] for part in parts]).tolist() if parts else []
+                for key in ("id", "column", "predicted_value", "confidence")
+            }
+            result["predictions"] = completion_result
+
+        if "preview" in result:
+             result["quality_report"] = scorer.report(result.get("metadata", {}), ai_result)
+
+             # PROACTIVE: Inject AI labels into preview for frontend display
+             anomalies = set(ai_result.get("anomalies", []))
+             for row in result["preview"]:
+                 if row.get("id") in anomalies:
+                     row["status"] = "anomaly"
+                 elif "status" not in row:
+                     row["status"] = "valid"
+
+        # Ids are captured before standardized renaming may move the "id" key
+        preview_ids = [row.get("id") for row in result.get("preview", [])]
+
+        # Update preview item keys for frontend display (Optional but recommended)
+        if "standardization" in result and "mapping" in result["standardization"]:
+            # Resolve renames once; the first log entry for a column wins
+            renames = {}
+            for log_entry in result["standardization"]["log"]:
+                renames.setdefault(log_entry["original_column"], log_entry["standardized_column"])
+            for item in result.get("preview", []):
+                # Create a copy of original keys to avoid modifying dict during iteration
+                for orig_key in list(item.keys()):
+                    standard_key = renames.get(orig_key)
+                    if standard_key and standard_key != orig_key: # Only rename if different
+                        item[standard_key] = item.pop(orig_key)
+
+        db.commit()
+
+        # Add DB ID to result
+        result["id"] = db_dataset.id
+        # Cached for re-uploads of the same content
+        db_dataset.result_json = result
+        db.commit()
+
+        # --- PROACTIVE: GENERATE DEMO ANNOTATIONS ---
+        report("annotating", 0.95)
+        # Pick 3 random points to flag (if more than 10)
+        if len(result.get("preview", [])) > 10:
+            sample_indices = random.sample(range(len(result["preview"])), 3)
+            demo_flags = [
+                ('verified', "Signal confirmed by multiple sensors. Looks solid."),
+                ('suspicious', "Unusual peak here. Possibly a cosmic ray strike?"),
+                ('quality_issue', "Sensor calibration error detected during this timestamp.")
+            ]
+            # One (dataset_id, original_id) lookup for all flagged rows
+            flagged = [str(preview_ids[idx]) for idx in sample_indices]
+            row_ids = dict(db.query(models.StandardizedData.original_id, models.StandardizedData.id).filter(
+                models.StandardizedData.dataset_id == db_dataset.id,
+                models.StandardizedData.original_id.in_(flagged)
+            ).order_by(models.StandardizedData.id.desc()).all())
+            flag_types = []
+            for original_id, (ftype, comment) in zip(flagged, demo_flags):
+                if original_id in row_ids:
+                    db_ann = models.Annotation(
+                        dataset_id=db_dataset.id,
+                        data_object_id=row_ids[original_id],
+                        user_id="SystemAI",
+                        flag_type=ftype,
+                        comment=comment
+                    )
+                    db.add(db_ann)
+                    flag_types.append(ftype)
+            count_annotations(db, db_dataset.id, flag_types)
+            db.commit()
+
+        report("completed", 1.0)
+        return result
+    except Exception:
+        if dataset_id is not None:
+            discard_dataset(db, dataset_id, columnar)
+        raise
+    finally:
+        if stream is not None:
+            stream.close()
+        db.close()
+
+# Stored columns behind the detector's value/x/y features
+DETECTOR_COLUMNS = {"value": "brightness", "x": "ra", "y": "dec"}
+
+def run_rescore(dataset_id, job_id=None, progress_queue=None):
+    """
+    Re-scores every stored row of a dataset with its persisted anomaly model,
+    so re-analysis and rows appended later need no refit. Datasets ingested
+    before models were persisted get one fitted on a sample of their rows.
+
+    Returns:
+        dict: {"dataset_id", "rows", "anomalies", "refitted"}
+    """
+    def report(stage, progress):
+        if progress_queue is not None:
+            progress_queue.put({"job_id": job_id, "stage": stage, "progress": round(progress, 3)})
+
+    db = SessionLocal()
+    try:
+        col = models.StandardizedData
+        feature_cols = list(DETECTOR_COLUMNS)
+        query = db.query(
+            col.id, *[getattr(col, DETECTOR_COLUMNS[c]).label(c) for c in feature_cols]
+        ).filter(col.dataset_id == dataset_id).order_by(col.id)
+
+        def batches():
+            return pd.read_sql(query.statement, db.connection(), chunksize=SCORE_BATCH_SIZE)
+
+        report("loading", 0.0)
+        detector = AnomalyDetector()
+        key = AnomalyDetector.model_key(dataset_id, feature_cols)
+        refitted = not detector.load(key)
+        if refitted:
+            sample = RowReservoir(FIT_POOL_SIZE)
+            for batch in batches():
+                sample.update(batch[feature_cols].to_numpy(dtype=np.float64, na_value=np.nan))
+            if len(sample.sample) <= 10:
+                return {"dataset_id": dataset_id, "rows": 0, "anomalies": 0, "refitted": False}
+            detector.fit(sample.sample, feature_cols)
+            detector.save(key)
+
+        report("scoring", 0.2)
+        total = max(1, query.count())
+        rows = anomalies = 0
+        set_type = col.__table__.update().where(col.__table__.c.id == bindparam("row_id"))
+        for batch in batches():
+            flags = detector.predict(batch[detector.feature_cols].to_numpy(dtype=np.float64, na_value=np.nan))
+            db.execute(set_type, [
+                {"row_id": int(i), "object_type": "ANOMALY" if f else None}
+                for i, f in zip(batch["id"], flags)
+            ])
+            rows += len(batch)
+            anomalies += int(flags.sum())
+            report("scoring", 0.2 + 0.8 * min(1.0, rows / total))
+        db.commit()
+
+        report("completed", 1.0)
+        return {"dataset_id": dataset_id, "rows": rows, "anomalies": anomalies, "refitted": refitted}
+    finally:
+        db.close()
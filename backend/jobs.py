@@ -0,0 +1,202 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Any
+from database import run_db
+from socket_manager import sio
+from ingestion import run_ingestion, init_worker
+from report_export import run_report_export, artifact_name
+import models
+
+# Concurrent jobs (one process each); extra jobs wait in the pool queue
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 2))
+# Finished jobs kept for GET /jobs/{id}
+JOB_HISTORY = 500
+# Job record fields stored as columns of models.Job (the result goes to result_json)
+JOB_FIELDS = ("id", "kind", "filename", "content_hash", "cached", "status", "stage",
+              "progress", "created_at", "finished_at", "dataset_id", "error")
+ACTIVE = ("queued", "running")
+
+def store_job(db, job):
+    db.merge(models.Job(result_json=job["result"], **{k: job[k] for k in JOB_FIELDS}))
+    db.commit()
+
+def store_progress(db, job_id, stage, progress):
+    # Never overwrites a finished job, whichever write lands last
+    db.query(models.Job).filter(models.Job.id == job_id, models.Job.status.in_(ACTIVE)).update(
+        {"status": "running", "stage": stage, "progress": progress}, synchronize_session=False
+    )
+    db.commit()
+
+def _job_record(row):
+    return dict({k: getattr(row, k) for k in JOB_FIELDS}, result=row.result_json)
+
+def load_job(db, job_id):
+    row = db.get(models.Job, job_id)
+    return _job_record(row) if row else None
+
+def find_active_job(db, kind, filename=None, content_hash=None):
+    """Oldest queued/running job of a kind for the same file or content, on any worker."""
+    query = db.query(models.Job).filter(models.Job.kind == kind, models.Job.status.in_(ACTIVE))
+    if filename is not None:
+        query = query.filter(models.Job.filename == filename)
+    if content_hash is not None:
+        query = query.filter(models.Job.content_hash == content_hash)
+    row = query.order_by(models.Job.created_at).first()
+    return _job_record(row) if row else None
+
+def prune_jobs(db, keep=JOB_HISTORY):
+    """Drops finished jobs beyond the newest `keep`."""
+    stale = db.query(models.Job.id).filter(~models.Job.status.in_(ACTIVE)).order_by(
+        models.Job.created_at.desc()
+    ).offset(keep)
+    db.query(models.Job).filter(models.Job.id.in_(stale.scalar_subquery())).delete(synchronize_session=False)
+    db.commit()
+
+class JobManager:
+    """
+    Runs heavy work (ingestion, cross-matching) in a process pool so the
+    event loop (and Socket.IO traffic) never waits on parsing or ML work.
+
+    Job functions are called as func(*args, job_id=..., progress_queue=...)
+    and report stage progress through that managed queue; a listener task
+    mirrors it into the job table and broadcasts it over Socket.IO.
+
+    Job records live in the jobs table, so every worker process serves any
+    job and sees in-flight work of the others when deduplicating. Jobs run
+    by this process are also kept in memory with their task.
+    """
+
+    def __init__(self, max_workers=INGEST_WORKERS):
+        self.max_workers = max_workers
+        # Jobs running in this process: job_id -> { "id", "filename", "status", "stage", "progress", ... }
+        self.jobs: Dict[str, Any] = {}
+        self._executor = None
+        self._manager = None
+        self._progress = None
+        self._listener = None
+
+    def _ensure_started(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_worker)
+            self._manager = multiprocessing.Manager()
+            self._progress = self._manager.Queue()
+            self._listener = asyncio.create_task(self._forward_progress())
+
+    async def submit_ingestion(self, file_path: str, filename: str, content_hash: str = None):
+        """
+        Queues a file for ingestion and returns the new job record. A file
+        whose content is already being ingested joins that job instead.
+        """
+        if content_hash:
+            job = await run_db(find_active_job, "ingestion", None, content_hash)
+            if job:
+                return self.public(job)
+        return await self.submit(
+            "ingestion", run_ingestion, file_path, filename, content_hash,
+            filename=filename, content_hash=content_hash
+        )
+
+    async def submit_report(self, dataset_id: int, version: int, fmt: str):
+        """
+        Queues a report export; a render of the same dataset version and
+        format that is still in flight is shared instead.
+        """
+        artifact = artifact_name(dataset_id, version, fmt)
+        job = await run_db(find_active_job, "report", artifact)
+        if job:
+            return self.public(job)
+        return await self.submit("report", run_report_export, dataset_id, fmt, filename=artifact)
+
+    async def cached(self, kind: str, result, filename: str = None, content_hash: str = None):
+        """Records an already-finished job (e.g. a deduplicated upload) so it can be polled like any other."""
+        await run_db(prune_jobs)
+        now = datetime.utcnow().isoformat()
+        job = self._record(kind, filename, content_hash)
+        job.update(status="completed", stage="completed", progress=1.0, finished_at=now,
+                   dataset_id=result.get("id"), result=result, cached=True)
+        await run_db(store_job, job)
+        return self.public(job)
+
+    def _record(self, kind, filename, content_hash):
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "filename": filename,
+            "content_hash": content_hash,
+            "cached": False,
+            "status": "queued",
+            "stage": "queued",
+            "progress": 0.0,
+            "created_at": datetime.utcnow().isoformat(),
+            "finished_at": None,
+            "dataset_id": None,
+            "error": None,
+            "result": None
+        }
+        return job
+
+    async def submit(self, kind: str, func, *args, filename: str = None, content_hash: str = None):
+        """Queues func(*args) in the worker pool and returns the new job record."""
+        self._ensure_started()
+        await run_db(prune_jobs)
+
+        job = self._record(kind, filename, content_hash)
+        await run_db(store_job, job)
+        self.jobs[job["id"]] = job
+        call = functools.partial(func, *args, job_id=job["id"], progress_queue=self._progress)
+        job["_task"] = asyncio.create_task(self._run(job, call))
+        return self.public(job)
+
+    async def get(self, job_id: str):
+        job = self.jobs.get(job_id) or await run_db(load_job, job_id)
+        return self.public(job) if job else None
+
+    def public(self, job, include_result=True):
+        """Job record without internal fields (and optionally without the result)."""
+        hidden = {"_task"} if include_result else {"_task", "result"}
+        return {k: v for k, v in job.items() if k not in hidden}
+
+    async def _run(self, job, call):
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._executor, call)
+            job.update(status="completed", stage="completed", progress=1.0, result=result,
+                       finished_at=datetime.utcnow().isoformat())
+            if job["kind"] in ("ingestion", "report"):
+                job["dataset_id"] = result.get("id")
+            await run_db(store_job, job)
+            await sio.emit('job_completed', self.public(job, include_result=False))
+        except Exception as e:
+            job.update(status="failed", stage="failed", error=str(e), finished_at=datetime.utcnow().isoformat())
+            await run_db(store_job, job)
+            await sio.emit('job_failed', self.public(job, include_result=False))
+        finally:
+            self.jobs.pop(job["id"], None)
+
+    async def _forward_progress(self):
+        """Relays worker progress events to the job table and Socket.IO."""
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await loop.run_in_executor(None, self._progress.get)
+            if event is None:
+                break
+            job = self.jobs.get(event["job_id"])
+            if job and job["status"] in ACTIVE:
+                job.update(status="running", stage=event["stage"], progress=event["progress"])
+                await run_db(store_progress, job["id"], event["stage"], event["progress"])
+            await sio.emit('job_progress', event)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._progress.put(None)
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._manager.shutdown()
+            self._executor = None
+
+job_manager = JobManager()
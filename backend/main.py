@@ -1,24 +1,32 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Response, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.middleware.gzip import DEFAULT_EXCLUDED_CONTENT_TYPES
+from fastapi.responses import JSONResponse, FileResponse
 import os
-import shutil
-import parsers.fits_parser as fits_parser
-import parsers.csv_parser as csv_parser
-import parsers.hdf5_parser as hdf5_parser
-from report_generator import research_report_generator
-from standardizer import ColumnStandardizer
-from ai_engine import AnomalyDetector
-from predictor import DataCompleter
-from quality_assurance import QualityScorer
-import pandas as pd
+import asyncio
+import secrets
+from report_generator import cached_report, count_annotations
+from report_export import artifact_name, artifact_path, EXPORT_FORMATS, MEDIA_TYPES
+from ingestion import is_supported, run_rescore, find_cached_result
+from uploads import receive_upload, ChunkedUploads, UploadTooLarge, UploadConflict
+from jobs import job_manager
+from crossmatch import run_crossmatch
 from typing import List
-from database import engine, get_db
+from database import engine, get_db, run_db
+from migrations import pending_migrations
+from sky_index import cone_search, box_search, sky_tree_cache, CONE_MAX_RADIUS_ARCSEC, SEARCH_MAX_LIMIT
+import numpy as np
+from columnar_store import open_dataset, regions_for_box, NUMERIC_COLUMNS
+from row_query import query_rows, InvalidQuery
+from sky_lod import query_lod, LOD_MAX_BINS
+from image_tiles import open_pyramid, TileError
+import pyarrow as pa
 import models
 from sqlalchemy.orm import Session
 from fastapi import Depends
 import socketio
-from socket_manager import sio
+from socket_manager import sio, manager as collab_manager
 from chat_engine import ChatEngine
 from pydantic import BaseModel
 
@@ -28,8 +36,6 @@ chat_engine = ChatEngine()
 class ChatRequest(BaseModel):
     message: str
 
-models.Base.metadata.create_all(bind=engine)
-
 app = FastAPI(
     title="COSMIC Data Fusion API",
     description="Unified Astronomical Data Processing Platform",
@@ -43,10 +49,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Image-Shape", "X-Image-Level", "X-Cutout-Box"],
+)
+# Raw float32 pixels of image tiles/cutouts
+PIXELS_TYPE = "application/octet-stream"
+# Large JSON payloads (previews, row pages) are gzipped for clients that accept it;
+# noisy float pixels barely compress, so they skip it
+app.add_middleware(
+    GZipMiddleware, minimum_size=4096, exclude_content_types=DEFAULT_EXCLUDED_CONTENT_TYPES + (PIXELS_TYPE,)
 )
 
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+chunked_uploads = ChunkedUploads(UPLOAD_FOLDER)
 
 @app.get("/")
 async def root():
@@ -57,204 +72,135 @@ async def chat(request: ChatRequest):
     response = await chat_engine.generate_response(request.message)
     return {"response": response}
 
-@app.post("/upload")
-async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    try:
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        
-        # Save file locally
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # Determine file type and parse
-        result = {}
-        if file.filename.endswith('.fits'):
-            result = fits_parser.parse_fits(file_path)
-        elif file.filename.endswith('.csv'):
-            result = csv_parser.parse_csv(file_path)
-        elif file.filename.endswith('.h5') or file.filename.endswith('.hdf5'):
-            result = hdf5_parser.parse_hdf5(file_path)
-        else:
-            return JSONResponse(
-                status_code=400, 
-                content={"message": "Unsupported file format. Please upload FITS, CSV, or HDF5."}
-            )
-            
-        # Run Standardization Engine
-        standardizer = ColumnStandardizer()
-        
-        # Extract column names based on format
-        columns_to_process = []
-        if result.get("format") == "CSV" and "metadata" in result and "columns" in result["metadata"]:
-             columns_to_process = result["metadata"]["columns"]
-        elif result.get("format") == "FITS":
-             # For FITS, check if it's a table with columns
-             for hdu in result.get("hdus", []):
-                 if hdu.get("is_table") and hdu.get("columns"):
-                     columns_to_process = [c["name"] for c in hdu["columns"]]
-                     break
-                     
-        standardization_result = {}
-        if columns_to_process:
-             standardization_result = standardizer.standardize(columns_to_process)
-             result["standardization"] = standardization_result
-
-        # Run AI Anomaly Detection (on preview data for MVP speed)
-        ai_result = {}
-        if "preview" in result and len(result["preview"]) > 10:
-             detector = AnomalyDetector()
-             ai_result = detector.analyze(result["preview"])
-             result["ai_analysis"] = ai_result
-
-        # Run Predictive Completion (if gaps exist)
-        completer = DataCompleter()
-        # Check preview for now (fastest), ideally check full dataset
-        if "preview" in result:
-             completion_result = completer.analyze_and_predict(result["preview"])
-             if completion_result["has_missing"]:
-                 result["predictions"] = completion_result
-
-        # Run Data Quality Assurance
-        if "preview" in result:
-             df_proxy = pd.DataFrame(result["preview"])
-             scorer = QualityScorer()
-             quality_report = scorer.analyze(df_proxy, result.get("metadata", {}), ai_result)
-             result["quality_report"] = quality_report
-             
-             # PROACTIVE: Inject AI labels into preview for frontend display
-             anomalies = ai_result.get("anomalies", [])
-             for row in result["preview"]:
-                 if row.get("id") in anomalies:
-                     row["status"] = "anomaly"
-                 elif "status" not in row:
-                     row["status"] = "valid"
-
-        # PROACTIVE: Save to DB
-        db_dataset = models.Dataset(
-            filename=file.filename,
-            format=result.get("format"),
-            file_path=file_path,
-            metadata_json=result.get("metadata"),
-            statistics_json=result.get("statistics")
+async def _start_ingestion(response, file_path, filename, content_hash):
+    # Identical content was ingested before: answer with its stored result
+    cached = await run_db(find_cached_result, content_hash)
+    if cached is not None:
+        response.status_code = 200
+        return await job_manager.cached("ingestion", cached, filename, content_hash)
+
+    # Parsing, AI passes and DB writes run in the ingestion worker pool;
+    # progress is broadcast as 'job_progress' and polled via GET /jobs/{id}
+    return await job_manager.submit_ingestion(file_path, filename, content_hash)
+
+@app.post("/upload", status_code=202)
+async def upload_file(response: Response, file: UploadFile = File(...)):
+    """ Single-request upload. The multipart body is spooled before this runs; large files should use /uploads. """
+    if not is_supported(file.filename):
+        return JSONResponse(
+            status_code=400, 
+            content={"message": "Unsupported file format. Please upload FITS, CSV, or HDF5."}
         )
-        db.add(db_dataset)
-        db.commit()
-        db.refresh(db_dataset)
-        
-        # PROACTIVE: Save Metadata Mappings
-        if "standardization" in result and "log" in result["standardization"]:
-            for log_entry in result["standardization"]["log"]:
-                db_mapping = models.MetadataMapping(
-                    dataset_id=db_dataset.id,
-                    original_column=log_entry["original_column"],
-                    standard_column=log_entry["standardized_column"],
-                    confidence_score=log_entry["confidence_score"],
-                    mapping_method=log_entry["method"]
-                )
-                db.add(db_mapping)
-
-        # PROACTIVE: Save Standardized Data (rows)
-        # We use the 'preview' data as a proxy for the simplified table rows for this MVP
-        if "preview" in result:
-             for item in result["preview"]:
-                 # Map preview keys to DB columns
-                 # Preview has x(RA), y(Dec), value(Brightness)
-                     # Apply standardization to preview item for consistent frontend display
-                     # and to find the temperature column
-                     
-                     # Helper to find value by standard name
-                     def get_val_by_standard(standard_key, default=None):
-                         # 1. Check if key exists directly (already standardized)
-                         if standard_key in item:
-                             return item[standard_key]
-                         
-                         # 2. Check via mapping
-                         if "standardization" in result and "mapping" in result["standardization"]:
-                             for orig, std in result["standardization"]["mapping"].items():
-                                 if std == standard_key and orig in item:
-                                     return item[orig]
-                         return default
-
-                     db_obj = models.StandardizedData(
-                         dataset_id=db_dataset.id,
-                         original_id=str(item.get("id")),
-                         ra=item.get("x"),   # Assuming preview mapping logic handled RA->x
-                         dec=item.get("y"),  # Assuming preview mapping logic handled Dec->y
-                         brightness=item.get("value"),
-                         # Captured Standardized Fields
-                         temperature=get_val_by_standard("temperature"),
-                         velocity=get_val_by_standard("velocity"),
-                         redshift=get_val_by_standard("redshift"),
-                         
-                         # Set defaults or N/A for others for now
-                         brightness_unit=result.get("metadata", {}).get("BUNIT", "unknown"),
-                         # PROACTIVE: Store AI flags if detected
-                         object_type="ANOMALY" if "ai_analysis" in result and item.get("id") in result["ai_analysis"].get("anomalies", []) else None
-                     )
-                     
-                     # Update preview item keys for frontend display (Optional but recommended)
-                     if "standardization" in result and "mapping" in result["standardization"]:
-                         # Create a copy of original keys to avoid modifying dict during iteration
-                         original_keys = list(item.keys())
-                         for orig_key in original_keys:
-                             # Find if this original key has a standardized mapping
-                             for log_entry in result["standardization"]["log"]:
-                                 if log_entry["original_column"] == orig_key:
-                                     standard_key = log_entry["standardized_column"]
-                                     if standard_key != orig_key: # Only rename if different
-                                         item[standard_key] = item.pop(orig_key)
-                                     break # Found mapping for this original key, move to next
-                     
-                     db.add(db_obj)
-        
-        db.commit()
-        
-        # Add DB ID to result
-        result["id"] = db_dataset.id
-
-        # --- PROACTIVE: GENERATE DEMO ANNOTATIONS ---
-        # Pick 3 random points to flag (if more than 10)
-        if len(result.get("preview", [])) > 10:
-            import random
-            sample_indices = random.sample(range(len(result["preview"])), 3)
-            demo_flags = [
-                ('verified', "Signal confirmed by multiple sensors. Looks solid."),
-                ('suspicious', "Unusual peak here. Possibly a cosmic ray strike?"),
-                ('quality_issue', "Sensor calibration error detected during this timestamp.")
-            ]
-            for idx, (ftype, comment) in zip(sample_indices, demo_flags):
-                data_point = result["preview"][idx]
-                # Find standard_data ID
-                data_row = db.query(models.StandardizedData).filter(
-                    models.StandardizedData.dataset_id == db_dataset.id,
-                    models.StandardizedData.original_id == str(data_point["id"])
-                ).first()
-                if data_row:
-                    db_ann = models.Annotation(
-                        dataset_id=db_dataset.id,
-                        data_object_id=data_row.id,
-                        user_id="SystemAI",
-                        flag_type=ftype,
-                        comment=comment
-                    )
-                    db.add(db_ann)
-            db.commit()
-
-        return result
-        
+
+    try:
+        # Copy to disk off the event loop, stored under its content hash
+        file_path, content_hash, _ = await receive_upload(file, UPLOAD_FOLDER)
+        return await _start_ingestion(response, file_path, file.filename, content_hash)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         # In a real app, log the error
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- RESUMABLE (CHUNKED) UPLOADS ---
+
+@app.post("/uploads", status_code=201)
+async def create_chunked_upload(filename: str, size: int):
+    """ Opens a resumable upload; send the bytes with PATCH /uploads/{id}. """
+    if not is_supported(filename):
+        raise HTTPException(status_code=400, detail="Unsupported file format. Please upload FITS, CSV, or HDF5.")
+    if size <= 0:
+        raise HTTPException(status_code=400, detail="size must be positive")
+    try:
+        return chunked_uploads.create(filename, size)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+@app.get("/uploads/{upload_id}")
+async def get_chunked_upload(upload_id: str):
+    """ Current offset of a resumable upload (where the next chunk must start). """
+    status = chunked_uploads.status(upload_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return status
+
+@app.patch("/uploads/{upload_id}")
+async def append_chunked_upload(upload_id: str, request: Request, upload_offset: int = Header(...)):
+    """ Appends the raw request body at Upload-Offset, streamed straight to disk. """
+    try:
+        status = await chunked_uploads.append(upload_id, upload_offset, request.stream())
+    except UploadConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if status is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return status
+
+@app.post("/uploads/{upload_id}/complete", status_code=202)
+async def complete_chunked_upload(upload_id: str, response: Response):
+    """ Finalizes a fully received upload and queues its ingestion (same reply as POST /upload). """
+    try:
+        completed = await chunked_uploads.complete(upload_id)
+    except UploadConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if completed is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    filename, file_path, content_hash, _ = completed
+    return await _start_ingestion(response, file_path, filename, content_hash)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.on_event("startup")
+def check_schema():
+    # Schema changes run once per deploy (python migrations.py), not per worker
+    pending = pending_migrations(engine)
+    if pending:
+        print(f"Warning: migrations {pending} are not applied; run `python migrations.py`")
+
+@app.on_event("shutdown")
+def shutdown_jobs():
+    job_manager.shutdown()
+
+# --- COLLABORATION SESSIONS ---
+
+@app.post("/sessions", status_code=201)
+def create_session(db: Session = Depends(get_db)):
+    """ Opens a new analysis session; clients join its room with {"session": token}. """
+    session = models.AnalysisSession(session_token=secrets.token_urlsafe(12), active_users_json=[], view_state_json={})
+    db.add(session)
+    db.commit()
+    db.refresh(session)
+    return {"token": session.session_token, "created_at": session.created_at}
+
+def _load_session(db, token):
+    session = db.query(models.AnalysisSession).filter(models.AnalysisSession.session_token == token).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"token": session.session_token, "created_at": session.created_at}
+
+@app.get("/sessions/{token}")
+async def get_session(token: str):
+    """ Session info with its live members and view (from the stores shared by all workers). """
+    session = await run_db(_load_session, token)
+    session["view_state"], session["view_seq"] = await collab_manager.views.state(token)
+    session["active_users"] = await collab_manager.get_room_users(token)
+    return session
+
 # --- ANNOTATIONS & COLLABORATION ---
 
 @app.get("/datasets/{dataset_id}/annotations")
-async def get_annotations(dataset_id: int, db: Session = Depends(get_db)):
+def get_annotations(dataset_id: int, db: Session = Depends(get_db)):
     annotations = db.query(models.Annotation).filter(models.Annotation.dataset_id == dataset_id).all()
     return annotations
 
 @app.post("/annotations")
-async def create_annotation(
+def create_annotation(
     dataset_id: int,
     data_object_id: str, # original_id or id
     user_id: str,
@@ -284,6 +230,7 @@ async def create_annotation(
         comment=comment
     )
     db.add(db_annotation)
+    count_annotations(db, dataset_id, [flag_type])
     db.commit()
     db.refresh(db_annotation)
     
@@ -293,7 +240,7 @@ async def create_annotation(
     return db_annotation
 
 @app.get("/quality-feed")
-async def get_quality_feed(limit: int = 10, db: Session = Depends(get_db)):
+def get_quality_feed(limit: int = 10, db: Session = Depends(get_db)):
     """ Returns recent annotations across all datasets for a global activity feed. """
     results = db.query(
         models.Annotation, 
@@ -314,25 +261,352 @@ async def get_quality_feed(limit: int = 10, db: Session = Depends(get_db)):
         })
     return feed
 
+# --- SKY QUERIES ---
+
+@app.get("/sky/cone")
+def sky_cone_search(
+    ra: float,
+    dec: float,
+    radius_arcsec: float,
+    dataset_id: int = None,
+    limit: int = 1000,
+    db: Session = Depends(get_db)
+):
+    """ Objects within radius_arcsec of (ra, dec), nearest first, across all datasets or one. """
+    if not (0 <= ra <= 360 and -90 <= dec <= 90) or not 0 < radius_arcsec <= CONE_MAX_RADIUS_ARCSEC:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Expected 0<=ra<=360, -90<=dec<=90 and 0<radius_arcsec<={CONE_MAX_RADIUS_ARCSEC:g}"
+        )
+    radius = radius_arcsec / 3600.0
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    if dataset_id is not None:
+        # Single dataset: served from the cached k-d tree
+        return sky_tree_cache.cone_search(db, dataset_id, ra, dec, radius, limit=limit)
+    return cone_search(db, ra, dec, radius, limit=limit)
+
+@app.get("/sky/box")
+def sky_box_search(
+    ra_min: float,
+    ra_max: float,
+    dec_min: float,
+    dec_max: float,
+    dataset_id: int = None,
+    limit: int = 1000,
+    db: Session = Depends(get_db)
+):
+    """ Objects inside an RA/Dec box; ra_min > ra_max wraps through RA 0. """
+    if not (0 <= ra_min <= 360 and 0 <= ra_max <= 360 and -90 <= dec_min <= dec_max <= 90):
+        raise HTTPException(status_code=400, detail="Expected RA in [0, 360] and -90<=dec_min<=dec_max<=90")
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    return box_search(db, ra_min, ra_max, dec_min, dec_max, dataset_id=dataset_id, limit=limit)
+
+# --- CROSS-MATCH ---
+
+def _count_datasets(db, dataset_ids):
+    return db.query(models.Dataset.id).filter(models.Dataset.id.in_(dataset_ids)).count()
+
+@app.post("/crossmatch", status_code=202)
+async def create_crossmatch(
+    dataset_a: int,
+    dataset_b: int,
+    radius_arcsec: float = 1.0,
+    target_epoch: float = None,
+    unique: bool = True
+):
+    """ Queues a positional cross-match between two datasets; poll GET /jobs/{id} for the summary. """
+    if dataset_a == dataset_b:
+        raise HTTPException(status_code=400, detail="Pick two different datasets")
+    if radius_arcsec <= 0:
+        raise HTTPException(status_code=400, detail="radius_arcsec must be positive")
+    found = await run_db(_count_datasets, [dataset_a, dataset_b])
+    if found != 2:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return await job_manager.submit(
+        "crossmatch", run_crossmatch, dataset_a, dataset_b, radius_arcsec, target_epoch, unique
+    )
+
+@app.post("/datasets/{dataset_id}/rescore", status_code=202)
+async def rescore_dataset(dataset_id: int):
+    """ Re-scores stored rows with the dataset's persisted anomaly model; poll GET /jobs/{id}. """
+    if not await run_db(_count_datasets, [dataset_id]):
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return await job_manager.submit("rescore", run_rescore, dataset_id)
+
+@app.get("/datasets/{dataset_id}/predictions")
+def get_predictions(
+    dataset_id: int,
+    column: str = None,
+    min_confidence: float = 0.0,
+    limit: int = 10000,
+    offset: int = 0,
+    db: Session = Depends(get_db)
+):
+    """ Imputed values for a dataset's gaps, as parallel (columnar) arrays. """
+    iv = models.ImputedValue
+    query = db.query(iv.original_id, iv.column_name, iv.predicted_value, iv.confidence).filter(
+        iv.dataset_id == dataset_id, iv.confidence >= min_confidence
+    )
+    if column:
+        query = query.filter(iv.column_name == column)
+    rows = query.order_by(iv.id).offset(offset).limit(limit).all()
+    return {
+        "dataset_id": dataset_id,
+        "id": [r.original_id for r in rows],
+        "column": [r.column_name for r in rows],
+        "predicted_value": [r.predicted_value for r in rows],
+        "confidence": [r.confidence for r in rows]
+    }
+
+ARROW_STREAM_TYPE = "application/vnd.apache.arrow.stream"
+
+@app.get("/datasets/{dataset_id}/rows")
+def get_rows(
+    dataset_id: int,
+    columns: str = None,
+    sort: str = "id",
+    order: str = "asc",
+    cursor: str = None,
+    limit: int = 1000,
+    ra_min: float = None, ra_max: float = None,
+    dec_min: float = None, dec_max: float = None,
+    brightness_min: float = None, brightness_max: float = None,
+    redshift_min: float = None, redshift_max: float = None,
+    format: str = "json",
+    compression: str = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Keyset-paginated rows of a dataset. Pass the returned next_cursor (or the
+    X-Next-Cursor header) back as `cursor` for the following page.
+
+    format=json returns column arrays; format=arrow returns an Arrow IPC
+    stream (optionally with lz4/zstd buffer compression).
+    """
+    if format not in ("json", "arrow") or order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="format must be json|arrow and order asc|desc")
+    if compression not in (None, "lz4", "zstd"):
+        raise HTTPException(status_code=400, detail="compression must be lz4 or zstd")
+    if not db.query(models.Dataset.id).filter(models.Dataset.id == dataset_id).first():
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    ranges = {
+        name: bounds for name, bounds in {
+            "ra": (ra_min, ra_max), "dec": (dec_min, dec_max),
+            "brightness": (brightness_min, brightness_max), "redshift": (redshift_min, redshift_max)
+        }.items() if bounds != (None, None)
+    }
+    try:
+        names, data, next_cursor = query_rows(
+            db, dataset_id, columns.split(",") if columns else None, ranges,
+            sort=sort, descending=order == "desc", cursor=cursor, limit=limit
+        )
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "arrow":
+        table = pa.table({name: data[name] for name in names})
+        sink = pa.BufferOutputStream()
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        return Response(content=sink.getvalue().to_pybytes(), media_type=ARROW_STREAM_TYPE, headers=headers)
+
+    return {
+        "dataset_id": dataset_id,
+        "columns": names,
+        "count": len(data["id"]),
+        "rows": data,
+        "next_cursor": next_cursor
+    }
+
+@app.get("/datasets/{dataset_id}/histogram")
+def get_histogram(
+    dataset_id: int,
+    column: str = "brightness",
+    bins: int = 50,
+    ra_min: float = None,
+    ra_max: float = None,
+    dec_min: float = None,
+    dec_max: float = None,
+    db: Session = Depends(get_db)
+):
+    """ Histogram of one stored column, scanned from the dataset's memory-mapped columnar copy. """
+    dataset = db.query(models.Dataset).filter(models.Dataset.id == dataset_id).first()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    store = open_dataset(dataset)
+    if store is None:
+        raise HTTPException(status_code=404, detail="Dataset has no columnar store")
+    if column not in NUMERIC_COLUMNS:
+        raise HTTPException(status_code=400, detail="Expected a numeric golden-record column")
+
+    regions = None
+    box = (ra_min, ra_max, dec_min, dec_max)
+    if any(v is not None for v in box):
+        if any(v is None for v in box):
+            raise HTTPException(status_code=400, detail="A box needs ra_min, ra_max, dec_min and dec_max")
+        regions = regions_for_box(*box)
+        table = store.read([column, "ra", "dec"], regions)
+        ra, dec = table.column("ra").to_numpy(), table.column("dec").to_numpy()
+        in_ra = (ra >= ra_min) & (ra <= ra_max) if ra_min <= ra_max else (ra >= ra_min) | (ra <= ra_max)
+        values = table.column(column).to_numpy()[in_ra & (dec >= dec_min) & (dec <= dec_max)]
+    else:
+        values = store.column(column)
+
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return {"column": column, "count": 0, "edges": [], "counts": []}
+    counts, edges = np.histogram(values, bins=max(1, min(bins, 1000)))
+    return {"column": column, "count": int(len(values)), "edges": edges.tolist(), "counts": counts.tolist()}
+
+@app.get("/datasets/{dataset_id}/lod")
+def get_lod(
+    dataset_id: int,
+    order: int = None,
+    max_bins: int = LOD_MAX_BINS,
+    ra_min: float = None,
+    ra_max: float = None,
+    dec_min: float = None,
+    dec_max: float = None,
+    db: Session = Depends(get_db)
+):
+    """
+    HEALPix-binned counts and mean brightness for a sky viewport, read from the
+    pyramid precomputed at ingestion. Without `order` the finest level that
+    keeps the viewport within max_bins is chosen.
+    """
+    dataset = db.query(models.Dataset).filter(models.Dataset.id == dataset_id).first()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    viewport = None
+    box = (ra_min, ra_max, dec_min, dec_max)
+    if any(v is not None for v in box):
+        if any(v is None for v in box):
+            raise HTTPException(status_code=400, detail="A viewport needs ra_min, ra_max, dec_min and dec_max")
+        viewport = box
+
+    bins = query_lod(dataset.columnar_path, order, viewport, max(1, max_bins)) if dataset.columnar_path else None
+    if bins is None:
+        raise HTTPException(status_code=404, detail="Dataset has no sky level-of-detail pyramid")
+    return bins
+
+def _image_response(window, headers):
+    """Raw little-endian float32 pixels (row-major, NaN = blank) plus their shape."""
+    headers["X-Image-Shape"] = f"{window.shape[0]},{window.shape[1]}"
+    return Response(content=window.astype("<f4").tobytes(), media_type=PIXELS_TYPE, headers=headers)
+
+def _get_pyramid(db, dataset_id):
+    dataset = db.query(models.Dataset).filter(models.Dataset.id == dataset_id).first()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    # Opening reads the manifest from disk; callers run this off the event loop
+    pyramid = open_pyramid(dataset)
+    if pyramid is None:
+        raise HTTPException(status_code=404, detail="Dataset has no image pyramid")
+    return pyramid
+
+@app.get("/datasets/{dataset_id}/tiles")
+def get_tile_info(dataset_id: int, db: Session = Depends(get_db)):
+    """ Image size, tile size and zoom range of a dataset's image pyramid. """
+    return _get_pyramid(db, dataset_id).manifest
+
+@app.get("/datasets/{dataset_id}/tiles/{z}/{x}/{y}")
+async def get_tile(dataset_id: int, z: int, x: int, y: int):
+    """ One TILE_SIZE tile of the image pyramid (z=0 is the whole image, max_zoom full resolution). """
+    pyramid = await run_db(_get_pyramid, dataset_id)
+    try:
+        tile = await asyncio.to_thread(pyramid.tile, z, x, y)
+    except TileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _image_response(tile, {"X-Image-Level": str(pyramid.max_zoom - z)})
+
+@app.get("/datasets/{dataset_id}/cutout")
+async def get_cutout(
+    dataset_id: int,
+    x_min: int = None, x_max: int = None,
+    y_min: int = None, y_max: int = None,
+    ra_min: float = None, ra_max: float = None,
+    dec_min: float = None, dec_max: float = None
+):
+    """
+    Cutout of the image by full-resolution pixel box (end-exclusive) or by
+    RA/Dec box through the FITS WCS. Large boxes come from a coarser pyramid
+    level (see X-Image-Level: pixels are 2**level full-resolution pixels).
+    """
+    pyramid = await run_db(_get_pyramid, dataset_id)
+    pixel_box = (x_min, x_max, y_min, y_max)
+    world_box = (ra_min, ra_max, dec_min, dec_max)
+    try:
+        if all(v is not None for v in pixel_box):
+            box = pixel_box
+        elif all(v is not None for v in world_box):
+            box = await asyncio.to_thread(pyramid.pixel_box, *world_box)
+        else:
+            raise HTTPException(status_code=400, detail="Give x_min, x_max, y_min, y_max or ra_min, ra_max, dec_min, dec_max")
+        window, level, box = await asyncio.to_thread(pyramid.cutout, *box)
+    except TileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _image_response(window, {"X-Image-Level": str(level), "X-Cutout-Box": ",".join(map(str, box))})
+
+@app.get("/match-groups/{group_id}")
+def get_match_group(group_id: int, db: Session = Depends(get_db)):
+    """ All golden-record rows fused into one physical object. """
+    members = db.query(models.StandardizedData).filter(models.StandardizedData.match_group == group_id).all()
+    if not members:
+        raise HTTPException(status_code=404, detail="Match group not found")
+    return {
+        "group_id": group_id,
+        "members": [
+            {"id": m.id, "dataset_id": m.dataset_id, "original_id": m.original_id,
+             "ra": m.ra, "dec": m.dec, "brightness": m.brightness, "object_type": m.object_type}
+            for m in members
+        ]
+    }
+
 @app.get("/datasets/{dataset_id}/report")
-async def generate_report(dataset_id: int, db: Session = Depends(get_db)):
+def generate_report(dataset_id: int, db: Session = Depends(get_db)):
+    """ Cached research report; rebuilt from stored statistics and annotation counts after annotation writes. """
     dataset = db.query(models.Dataset).filter(models.Dataset.id == dataset_id).first()
     if not dataset:
         raise HTTPException(status_code=404, detail="Dataset not found")
-        
-    annotations = db.query(models.Annotation).filter(models.Annotation.dataset_id == dataset_id).all()
-    # Convert SQLAlchemy objects to dicts for the generator
-    annotation_dicts = [{"flag_type": a.flag_type, "comment": a.comment} for a in annotations]
-    
-    generator = research_report_generator()
-    report = generator.generate(
-        dataset_name=dataset.filename,
-        format=dataset.format,
-        metadata=dataset.metadata_json or {},
-        statistics=dataset.statistics_json or {},
-        annotations=annotation_dicts
-    )
-    return report
+    return cached_report(db, dataset)
+
+def _dataset_version(db, dataset_id):
+    dataset = db.query(models.Dataset.version).filter(models.Dataset.id == dataset_id).first()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return dataset.version or 0
+
+def _check_export_format(format):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+
+@app.post("/datasets/{dataset_id}/report/export", status_code=202)
+async def export_report(dataset_id: int, format: str = "pdf"):
+    """ Renders the report with its plots to HTML/PDF in the worker pool; poll GET /jobs/{id}, then download it. """
+    _check_export_format(format)
+    version = await run_db(_dataset_version, dataset_id)
+    path = artifact_path(dataset_id, version, format)
+    if os.path.exists(path):
+        # Already rendered for this dataset version
+        return await job_manager.cached(
+            "report", {"id": dataset_id, "version": version, "format": format, "path": path},
+            filename=artifact_name(dataset_id, version, format)
+        )
+    return await job_manager.submit_report(dataset_id, version, format)
+
+@app.get("/datasets/{dataset_id}/report/export")
+def download_report(dataset_id: int, format: str = "pdf", db: Session = Depends(get_db)):
+    """ The rendered report of the dataset's current version (404 until an export job has produced it). """
+    _check_export_format(format)
+    version = _dataset_version(db, dataset_id)
+    path = artifact_path(dataset_id, version, format)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Report not rendered for the current version; POST to export it")
+    return FileResponse(path, media_type=MEDIA_TYPES[format], filename=artifact_name(dataset_id, version, format))
 
 # Mount Socket.IO
 # We must wrap the FastAPI app with the socketio ASGIApp
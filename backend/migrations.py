@@ -0,0 +1,148 @@
+from datetime import datetime
+from sqlalchemy import inspect, text
+
+# version -> (name, fn(conn)); applied in version order, each exactly once
+MIGRATIONS = {}
+
+def migration(version, name):
+    def register(fn):
+        if version in MIGRATIONS:
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS[version] = (name, fn)
+        return fn
+    return register
+
+def _create_index(conn, name, table, columns):
+    """
+    Idempotent index build. On PostgreSQL it is built CONCURRENTLY (the
+    connection is in autocommit mode) so ingestion keeps writing meanwhile.
+    """
+    concurrently = "CONCURRENTLY " if conn.dialect.name == "postgresql" else ""
+    conn.execute(text(f"CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+@migration(1, "composite indexes for annotation, feed and original_id lookups")
+def _annotation_indexes(conn):
+    # GET /datasets/{id}/annotations and per-dataset report aggregates
+    _create_index(conn, "ix_annotations_dataset_time", "annotations", ["dataset_id", "timestamp"])
+    # GET /quality-feed: newest annotations first, read backwards off the index
+    _create_index(conn, "ix_annotations_timestamp", "annotations", ["timestamp"])
+    # POST /annotations and ingestion resolve (dataset_id, original_id) to a row
+    _create_index(conn, "ix_standardized_data_dataset_original", "standardized_data", ["dataset_id", "original_id"])
+    # Fresh planner statistics so the new indexes are picked up immediately
+    for table in ("annotations", "standardized_data"):
+        conn.execute(text(f"ANALYZE {table}"))
+
+@migration(2, "backfill per-flag_type annotation counts")
+def _annotation_counts(conn):
+    # Datasets annotated before annotation_counts existed; later writes keep it current
+    conn.execute(text(
+        "INSERT INTO annotation_counts (dataset_id, flag_type, count) "
+        "SELECT dataset_id, flag_type, COUNT(*) FROM annotations "
+        "WHERE dataset_id IS NOT NULL GROUP BY dataset_id, flag_type"
+    ))
+
+@migration(3, "in-flight job lookup index")
+def _job_indexes(conn):
+    # Deduplicating submissions looks up queued/running jobs of a kind
+    _create_index(conn, "ix_jobs_kind_status", "jobs", ["kind", "status"])
+
+@migration(4, "sky search, pagination, upload dedup and cross-match indexes")
+def _query_indexes(conn):
+    # Zone + RA range scans back cone/box searches (sky_index.cone_search)
+    _create_index(conn, "ix_standardized_data_zone_ra", "standardized_data", ["sky_zone", "ra"])
+    # Keyset pagination of one dataset's rows (GET /datasets/{id}/rows)
+    _create_index(conn, "ix_standardized_data_dataset_row", "standardized_data", ["dataset_id", "id"])
+    # GET /match-groups/{id} and regrouping after a cross-match
+    _create_index(conn, "ix_standardized_data_match_group", "standardized_data", ["match_group"])
+    # Upload deduplication by content hash (find_cached_result)
+    _create_index(conn, "ix_datasets_content_hash", "datasets", ["content_hash"])
+    # Re-running a dataset pair replaces its matches; groups are rebuilt from pairs
+    _create_index(conn, "ix_cross_matches_datasets", "cross_matches", ["dataset_a_id", "dataset_b_id"])
+    _create_index(conn, "ix_cross_matches_object_a_id", "cross_matches", ["object_a_id"])
+    _create_index(conn, "ix_cross_matches_object_b_id", "cross_matches", ["object_b_id"])
+    _create_index(conn, "ix_cross_matches_match_group", "cross_matches", ["match_group"])
+    # Predictions of one dataset's rows (GET /datasets/{id}/predictions)
+    _create_index(conn, "ix_imputed_values_dataset_row", "imputed_values", ["dataset_id", "original_id"])
+    for table in ("standardized_data", "datasets", "cross_matches", "imputed_values"):
+        conn.execute(text(f"ANALYZE {table}"))
+
+@migration(5, "keyset pagination indexes for every sortable row column")
+def _sort_indexes(conn):
+    # GET /datasets/{id}/rows?sort=<col> walks (dataset_id, col, id) in order
+    for column in ("ra", "dec", "brightness", "temperature", "velocity", "redshift"):
+        _create_index(conn, f"ix_standardized_data_dataset_{column}", "standardized_data", ["dataset_id", column, "id"])
+    conn.execute(text("ANALYZE standardized_data"))
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations "
+            "(version INTEGER PRIMARY KEY, name VARCHAR, applied_at VARCHAR)"
+        ))
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+def pending_migrations(engine):
+    """Versions not yet applied, without creating anything."""
+    if not inspect(engine).has_table("schema_migrations"):
+        return sorted(MIGRATIONS)
+    with engine.connect() as conn:
+        done = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+    return sorted(set(MIGRATIONS) - done)
+
+def run_migrations(engine):
+    """
+    Applies pending migrations in version order and records each one in
+    schema_migrations. sync_schema() keeps handling additive columns and
+    tables; migrations cover steps a declarative diff cannot express
+    (concurrent index builds, statistics, data changes).
+
+    Returns:
+        list: Versions applied by this call.
+    """
+    done = applied_versions(engine)
+    applied = []
+    for version in sorted(MIGRATIONS):
+        if version in done:
+            continue
+        name, fn = MIGRATIONS[version]
+        if engine.dialect.name == "postgresql":
+            # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                fn(conn)
+        else:
+            with engine.begin() as conn:
+                fn(conn)
+        with engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": datetime.utcnow().isoformat()}
+            )
+        applied.append(version)
+    return applied
+
+def prepare_database():
+    """
+    Brings the configured database up to date: missing tables, columns and
+    indexes (sync_schema), pending migrations, then sky zones of rows stored
+    before the sky index existed. Run it once per deploy, before starting
+    the API workers, so concurrent workers never race on schema changes:
+
+        python migrations.py
+
+    Returns:
+        list: Versions applied by this call.
+    """
+    # database.py builds the engine from DATABASE_URL on import
+    import models
+    from database import engine, SessionLocal, sync_schema
+    from sky_index import backfill_sky_zones
+
+    sync_schema(models.Base)
+    applied = run_migrations(engine)
+    with SessionLocal() as db:
+        backfill_sky_zones(db)
+    return applied
+
+if __name__ == "__main__":
+    applied = prepare_database()
+    print(f"Applied migrations: {', '.join(map(str, applied))}" if applied else "Database is up to date")
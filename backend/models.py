@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, JSON, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, JSON, ForeignKey, Boolean, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -12,12 +12,21 @@ class Dataset(Base):
     upload_date = Column(DateTime, default=datetime.utcnow)
     file_path = Column(String)
     file_size = Column(Integer, nullable=True) # in bytes
+    content_hash = Column(String, nullable=True) # SHA-256 of the file; uploads are stored under it
+    columnar_path = Column(String, nullable=True) # Arrow IPC copy of the rows, partitioned by sky region
+    tiles_path = Column(String, nullable=True) # Mip pyramid of the file's image, if it has one
     uploader_id = Column(String, nullable=True, index=True) # Optional: if auth is added
     
     # Store raw metadata extracted from headers
     metadata_json = Column(JSON)
     # Store pre-calculated stats (min/max/mean) to avoid full table scans
     statistics_json = Column(JSON)
+    # Full upload response, returned as-is when the same content is uploaded again
+    result_json = Column(JSON, nullable=True)
+    # Bumped by every annotation write; derived reports are tied to the version they were built from
+    version = Column(Integer, default=0)
+    # Research report, served as-is until an annotation write clears it
+    report_json = Column(JSON, nullable=True)
     
     # Relationships
     standardized_data = relationship("StandardizedData", back_populates="dataset", cascade="all, delete-orphan")
@@ -55,10 +64,26 @@ class StandardizedData(Base):
     # 4. CLASSIFICATION
     object_type = Column(String, nullable=True) # e.g., 'STAR', 'GALAXY', 'QSO'
     
+    # 5. ASTROMETRY (for epoch propagation during cross-matching)
+    pm_ra = Column(Float, nullable=True) # mas/yr, includes cos(dec)
+    pm_dec = Column(Float, nullable=True) # mas/yr
+    epoch = Column(Float, nullable=True) # Julian year of ra/dec, e.g. 2016.0
+    
+    # 6. SKY INDEX
+    # Declination strip (see sky_index.ZONE_HEIGHT); NULL when ra/dec are not sky coordinates
+    sky_zone = Column(Integer, nullable=True)
+    
+    # 7. FUSION
+    # Rows describing the same physical object share a group (see crossmatch.py)
+    match_group = Column(Integer, nullable=True)
+    
     # Relationship
     dataset = relationship("Dataset", back_populates="standardized_data")
     annotations = relationship("Annotation", back_populates="data_object")
 
+    # (sky_zone, ra), (dataset_id, id), (dataset_id, original_id) and
+    # match_group indexes are built by migrations.py
+
 class MetadataMapping(Base):
     """
     Tracks how original columns were mapped to standard ones.
@@ -73,6 +98,7 @@ class MetadataMapping(Base):
     standard_column = Column(String)
     confidence_score = Column(Integer) # 0-100
     mapping_method = Column(String) # 'exact', 'fuzzy', 'manual_override'
+    fuzzy_threshold = Column(Integer, nullable=True) # Threshold the decision was made at (warms the standardizer cache)
     
     dataset = relationship("Dataset", back_populates="mappings")
 
@@ -92,9 +118,26 @@ class Annotation(Base):
     flag_type = Column(String) # 'anomaly', 'quality_issue', 'interesting', 'comment'
     comment = Column(String, nullable=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    # (dataset_id, timestamp) and timestamp indexes are built by migrations.py
     
     data_object = relationship("StandardizedData", back_populates="annotations")
 
+class AnnotationCount(Base):
+    """
+    Annotations per (dataset, flag_type), updated with every annotation write
+    so reports never scan the annotations table.
+    """
+    __tablename__ = "annotation_counts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    dataset_id = Column(Integer, ForeignKey("datasets.id"))
+    flag_type = Column(String)
+    count = Column(Integer, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("dataset_id", "flag_type", name="uq_annotation_counts_dataset_flag"),
+    )
+
 class AnalysisSession(Base):
     """
     Real-time collaboration state.
@@ -110,3 +153,59 @@ class AnalysisSession(Base):
     
     # Current UI state (cam position, filters)
     view_state_json = Column(JSON)
+
+class CrossMatch(Base):
+    """
+    Positional match between two golden-record rows from different datasets.
+    """
+    __tablename__ = "cross_matches"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    dataset_a_id = Column(Integer, ForeignKey("datasets.id"))
+    dataset_b_id = Column(Integer, ForeignKey("datasets.id"))
+    object_a_id = Column(Integer, ForeignKey("standardized_data.id"))
+    object_b_id = Column(Integer, ForeignKey("standardized_data.id"))
+    
+    separation_arcsec = Column(Float)
+    match_group = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Dataset pair, object and match_group indexes are built by migrations.py
+
+class ImputedValue(Base):
+    """
+    Side table of values proposed by the DataCompleter for gaps in a dataset.
+    Observed golden-record values are never overwritten.
+    """
+    __tablename__ = "imputed_values"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    dataset_id = Column(Integer, ForeignKey("datasets.id"))
+    original_id = Column(String) # Row id in the source file, as in StandardizedData
+    
+    column_name = Column(String) # Source column that had the gap
+    predicted_value = Column(Float)
+    confidence = Column(Float) # 0-100
+    method = Column(String) # 'temporal' | 'spatial'
+    # (dataset_id, original_id) index is built by migrations.py
+
+class Job(Base):
+    """
+    Background job (ingestion, cross-match, rescore, report export). Every
+    state change is written here, so any worker can answer GET /jobs/{id}.
+    """
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True) # uuid4 hex
+    kind = Column(String)
+    filename = Column(String, nullable=True)
+    content_hash = Column(String, nullable=True)
+    cached = Column(Boolean, default=False)
+    status = Column(String) # 'queued', 'running', 'completed', 'failed'
+    stage = Column(String)
+    progress = Column(Float, default=0.0)
+    created_at = Column(String) # ISO timestamps, as returned to clients
+    finished_at = Column(String, nullable=True)
+    dataset_id = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+    result_json = Column(JSON, nullable=True)
+    # (kind, status) lookups of in-flight jobs use an index built by migrations.py
@@ -1,67 +1,147 @@
+import os
 import pandas as pd
 import numpy as np
+from parsers.streaming_stats import RunningStats, RowReservoir
 
-def parse_csv(filepath):
+# Rows per chunk read from disk; bounds parser memory regardless of file size
+CHUNK_SIZE = 50000
+PREVIEW_ROWS = 1000
+
+class CsvStream:
     """
-    Parses a CSV file and returns metadata and basic statistics.
+    Single pass over a CSV file that feeds the ingestion pipeline and builds
+    the parse result on the way: every chunk yielded by chunks() also
+    updates the running statistics and row count, so the file is parsed
+    once. Columns, plot roles and the preview come from the first chunk,
+    which is read on construction.
     """
-    try:
-        # Read specifically mostly numeric data for astronomical purposes?
-        # For now just read standard CSV
-        df = pd.read_csv(filepath)
-        
+
+    def __init__(self, filepath, chunksize=CHUNK_SIZE):
+        self.filepath = filepath
+        self.chunksize = chunksize
+        self.row_count = 0
+        self._size = max(1, os.path.getsize(filepath))
+        self._running = RunningStats()
+        self._file = open(filepath, "rb")
+        try:
+            self._reader = pd.read_csv(self._file, chunksize=chunksize)
+            self._first = next(self._reader, None)
+        except Exception as e:
+            self.close()
+            raise Exception(f"Error parsing CSV file: {str(e)}")
+
         # Metadata mostly from file info or if there are specific comment lines
         # In simple CSV, column names are the primary metadata
+        first = self._first
+        self.columns = list(first.columns) if first is not None else []
+        # Column roles are fixed by the first chunk so ids/x/y stay consistent
+        self.numeric_cols = list(first.select_dtypes(include=[np.number]).columns) if first is not None else []
+        self.preview = []
+        if self.numeric_cols:
+            self.x_col, self.y_col, self.val_col = _pick_plot_columns(self.numeric_cols)
+            head = _coerce_numeric(first, self.numeric_cols).head(PREVIEW_ROWS)
+            preview = _with_plot_columns(head, self.x_col, self.y_col, self.val_col)
+            # Gaps become null so the preview stays JSON-serializable
+            self.preview = preview.astype(object).where(preview.notna(), None).to_dict("records")
+
+    @property
+    def progress(self):
+        """Fraction of the file's bytes consumed so far."""
+        return 1.0 if self._file.closed else min(1.0, self._file.tell() / self._size)
+
+    def close(self):
+        self._file.close()
+
+    def chunks(self):
+        """
+        Streams every row as numeric DataFrame chunks. Each chunk carries `id`
+        (global row index), `x`, `y` and `value` alongside the original
+        numeric columns, matching the preview row layout.
+        """
+        try:
+            chunk, self._first = self._first, None
+            while chunk is not None:
+                self.row_count += len(chunk)
+                if not self.numeric_cols:
+                    chunk = next(self._reader, None)
+                    continue
+                numeric_chunk = _coerce_numeric(chunk, self.numeric_cols)
+                self._running.update_frame(numeric_chunk)
+                yield _with_plot_columns(numeric_chunk, self.x_col, self.y_col, self.val_col)
+                chunk = next(self._reader, None)
+        finally:
+            self.close()
+
+    def fit_sample(self, size):
+        """
+        Uniform sample of the (value, x, y) rows of the whole file (None
+        without numeric columns). Models must be fitted before the pipeline
+        pass scores its first chunk, so this reads the file ahead of it,
+        parsing only those three columns.
+        """
+        if not self.numeric_cols:
+            return None
+        roles = [self.val_col, self.x_col, self.y_col]
+        usecols = list(dict.fromkeys(roles))
+        reservoir = RowReservoir(size)
+        for chunk in pd.read_csv(self.filepath, usecols=usecols, chunksize=self.chunksize):
+            reservoir.update(_coerce_numeric(chunk, usecols)[roles].to_numpy(dtype=np.float64, na_value=np.nan))
+        return reservoir.sample
+
+    def result(self):
+        """
+        Metadata, statistics and preview in the parser result layout.
+        Statistics and the row count cover the rows streamed so far.
+        """
         metadata = {
-            "columns": list(df.columns),
-            "row_count": len(df)
+            "columns": self.columns,
+            "row_count": self.row_count
         }
-        
-        # Calculate stats for numeric columns only
-        numeric_df = df.select_dtypes(include=[np.number])
-        
-        stats = {}
-        if not numeric_df.empty:
+
+        if self.numeric_cols:
+            samples = self._running.describe_all()
             stats = {
-                "numeric_columns": list(numeric_df.columns),
-                "mean": float(numeric_df.mean().mean()),
-                "shape": str(df.shape),
-                "samples": numeric_df.describe().map(lambda x: float(x)).to_dict()
+                "numeric_columns": self.numeric_cols,
+                "mean": float(np.nanmean([s["mean"] for s in samples.values()])) if samples else None,
+                "shape": str((self.row_count, len(self.columns))),
+                "samples": samples
             }
-            # Flatten samples for simpler display if needed, but dict is fine
         else:
              stats = {
-                 "shape": str(df.shape),
+                 "shape": str((self.row_count, len(self.columns))),
                  "message": "No numeric data found for statistics"
              }
 
-        # Prepare preview data
-        preview_data = []
-        if not numeric_df.empty:
-            # Take up to 1000 rows
-            sample_df = numeric_df.head(1000)
-            # Try to identify RA/Dec columns or just use first two
-            cols = sample_df.columns
-            x_col = next((c for c in cols if 'ra' in c.lower() or 'x' in c.lower()), cols[0])
-            y_col = next((c for c in cols if 'dec' in c.lower() or 'y' in c.lower()), cols[1] if len(cols) > 1 else cols[0])
-            val_col = next((c for c in cols if 'flux' in c.lower() or 'mag' in c.lower() or 'val' in c.lower()), cols[0])
-
-            for i, row in sample_df.iterrows():
-                row_dict = row.to_dict()
-                row_dict['id'] = i
-                # Keep x, y, value for backward compatibility with existing components
-                row_dict['x'] = float(row[x_col])
-                row_dict['y'] = float(row[y_col])
-                row_dict['value'] = float(row[val_col])
-                preview_data.append(row_dict)
-
         return {
-            "filename": filepath.split('\\')[-1],
+            "filename": self.filepath.split('\\')[-1],
             "format": "CSV",
             "metadata": metadata,
             "statistics": stats,
-            "preview": preview_data
+            "preview": self.preview
         }
 
-    except Exception as e:
-        raise Exception(f"Error parsing CSV file: {str(e)}")
+def _coerce_numeric(chunk, numeric_cols):
+    """Later chunks may infer a different dtype (e.g. a stray string), so coerce."""
+    numeric_chunk = chunk[numeric_cols]
+    if all(pd.api.types.is_numeric_dtype(numeric_chunk[c]) for c in numeric_cols):
+        return numeric_chunk
+    return numeric_chunk.apply(pd.to_numeric, errors="coerce")
+
+def _pick_plot_columns(cols):
+    # Try to identify RA/Dec columns or just use first two
+    x_col = next((c for c in cols if 'ra' in c.lower() or 'x' in c.lower()), cols[0])
+    y_col = next((c for c in cols if 'dec' in c.lower() or 'y' in c.lower()), cols[1] if len(cols) > 1 else cols[0])
+    val_col = next((c for c in cols if 'flux' in c.lower() or 'mag' in c.lower() or 'val' in c.lower()), cols[0])
+    return x_col, y_col, val_col
+
+def _with_plot_columns(numeric_df, x_col, y_col, val_col):
+    """
+    Vectorized equivalent of the old per-row preview dicts: original numeric
+    columns plus id, x, y, value (kept for backward compatibility with existing components).
+    """
+    frame = numeric_df.copy()
+    frame["id"] = numeric_df.index
+    frame["x"] = numeric_df[x_col].astype(float)
+    frame["y"] = numeric_df[y_col].astype(float)
+    frame["value"] = numeric_df[val_col].astype(float)
+    return frame
@@ -1,14 +1,25 @@
 from astropy.io import fits
 import numpy as np
 import pandas as pd
+from parsers.streaming_stats import RunningStats, RowReservoir
 
-def parse_fits(filepath):
+# Rows/pixels reduced per block; bounds memory regardless of HDU size
+BLOCK_PIXELS = 4_000_000
+TABLE_BLOCK_ROWS = 100_000
+PREVIEW_POINTS = 1000
+
+def parse_fits(filepath, secondary_headers_only=False):
     """
     Comprehensive FITS parser that handles multiple HDUs, extracts metadata,
     column info, units, and generates statistics/previews.
+
+    The file is memory-mapped and HDU data is only ever touched in bounded
+    blocks, so statistics cover whole images/tables without full-size copies.
     
     Args:
         filepath (str): Absolute path to the FITS file.
+        secondary_headers_only (bool): Only read the data of the primary
+            analysis target; other HDUs report header/shape information only.
         
     Returns:
         dict: Structured JSON containing metadata, stats, and preview data.
@@ -23,24 +34,19 @@ def parse_fits(filepath):
             "preview": []     # Sentinel preview for visualization
         }
 
-        # Open the FITS file
-        with fits.open(filepath) as hdul:
+        # Open the FITS file (scaling is applied per block, see _image_blocks)
+        with fits.open(filepath, memmap=True, do_not_scale_image_data=True) as hdul:
+            # Determine "Primary" content for the Dashboard from headers alone
+            # Prioritize Tables over Images for analysis
+            target = _find_primary_target(hdul)
+
             # 6. Handle Multiple HDUs
             for i, hdu in enumerate(hdul):
-                hdu_info = _process_hdu(hdu, i)
+                load_data = i == target or not secondary_headers_only
+                hdu_info = _process_hdu(hdu, i, load_data=load_data)
                 results["hdus"].append(hdu_info)
 
-            # Determine "Primary" content for the Dashboard
-            # Prioritize Tables over Images for analysis
-            table_hdus = [h for h in results["hdus"] if h.get("is_table") and h.get("has_data")]
-            image_hdus = [h for h in results["hdus"] if h.get("is_image") and h.get("has_data")]
-            
-            if table_hdus:
-                primary_hdu = table_hdus[0]
-            elif image_hdus:
-                primary_hdu = image_hdus[0]
-            else:
-                primary_hdu = results["hdus"][0]
+            primary_hdu = results["hdus"][target]
             
             # Populates top-level fields for easy frontend access
             results["metadata"] = primary_hdu["header"]
@@ -58,7 +64,36 @@ def parse_fits(filepath):
         print(f"FITS Parsing Error: {e}")
         raise Exception(f"Failed to parse FITS file: {str(e)}")
 
-def _process_hdu(hdu, index):
+def _find_primary_target(hdul):
+    """
+    Index of the HDU to analyse: first table with rows, else first image
+    with pixels, else the primary HDU. Uses headers only.
+    """
+    table_idx = [i for i, h in enumerate(hdul) if _is_table(h) and _header_has_data(h)]
+    image_idx = [i for i, h in enumerate(hdul) if _is_image(h) and _header_has_data(h)]
+    if table_idx:
+        return table_idx[0]
+    if image_idx:
+        return image_idx[0]
+    return 0
+
+def _is_table(hdu):
+    return isinstance(hdu, (fits.BinTableHDU, fits.TableHDU))
+
+def _is_image(hdu):
+    return isinstance(hdu, (fits.PrimaryHDU, fits.ImageHDU))
+
+def _header_has_data(hdu):
+    """True if the header declares a non-empty data unit (no data access)."""
+    naxis = hdu.header.get('NAXIS', 0)
+    return naxis > 0 and all(hdu.header.get(f'NAXIS{n}', 0) > 0 for n in range(1, naxis + 1))
+
+def _header_shape(hdu):
+    """Numpy-order data shape taken from NAXISn keywords."""
+    naxis = hdu.header.get('NAXIS', 0)
+    return tuple(hdu.header.get(f'NAXIS{n}', 0) for n in range(naxis, 0, -1))
+
+def _process_hdu(hdu, index, load_data=True):
     """
     Helper to process a single HDU (Header Data Unit).
     """
@@ -67,7 +102,7 @@ def _process_hdu(hdu, index):
         "name": hdu.name,
         "type": type(hdu).__name__,
         "header": _extract_header(hdu.header),
-        "has_data": hdu.data is not None,
+        "has_data": _header_has_data(hdu),
         "is_table": False,
         "is_image": False,
         "columns": [],
@@ -76,13 +111,11 @@ def _process_hdu(hdu, index):
     }
 
     if info["has_data"]:
-        data = hdu.data
-        
         # 3. & 4. Identify Data Types / Handle Tables vs Images
         # Check for Table types (BinTableHDU or TableHDU)
-        if isinstance(hdu, (fits.BinTableHDU, fits.TableHDU)):
+        if _is_table(hdu):
             info["is_table"] = True
-            info["rows"] = len(data)
+            info["rows"] = hdu.header.get('NAXIS2', 0)
             
             # Extract column info (names, formats, units)
             if hasattr(hdu, 'columns'):
@@ -93,135 +126,228 @@ def _process_hdu(hdu, index):
                         "unit": col.unit if col.unit else "N/A"
                     })
 
-            # Generate Table Preview (simulating scatter plot data from columns)
-            # We look for numeric columns to plot (RA, DEC, FLUX/MAG)
-            try:
-                # Identify numeric columns by format (I=Int, E=Float, D=Double, etc)
-                numeric_cols = [
-                    col.name for col in hdu.columns 
-                    if col.format and col.format[-1].upper() in ['I','J','K','E','D']
-                ]
-                
-                if numeric_cols:
-                    # Take first 1000 rows
-                    limit = min(len(data), 1000)
-                    subset = data[:limit]
-                    
-                    # Smart Column Mapping
-                    x_col = next((c for c in numeric_cols if 'RA' in c.upper() or 'X' in c.upper()), numeric_cols[0])
-                    y_col = next((c for c in numeric_cols if 'DEC' in c.upper() or 'Y' in c.upper()), numeric_cols[1] if len(numeric_cols)>1 else numeric_cols[0])
-                    val_col = next((c for c in numeric_cols if any(x in c.upper() for x in ['FLUX', 'MAG', 'ERR'])), numeric_cols[-1])
-                    
-                    for j in range(limit):
-                        # Handle potential endianness or complex types by casting to standard float
-                        row = subset[j]
-                        row_dict = {}
-                        
-                        # Add all columns to the dictionary
-                        for col_name in numeric_cols:
-                            val = row[col_name]
-                            # Handle potential NaN
-                            row_dict[col_name] = float(val) if not np.isnan(val) else 0.0
-                        
-                        # Add required mapped fields for visualization
-                        row_dict["id"] = j
-                        row_dict["x"] = float(row[x_col]) if not np.isnan(row[x_col]) else 0.0
-                        row_dict["y"] = float(row[y_col]) if not np.isnan(row[y_col]) else 0.0
-                        row_dict["value"] = float(row[val_col]) if not np.isnan(row[val_col]) else 0.0
-                        
-                        info["preview"].append(row_dict)
-                        
-                    # Basic Stats using Pandas (matching CSV parser style)
-                    try:
-                        df_subset = pd.DataFrame(subset[numeric_cols])
-                        # Filter out rows with all NaNs
-                        df_subset = df_subset.dropna(how='all')
-                        
-                        if not df_subset.empty:
-                            info["stats"] = {
-                                "numeric_columns": numeric_cols,
-                                "mean": float(df_subset.mean().mean()),
-                                "shape": f"({len(data)}, {len(numeric_cols)})",
-                                "samples": df_subset.describe().map(lambda x: float(x)).to_dict()
-                            }
-                    except Exception as stats_e:
-                        print(f"Warning: Failed to generate detailed stats: {stats_e}")
-                        # Fallback to basic stats
-                        vals = [float(x[val_col]) for x in subset if not np.isnan(x[val_col])]
-                        if vals:
-                            info["stats"] = {
-                                "min": min(vals),
-                                "max": max(vals),
-                                "mean": sum(vals)/len(vals),
-                                "count": len(data)
-                            }
-            except Exception as e:
-                print(f"Warning: Could not generate table preview: {e}")
-
+            if load_data:
+                _process_table_data(hdu, info)
+            else:
+                info["data_skipped"] = True
 
         # Check for Image types (PrimaryHDU or ImageHDU)
-        elif isinstance(hdu, (fits.PrimaryHDU, fits.ImageHDU)):
+        elif _is_image(hdu):
             info["is_image"] = True
-            info["shape"] = str(data.shape)
+            info["shape"] = str(_header_shape(hdu))
             
             # 5. Detect Units from Header keywords
             info["unit"] = hdu.header.get('BUNIT', 'N/A')
 
-            # Calculate Image Statistics
-            if data.size > 0:
-                # Work with flat array for stats
-                flat = data.flatten()
-                
-                # Filter NaNs for stats arithmetic
-                if np.issubdtype(data.dtype, np.floating):
-                    valid_data = flat[~np.isnan(flat)]
-                else:
-                    valid_data = flat
-                
-                if valid_data.size > 0:
-                    # 7. Generate Preview (Pixel Coordinate Grid)
-                    # Use pixel indices for images to reflect actual data structure
-                    rows, cols = data.shape if len(data.shape) >= 2 else (1, data.size)
-                    num_samples = min(data.size, 1000)
-                    
-                    # Sample indices evenly
-                    indices = np.linspace(0, data.size - 1, num_samples, dtype=int)
-                    
-                    for j, idx in enumerate(indices):
-                        # Map flat index to 2D coordinates
-                        if len(data.shape) >= 2:
-                            r = idx // data.shape[1]
-                            c = idx % data.shape[1]
-                        else:
-                            r = 0
-                            c = idx
-                            
-                        val = data.flat[idx]
-                        info["preview"].append({
-                            "id": j,
-                            "value": float(val) if not np.isnan(val) else 0.0,
-                            "x": float(c),
-                            "y": float(r)
-                        })
-                    
-                    # Statistics for Images
-                    info["stats"] = {
-                        "numeric_columns": ["value", "x", "y"],
-                        "mean": float(np.mean(valid_data)),
-                        "shape": str(data.shape),
-                        "samples": {
-                            "value": {
-                                "mean": float(np.mean(valid_data)),
-                                "min": float(np.min(valid_data)),
-                                "max": float(np.max(valid_data)),
-                                "std": float(np.std(valid_data)),
-                                "50%": float(np.median(valid_data))
-                            }
-                        }
-                    }
+            if load_data:
+                _process_image_data(hdu, info)
+            else:
+                info["data_skipped"] = True
 
     return info
 
+def _process_table_data(hdu, info):
+    """
+    Table preview and full-column statistics from vectorized column slices,
+    reading the (memory-mapped) table in row blocks.
+    """
+    # Generate Table Preview (simulating scatter plot data from columns)
+    # We look for numeric columns to plot (RA, DEC, FLUX/MAG)
+    try:
+        data = hdu.data
+        n_rows = len(data)
+
+        numeric_cols = _numeric_columns(hdu)
+        if not numeric_cols:
+            return
+
+        # Smart Column Mapping
+        x_col, y_col, val_col = _plot_columns(numeric_cols)
+
+        # Take first 1000 rows; casting to native float handles endianness,
+        # NaN is replaced with 0.0 for display
+        subset = data[:min(n_rows, PREVIEW_POINTS)]
+        preview = pd.DataFrame({
+            name: np.nan_to_num(np.asarray(subset.field(name), dtype=np.float64), nan=0.0)
+            for name in numeric_cols
+        })
+        # Add required mapped fields for visualization
+        preview["id"] = np.arange(len(preview))
+        preview["x"] = preview[x_col]
+        preview["y"] = preview[y_col]
+        preview["value"] = preview[val_col]
+        info["preview"] = preview.to_dict("records")
+
+        # Basic Stats over every row (matching CSV parser style)
+        running = RunningStats()
+        for start in range(0, n_rows, TABLE_BLOCK_ROWS):
+            block = data[start:start + TABLE_BLOCK_ROWS]
+            for name in numeric_cols:
+                running.update(name, block.field(name))
+
+        samples = running.describe_all()
+        if any(s["count"] > 0 for s in samples.values()):
+            info["stats"] = {
+                "numeric_columns": numeric_cols,
+                "mean": float(np.nanmean([s["mean"] for s in samples.values()])),
+                "shape": f"({n_rows}, {len(numeric_cols)})",
+                "samples": samples
+            }
+    except Exception as e:
+        print(f"Warning: Could not generate table preview: {e}")
+
+def _numeric_columns(hdu):
+    # Identify numeric columns by format (I=Int, E=Float, D=Double, etc).
+    # Vector cells (e.g. 2E, 3D) have no single value per row and are skipped
+    return [
+        col.name for col in hdu.columns
+        if col.format and col.format[-1].upper() in ['I','J','K','E','D']
+        and getattr(col.format, 'repeat', 1) == 1
+    ]
+
+def _plot_columns(numeric_cols):
+    x_col = next((c for c in numeric_cols if 'RA' in c.upper() or 'X' in c.upper()), numeric_cols[0])
+    y_col = next((c for c in numeric_cols if 'DEC' in c.upper() or 'Y' in c.upper()), numeric_cols[1] if len(numeric_cols)>1 else numeric_cols[0])
+    val_col = next((c for c in numeric_cols if any(x in c.upper() for x in ['FLUX', 'MAG', 'ERR'])), numeric_cols[-1])
+    return x_col, y_col, val_col
+
+def iter_table_chunks(filepath, chunksize=TABLE_BLOCK_ROWS):
+    """
+    Streams every row of the analysed table HDU as numeric DataFrame chunks
+    for the ingestion pipeline, read as slices of the memory-mapped table.
+    Chunks carry `id` (global row index), `x`, `y` and `value` like the
+    preview rows, with gaps left as NaN. Yields nothing for images.
+    """
+    with fits.open(filepath, memmap=True) as hdul:
+        hdu = hdul[_find_primary_target(hdul)]
+        if not _is_table(hdu) or not _header_has_data(hdu):
+            return
+        numeric_cols = _numeric_columns(hdu)
+        if not numeric_cols:
+            return
+        x_col, y_col, val_col = _plot_columns(numeric_cols)
+
+        data = hdu.data
+        for start in range(0, len(data), chunksize):
+            block = data[start:start + chunksize]
+            # Casting to native float handles endianness
+            frame = pd.DataFrame(
+                {name: np.asarray(block.field(name), dtype=np.float64) for name in numeric_cols},
+                index=pd.RangeIndex(start, start + len(block))
+            )
+            frame["id"] = frame.index
+            frame["x"] = frame[x_col]
+            frame["y"] = frame[y_col]
+            frame["value"] = frame[val_col]
+            yield frame
+
+def table_fit_sample(filepath, size, chunksize=TABLE_BLOCK_ROWS):
+    """
+    Uniform sample of the (value, x, y) rows of the whole analysed table HDU
+    (None for images), read field by field from the memory-mapped table.
+    """
+    with fits.open(filepath, memmap=True) as hdul:
+        hdu = hdul[_find_primary_target(hdul)]
+        if not _is_table(hdu) or not _header_has_data(hdu):
+            return None
+        numeric_cols = _numeric_columns(hdu)
+        if not numeric_cols:
+            return None
+        x_col, y_col, val_col = _plot_columns(numeric_cols)
+
+        data = hdu.data
+        reservoir = RowReservoir(size)
+        for start in range(0, len(data), chunksize):
+            block = data[start:start + chunksize]
+            reservoir.update(np.column_stack([
+                np.asarray(block.field(name), dtype=np.float64) for name in (val_col, x_col, y_col)
+            ]))
+        return reservoir.sample
+
+def _image_blocks(hdu):
+    """
+    Yields the image as float64 blocks of whole rows along the first axis,
+    applying BSCALE/BZERO/BLANK per block instead of to the full array.
+    """
+    data = hdu.data  # memory-mapped, raw (unscaled) values
+    header = hdu.header
+    bscale = header.get('BSCALE', 1.0)
+    bzero = header.get('BZERO', 0.0)
+    blank = header.get('BLANK') if np.issubdtype(data.dtype, np.integer) else None
+
+    if data.ndim == 0:
+        return
+    row_pixels = max(1, data.size // data.shape[0])
+    step = max(1, BLOCK_PIXELS // row_pixels)
+    for start in range(0, data.shape[0], step):
+        raw = data[start:start + step]
+        block = raw.astype(np.float64)
+        if blank is not None:
+            block[raw == blank] = np.nan
+        if bscale != 1.0 or bzero != 0.0:
+            block = block * bscale + bzero
+        yield block
+
+def _process_image_data(hdu, info):
+    """
+    Image statistics via blocked reductions and a strided pixel preview.
+    """
+    data = hdu.data
+    if data is None or data.size == 0:
+        return
+
+    # Calculate Image Statistics block by block (NaNs are skipped)
+    running = RunningStats()
+    for block in _image_blocks(hdu):
+        running.update("value", block)
+
+    if running.count("value") == 0:
+        return
+
+    # 7. Generate Preview (Pixel Coordinate Grid)
+    # Use pixel indices for images to reflect actual data structure
+    num_samples = min(data.size, PREVIEW_POINTS)
+    
+    # Sample indices evenly; only these pixels are read from the memmap
+    indices = np.linspace(0, data.size - 1, num_samples, dtype=int)
+    raw = data.reshape(-1)[indices] if data.flags.c_contiguous else data.flat[indices]
+    values = raw.astype(np.float64)
+    blank = hdu.header.get('BLANK') if np.issubdtype(data.dtype, np.integer) else None
+    if blank is not None:
+        values[raw == blank] = np.nan
+    values = values * hdu.header.get('BSCALE', 1.0) + hdu.header.get('BZERO', 0.0)
+
+    # Map flat index to 2D coordinates
+    if data.ndim >= 2:
+        rows, cols = np.divmod(indices, data.shape[-1])
+    else:
+        rows, cols = np.zeros_like(indices), indices
+
+    preview = pd.DataFrame({
+        "id": np.arange(num_samples),
+        "value": np.nan_to_num(values, nan=0.0),
+        "x": cols.astype(np.float64),
+        "y": rows.astype(np.float64)
+    })
+    info["preview"] = preview.to_dict("records")
+    
+    # Statistics for Images
+    value_stats = running.describe("value", ddof=0)
+    info["stats"] = {
+        "numeric_columns": ["value", "x", "y"],
+        "mean": value_stats["mean"],
+        "shape": str(data.shape),
+        "samples": {
+            "value": {
+                "mean": value_stats["mean"],
+                "min": value_stats["min"],
+                "max": value_stats["max"],
+                "std": value_stats["std"],
+                "50%": value_stats["50%"]
+            }
+        }
+    }
+
 def _extract_header(header):
     """
     2. Extract and sanitize header metadata.
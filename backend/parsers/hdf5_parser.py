@@ -1,9 +1,21 @@
 import h5py
 import numpy as np
+import pandas as pd
+from parsers.streaming_stats import RunningStats, RowReservoir
+
+# Elements reduced per block; bounds memory regardless of dataset size
+BLOCK_ELEMENTS = 4_000_000
+# Table rows per frame handed to the ingestion pipeline
+TABLE_CHUNK_ROWS = 100_000
+PREVIEW_POINTS = 1000
 
 def parse_hdf5(filepath):
     """
     Parses an HDF5 file and returns metadata and basic statistics.
+
+    Every dataset in the file is summarised out-of-core: values are streamed
+    in blocks aligned to the dataset's native HDF5 chunks, and the preview is
+    read with point/hyperslab selections instead of loading the array.
     """
     try:
         with h5py.File(filepath, 'r') as f:
@@ -11,71 +23,41 @@ def parse_hdf5(filepath):
             # Extract attributes from the root group as general metadata
             for key, value in f.attrs.items():
                 metadata[key] = str(value)
-            
-            # Recursively explore to find datasets? 
-            # For this MVP, let's look for known astronomical keys or just the first dataset found.
-            
-            def find_first_dataset(group):
-                for key in group:
-                    item = group[key]
-                    if isinstance(item, h5py.Dataset):
-                        return item, key
-                    elif isinstance(item, h5py.Group):
-                        ds, name = find_first_dataset(item)
-                        if ds: return ds, name
-                return None, None
-
-            dataset, ds_name = find_first_dataset(f)
-            
+
+            # Walk the whole file, not just the first dataset found
+            datasets = []
+            f.visititems(lambda name, obj: datasets.append((name, obj)) if isinstance(obj, h5py.Dataset) else None)
+
             stats = {}
             preview_data = []
-            
-            if dataset:
-                # Handle large datasets carefully, maybe just read a sample
-                data = dataset[()] 
-                if np.issubdtype(data.dtype, np.number):
-                     stats = {
-                        "dataset_name": ds_name,
-                        "shape": str(data.shape),
-                        "mean": float(np.mean(data)),
-                        "std": float(np.std(data)),
-                        "min": float(np.min(data)),
-                        "max": float(np.max(data))
-                    }
-                     
-                     # Generate preview data for visualization
-                     flat_data = data.flatten()
-                     num_samples = min(len(flat_data), 1000)
-                     
-                     # Sample evenly across the dataset
-                     indices = np.linspace(0, len(flat_data) - 1, num_samples, dtype=int)
-                     
-                     for i, idx in enumerate(indices):
-                         val = flat_data[idx]
-                         
-                         # For 2D data, map back to row/col coordinates
-                         if len(data.shape) >= 2:
-                             row = idx // data.shape[1]
-                             col = idx % data.shape[1]
-                         else:
-                             row = 0
-                             col = idx
-                         
-                         preview_data.append({
-                             "id": i,
-                             "x": float(col),
-                             "y": float(row),
-                             "value": float(val) if not np.isnan(val) else 0.0
-                         })
-                else:
-                    stats = {
-                        "dataset_name": ds_name,
-                        "shape": str(data.shape),
-                        "message": "Non-numeric data"
-                    }
+            summaries = []
+            primary = None
+
+            for ds_name, dataset in datasets:
+                summary = _summarize_dataset(dataset, ds_name)
+                summaries.append(summary)
+                # The first numeric dataset is the analysis target
+                if primary is None and summary.get("numeric"):
+                    primary = (ds_name, dataset, summary)
+
+            if primary:
+                ds_name, dataset, summary = primary
+                stats = {k: v for k, v in summary.items() if k != "numeric"}
+                preview_data = _preview_dataset(dataset, summary)
+            elif summaries:
+                stats = {
+                    "dataset_name": summaries[0]["dataset_name"],
+                    "shape": summaries[0]["shape"],
+                    "message": "Non-numeric data"
+                }
             else:
                  stats = {"message": "No Value dataset found"}
 
+            if summaries:
+                stats["datasets"] = [
+                    {k: v for k, v in s.items() if k not in ("numeric", "samples")} for s in summaries
+                ]
+
             return {
                 "filename": filepath.split('\\')[-1],
                 "format": "HDF5",
@@ -86,3 +68,174 @@ def parse_hdf5(filepath):
 
     except Exception as e:
         raise Exception(f"Error parsing HDF5 file: {str(e)}")
+
+def _numeric_fields(dataset):
+    """Numeric field names of a compound (table-like) dataset."""
+    if dataset.ndim == 0:
+        return []
+    names = dataset.dtype.names or ()
+    return [n for n in names if np.issubdtype(dataset.dtype[n], np.number) and dataset.dtype[n].shape == ()]
+
+def _iter_blocks(dataset):
+    """
+    Yields row blocks along the first axis, sized to a multiple of the
+    dataset's native chunk rows so each HDF5 chunk is read exactly once.
+    """
+    if dataset.ndim == 0:
+        yield dataset[()]
+        return
+    row_elems = max(1, int(np.prod(dataset.shape[1:], dtype=np.int64)))
+    step = max(1, BLOCK_ELEMENTS // row_elems)
+    if dataset.chunks:
+        chunk_rows = dataset.chunks[0]
+        step = max(chunk_rows, (step // chunk_rows) * chunk_rows)
+    for start in range(0, dataset.shape[0], step):
+        yield dataset[start:start + step]
+
+def _summarize_dataset(dataset, ds_name):
+    """
+    Streaming (Welford) mean/std/min/max of one dataset in a single pass.
+    """
+    summary = {
+        "dataset_name": ds_name,
+        "shape": str(dataset.shape),
+        "dtype": str(dataset.dtype),
+        "numeric": False
+    }
+
+    if dataset.size == 0:
+        return summary
+
+    # Compound datasets are tables: summarise each numeric field
+    fields = _numeric_fields(dataset)
+    if fields:
+        running = RunningStats()
+        for block in _iter_blocks(dataset):
+            for name in fields:
+                running.update(name, block[name])
+        samples = running.describe_all()
+        summary.update({
+            "numeric": True,
+            "numeric_columns": fields,
+            "mean": float(np.nanmean([s["mean"] for s in samples.values()])),
+            "samples": samples
+        })
+        return summary
+
+    if not np.issubdtype(dataset.dtype, np.number):
+        return summary
+
+    running = RunningStats()
+    for block in _iter_blocks(dataset):
+        running.update("value", block)
+    value = running.describe("value", ddof=0)
+    summary.update({
+        "numeric": True,
+        "mean": value["mean"],
+        "std": value["std"],
+        "min": value["min"],
+        "max": value["max"],
+        "samples": {"value": value}
+    })
+    return summary
+
+def _plot_columns(fields):
+    x_col = next((c for c in fields if 'ra' in c.lower() or 'x' in c.lower()), fields[0])
+    y_col = next((c for c in fields if 'dec' in c.lower() or 'y' in c.lower()), fields[1] if len(fields) > 1 else fields[0])
+    val_col = next((c for c in fields if any(k in c.lower() for k in ['flux', 'mag', 'bright', 'val'])), fields[0])
+    return x_col, y_col, val_col
+
+def _table_frame(block, fields, start):
+    """Rows of a compound block as a frame with id (global row index), x, y and value."""
+    frame = pd.DataFrame(
+        {name: np.asarray(block[name], dtype=np.float64) for name in fields},
+        index=pd.RangeIndex(start, start + len(block))
+    )
+    x_col, y_col, val_col = _plot_columns(fields)
+    frame["id"] = frame.index
+    frame["x"] = frame[x_col]
+    frame["y"] = frame[y_col]
+    frame["value"] = frame[val_col]
+    return frame
+
+def iter_table_chunks(filepath, dataset_name, chunksize=TABLE_CHUNK_ROWS):
+    """
+    Streams every row of a compound (table-like) dataset as numeric
+    DataFrame chunks of up to `chunksize` rows for the ingestion pipeline.
+    Reads use the same chunk-aligned blocks as the statistics pass. Yields
+    nothing for plain arrays.
+    """
+    with h5py.File(filepath, 'r') as f:
+        dataset = f.get(dataset_name)
+        if not isinstance(dataset, h5py.Dataset):
+            return
+        fields = _numeric_fields(dataset)
+        if not fields:
+            return
+        start = 0
+        for block in _iter_blocks(dataset):
+            for offset in range(0, len(block), chunksize):
+                yield _table_frame(block[offset:offset + chunksize], fields, start + offset)
+            start += len(block)
+
+def table_fit_sample(filepath, dataset_name, size):
+    """
+    Uniform sample of the (value, x, y) rows of a whole compound dataset
+    (None for plain arrays), read in the same chunk-aligned blocks.
+    """
+    with h5py.File(filepath, 'r') as f:
+        dataset = f.get(dataset_name)
+        if not isinstance(dataset, h5py.Dataset):
+            return None
+        fields = _numeric_fields(dataset)
+        if not fields:
+            return None
+        x_col, y_col, val_col = _plot_columns(fields)
+        reservoir = RowReservoir(size)
+        for block in _iter_blocks(dataset):
+            reservoir.update(np.column_stack([
+                np.asarray(block[name], dtype=np.float64) for name in (val_col, x_col, y_col)
+            ]))
+        return reservoir.sample
+
+def _read_points(dataset, coords):
+    """Reads only the given element coordinates (n, ndim) via a point selection."""
+    space = dataset.id.get_space()
+    space.select_elements(np.ascontiguousarray(coords, dtype=np.uint64))
+    out = np.empty(len(coords), dtype=dataset.dtype)
+    dataset.id.read(h5py.h5s.create_simple((len(coords),)), space, out)
+    return out
+
+def _preview_dataset(dataset, summary):
+    """
+    Builds the visualization preview without materializing the dataset.
+    """
+    if summary.get("numeric_columns"):
+        # Tables: leading rows only (one bounded hyperslab read)
+        fields = summary["numeric_columns"]
+        subset = dataset[:min(dataset.shape[0], PREVIEW_POINTS)]
+        return _table_frame(subset, fields, 0).fillna(0.0).to_dict("records")
+
+    if dataset.ndim == 0:
+        return []
+
+    num_samples = min(dataset.size, PREVIEW_POINTS)
+
+    # Sample evenly across the dataset
+    indices = np.linspace(0, dataset.size - 1, num_samples, dtype=np.int64)
+    coords = np.stack(np.unravel_index(indices, dataset.shape), axis=1)
+    values = _read_points(dataset, coords).astype(np.float64)
+
+    # For 2D data, map back to row/col coordinates
+    if dataset.ndim >= 2:
+        rows, cols = np.divmod(indices, dataset.shape[-1])
+    else:
+        rows, cols = np.zeros_like(indices), indices
+
+    preview = pd.DataFrame({
+        "id": np.arange(num_samples),
+        "x": cols.astype(np.float64),
+        "y": rows.astype(np.float64),
+        "value": np.nan_to_num(values, nan=0.0)
+    })
+    return preview.to_dict("records")
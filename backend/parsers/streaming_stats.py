@@ -0,0 +1,125 @@
+import numpy as np
+
+
+class RunningStats:
+    """
+    Single-pass, bounded-memory column statistics.
+
+    Chunks are merged with the parallel Welford update (Chan et al.), so the
+    mean/std/min/max of a column are exact no matter how the data is split.
+    Quantiles are estimated from a fixed-size uniform reservoir sample.
+    """
+
+    def __init__(self, reservoir_size=10000, seed=42):
+        self.reservoir_size = reservoir_size
+        self._rng = np.random.default_rng(seed)
+        # column -> {"n", "mean", "m2", "min", "max", "nulls", "sample", "keys"}
+        self._columns = {}
+
+    def update(self, name, values):
+        """
+        Merge a chunk of values for one column. NaNs are counted as nulls.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        acc = self._columns.setdefault(name, {
+            "n": 0, "mean": 0.0, "m2": 0.0,
+            "min": np.inf, "max": -np.inf, "nulls": 0,
+            "sample": np.empty(0), "keys": np.empty(0)
+        })
+
+        finite = values[~np.isnan(values)]
+        acc["nulls"] += values.size - finite.size
+        n_b = finite.size
+        if n_b == 0:
+            return
+
+        mean_b = float(finite.mean())
+        m2_b = float(np.square(finite - mean_b).sum())
+        n_a = acc["n"]
+        n = n_a + n_b
+        delta = mean_b - acc["mean"]
+        acc["mean"] += delta * n_b / n
+        acc["m2"] += m2_b + delta * delta * n_a * n_b / n
+        acc["n"] = n
+        acc["min"] = min(acc["min"], float(finite.min()))
+        acc["max"] = max(acc["max"], float(finite.max()))
+
+        # Reservoir via random keys: keep the k smallest keys seen so far
+        keys = self._rng.random(n_b)
+        sample = np.concatenate([acc["sample"], finite])
+        all_keys = np.concatenate([acc["keys"], keys])
+        if sample.size > self.reservoir_size:
+            keep = np.argpartition(all_keys, self.reservoir_size)[:self.reservoir_size]
+            sample, all_keys = sample[keep], all_keys[keep]
+        acc["sample"], acc["keys"] = sample, all_keys
+
+    def update_frame(self, df):
+        """Merge every column of a (numeric) DataFrame chunk."""
+        for col in df.columns:
+            self.update(col, df[col].to_numpy(dtype=np.float64, na_value=np.nan))
+
+    @property
+    def columns(self):
+        return list(self._columns.keys())
+
+    def count(self, name):
+        return self._columns[name]["n"] if name in self._columns else 0
+
+    def nulls(self, name):
+        return self._columns[name]["nulls"] if name in self._columns else 0
+
+    def describe(self, name, ddof=1):
+        """
+        Returns a pandas.describe()-shaped dict for one column.
+        """
+        acc = self._columns.get(name)
+        if not acc or acc["n"] == 0:
+            return {"count": 0.0, "mean": float("nan"), "std": float("nan"),
+                    "min": float("nan"), "25%": float("nan"), "50%": float("nan"),
+                    "75%": float("nan"), "max": float("nan")}
+
+        n = acc["n"]
+        std = float(np.sqrt(acc["m2"] / (n - ddof))) if n > ddof else float("nan")
+        q25, q50, q75 = np.quantile(acc["sample"], [0.25, 0.5, 0.75])
+        return {
+            "count": float(n),
+            "mean": float(acc["mean"]),
+            "std": std,
+            "min": float(acc["min"]),
+            "25%": float(q25),
+            "50%": float(q50),
+            "75%": float(q75),
+            "max": float(acc["max"])
+        }
+
+    def describe_all(self, ddof=1):
+        return {name: self.describe(name, ddof=ddof) for name in self._columns}
+
+
+class RowReservoir:
+    """
+    Fixed-size uniform sample of whole rows from a stream of 2-D blocks,
+    using the same random-key scheme as RunningStats.
+    """
+
+    def __init__(self, size, seed=42):
+        self.size = size
+        self._rng = np.random.default_rng(seed)
+        self._rows = None
+        self._keys = np.empty(0)
+
+    def update(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim != 2 or len(block) == 0:
+            return
+        keys = self._rng.random(len(block))
+        rows = block if self._rows is None else np.concatenate([self._rows, block])
+        all_keys = np.concatenate([self._keys, keys])
+        if len(rows) > self.size:
+            keep = np.argpartition(all_keys, self.size)[:self.size]
+            rows, all_keys = rows[keep], all_keys[keep]
+        self._rows, self._keys = rows, all_keys
+
+    @property
+    def sample(self):
+        return self._rows if self._rows is not None else np.empty((0, 0))
@@ -0,0 +1,148 @@
+import io
+import numpy as np
+import pandas as pd
+import models
+from sky_index import valid_sky, zone_of
+
+# Rows sent per executemany/COPY round-trip
+BATCH_SIZE = 10000
+
+# Golden-record columns captured from standardized columns: db column -> standard name
+STANDARD_FIELDS = {
+    "temperature": "temperature",
+    "velocity": "velocity",
+    "redshift": "redshift",
+    "pm_ra": "proper_motion_ra",
+    "pm_dec": "proper_motion_dec",
+    "epoch": "epoch"
+}
+
+class StandardizedRowWriter:
+    """
+    Bulk persistence for the StandardizedData rows of one dataset.
+
+    The column -> standard-name lookup is resolved once per column layout
+    instead of per row, rows are built column-wise from pipeline frames, and
+    batches are written with a single executemany (COPY on PostgreSQL).
+    With a `columnar` writer (columnar_store.ColumnarWriter) the same rows
+    are also appended to the dataset's Arrow files.
+    """
+
+    COLUMNS = [
+        "dataset_id", "original_id", "ra", "dec", "brightness",
+        "temperature", "velocity", "redshift", "pm_ra", "pm_dec", "epoch",
+        "brightness_unit", "object_type", "sky_zone"
+    ]
+
+    def __init__(self, db, dataset_id, standardization=None, metadata=None, batch_size=BATCH_SIZE, columnar=None):
+        self.db = db
+        self.dataset_id = dataset_id
+        self.mapping = (standardization or {}).get("mapping", {})
+        self.brightness_unit = (metadata or {}).get("BUNIT", "unknown")
+        self.batch_size = batch_size
+        self.columnar = columnar
+        self._sources = {}  # tuple(frame columns) -> {standard_field: source column}
+        self.rows_written = 0
+
+    def resolve_sources(self, columns):
+        """
+        For each golden-record column, the frame column holding its value:
+        the standard name itself if already standardized, else the first
+        original column mapped to it.
+        """
+        key = tuple(columns)
+        if key not in self._sources:
+            present = set(columns)
+            sources = {}
+            for field, standard in STANDARD_FIELDS.items():
+                if standard in present:
+                    sources[field] = standard
+                    continue
+                sources[field] = next(
+                    (orig for orig, std in self.mapping.items() if std == standard and orig in present), None
+                )
+            self._sources[key] = sources
+        return self._sources[key]
+
+    def build_rows(self, frame, anomaly_ids=()):
+        """
+        Vectorized conversion of a pipeline frame (id/x/y/value + original
+        columns) into a DataFrame laid out like the standardized_data table.
+        """
+        n = len(frame)
+        sources = self.resolve_sources(frame.columns)
+
+        def column(name):
+            return frame[name] if name in frame.columns else pd.Series([np.nan] * n, index=frame.index)
+
+        ids = column("id")
+        ra, dec = column("x"), column("y")
+        # Sky index key only for real coordinates (image previews carry pixel x/y)
+        on_sky = valid_sky(ra, dec)
+        sky_zone = pd.Series(zone_of(dec.where(on_sky, 0.0)), index=frame.index).where(on_sky)
+
+        rows = pd.DataFrame({
+            "dataset_id": self.dataset_id,
+            "original_id": ids.astype(str),
+            "ra": ra,   # Rows have x(RA), y(Dec), value(Brightness)
+            "dec": dec,
+            "brightness": column("value"),
+            **{field: column(src) if src else np.nan for field, src in sources.items()},
+            "brightness_unit": self.brightness_unit,
+            # PROACTIVE: Store AI flags if detected
+            "object_type": np.where(ids.isin(list(anomaly_ids)), "ANOMALY", None),
+            "sky_zone": sky_zone.astype("Int64")
+        }, index=frame.index)
+        return rows[self.COLUMNS]
+
+    def write_frame(self, frame, anomaly_ids=()):
+        """Builds and writes all rows of one frame in batches. Returns the row count."""
+        rows = self.build_rows(frame, anomaly_ids)
+        for start in range(0, len(rows), self.batch_size):
+            self._write_batch(rows.iloc[start:start + self.batch_size])
+        if self.columnar is not None:
+            self.columnar.write(rows)
+        self.rows_written += len(rows)
+        return len(rows)
+
+    def _write_batch(self, rows):
+        if self.db.get_bind().dialect.name == "postgresql":
+            self._copy_batch(rows)
+            return
+        # NaN -> NULL, numpy scalars -> Python values for the DB-API driver
+        records = rows.astype(object).where(rows.notna(), None).to_dict("records")
+        self.db.execute(models.StandardizedData.__table__.insert(), records)
+
+    def _copy_batch(self, rows):
+        """PostgreSQL fast path: stream the batch through COPY ... FROM STDIN."""
+        buffer = io.StringIO()
+        rows.to_csv(buffer, index=False, header=False, na_rep="")
+        buffer.seek(0)
+        cursor = self.db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {models.StandardizedData.__tablename__} ({', '.join(self.COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+        finally:
+            cursor.close()
+
+def write_predictions(db, dataset_id, predictions, method, batch_size=BATCH_SIZE):
+    """
+    Bulk-inserts columnar DataCompleter predictions (parallel "id", "column",
+    "predicted_value", "confidence" arrays) into the imputed_values side table.
+    Returns the row count.
+    """
+    n = len(predictions["id"])
+    table = models.ImputedValue.__table__
+    for start in range(0, n, batch_size):
+        stop = start + batch_size
+        db.execute(table.insert(), [
+            {"dataset_id": dataset_id, "original_id": str(row_id), "column_name": col,
+             "predicted_value": value, "confidence": conf, "method": method}
+            for row_id, col, value, conf in zip(
+                predictions["id"][start:stop].tolist(), predictions["column"][start:stop].tolist(),
+                predictions["predicted_value"][start:stop].tolist(), predictions["confidence"][start:stop].tolist()
+            )
+        ])
+    return n
@@ -1,24 +1,40 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
-from sklearn.impute import KNNImputer
+from sklearn.neighbors import KDTree
 from sklearn.linear_model import LinearRegression
 from sklearn.experimental import enable_iterative_imputer
 from sklearn.impute import IterativeImputer
 
+# Gap rows queried against the donor tree per batch (bounds memory)
+QUERY_BATCH_SIZE = 50000
+# Donors sampled to estimate the typical neighbour spacing
+SPACING_SAMPLE = 2000
+# Plot aliases the parsers add next to the source columns
+PLOT_ALIASES = ("x", "y", "value")
+
 class DataCompleter:
     """
     Predictive system to detect and fill missing astronomical data.
     """
 
-    def __init__(self):
-        self.spatial_imputer = KNNImputer(n_neighbors=5, weights="distance")
+    def __init__(self, n_neighbors=5, n_jobs=1):
+        self.n_neighbors = n_neighbors
+        # Columns can be imputed in parallel threads (KD-tree queries release
+        # the GIL). Ingestion already runs one worker process per core, so the
+        # default is a single thread; n_jobs=None uses every core
+        self.n_jobs = n_jobs or os.cpu_count() or 1
         
-    def analyze_and_predict(self, data_list):
+    def analyze_and_predict(self, data_list, columnar=False):
         """
         Main pipeline to detect gaps and propose completions.
         
         Args:
-            data_list (list): List of dicts representing the dataset.
+            data_list (list | pd.DataFrame): List of dicts (or a frame) representing the dataset.
+            columnar (bool): Return predictions as parallel NumPy arrays
+                {"id", "column", "predicted_value", "confidence"} instead of
+                one dict per filled cell.
             
         Returns:
             dict: {
@@ -30,17 +46,19 @@ class DataCompleter:
                 "missing_stats": { col: count }
             }
         """
-        if not data_list:
+        if data_list is None or len(data_list) == 0:
             return {"has_missing": False}
 
         df = pd.DataFrame(data_list)
         
         # 1. Detect Missing Values
         # Replace common placeholders with NaN
-        df.replace(['NaN', 'nan', '', 'None', 'null'], np.nan, inplace=True)
+        df = df.replace(['NaN', 'nan', '', 'None', 'null'], np.nan)
         
-        # Check numeric columns only for now (MVP)
+        # Check numeric columns only for now (MVP). Plot aliases that copy a
+        # source column are neither features nor targets of their own
         numeric_df = df.select_dtypes(include=[np.number])
+        numeric_df = numeric_df.drop(columns=self._alias_columns(numeric_df))
         missing_stats = numeric_df.isnull().sum().to_dict()
         total_missing = sum(missing_stats.values())
         
@@ -52,8 +70,6 @@ class DataCompleter:
         time_cols = [c for c in df.columns if any(x in c.lower() for x in ['time', 'date', 'mjd', 'jd'])]
         is_temporal = len(time_cols) > 0 and df[time_cols[0]].is_monotonic_increasing
         
-        predictions = []
-        
         if is_temporal:
             predictions = self._predict_temporal(df, numeric_df, time_cols[0])
             gap_type = "temporal"
@@ -65,78 +81,181 @@ class DataCompleter:
             "has_missing": True,
             "gap_type": gap_type,
             "missing_stats": {k:v for k,v in missing_stats.items() if v > 0},
-            "predictions": predictions
+            "predictions": predictions if columnar else self._prediction_rows(predictions)
         }
 
     def _predict_temporal(self, df, numeric_df, time_col):
         """
         Handle time-series gaps using interpolation/regression.
+
+        Confidence falls with the interpolation span: a single missing sample
+        between regular neighbours scores 95, longer spans proportionally
+        less, and gaps beyond the last known point (held, not interpolated) half that.
         """
-        predictions = []
+        parts = []
         # Sort by time just in case
         df_sorted = df.sort_values(by=time_col)
+        times = pd.Series(self._time_values(df_sorted[time_col]), index=df_sorted.index)
+        step = times.diff()
+        step = float(step[step > 0].median()) if (step > 0).any() else 1.0
         
         for col in numeric_df.columns:
-            if df_sorted[col].isnull().sum() == 0:
+            values = df_sorted[col]
+            missing = values.isnull()
+            if not missing.any():
                 continue
                 
             # Linear Interpolation for temporal gaps
             # In a real system, we might use ARIMA or Gaussian Processes here
-            interpolated = df_sorted[col].interpolate(method='linear')
-            
-            # Identify filled rows
-            missing_indices = df_sorted[df_sorted[col].isnull()].index
-            
-            for idx in missing_indices:
-                val = interpolated.loc[idx]
-                predictions.append({
-                    "id": int(idx),
-                    "column": col,
-                    "predicted_value": float(val) if not pd.isna(val) else 0.0,
-                    "confidence": 85.0 # High confidence for linear interpolation between known points
-                })
+            interpolated = values.interpolate(method='linear')
+
+            known_times = times.where(~missing)
+            prev_t = known_times.ffill()[missing]
+            next_t = known_times.bfill()[missing]
+            span = (next_t - prev_t).to_numpy()
+            confidence = 95.0 * np.minimum(1.0, 2.0 * step / np.maximum(span, 1e-12))
+            # Trailing gaps are held at the last value; leading ones have nothing
+            trailing = next_t.isnull().to_numpy() & prev_t.notnull().to_numpy()
+            held = times[missing].to_numpy() - prev_t.to_numpy()
+            confidence[trailing] = 47.5 * np.minimum(1.0, step / np.maximum(held[trailing], 1e-12))
+            confidence[prev_t.isnull().to_numpy()] = 0.0
+
+            parts.append((missing[missing].index, col, interpolated[missing].fillna(0.0).to_numpy(), confidence))
                 
-        return predictions
+        return self._columnar(parts)
 
     def _predict_spatial(self, df, numeric_df):
         """
         Handle spatial/random gaps using KNN (finding similar objects).
+
+        Per column with gaps: a KD-tree over the scaled other features of the
+        rows that have the value, queried only by the rows that lack it.
+        Gap rows are grouped by which features they have, and each group
+        searches only those features. Confidence combines neighbour proximity
+        (relative to the typical donor spacing) with how well the neighbours
+        agree.
         """
-        predictions = []
-        
-        # We need a complete matrix for training. 
-        # For KNNImputer, we can pass the matrix with NaNs directly.
-        
-        # Fit and Transform
-        # Use standard scaler? KNN works best with scaled data, but for MVP strict value preservation 
-        # is often preferred visually. Let's assume standardized units or raw.
-        
-        imputed_array = self.spatial_imputer.fit_transform(numeric_df)
-        imputed_df = pd.DataFrame(imputed_array, columns=numeric_df.columns, index=numeric_df.index)
-        
-        # Extract predictions
-        for col in numeric_df.columns:
-            missing_indices = numeric_df[numeric_df[col].isnull()].index
-            
-            if len(missing_indices) == 0:
+        # Row ids are not a physical feature
+        features = numeric_df.drop(columns=[c for c in ['id'] if c in numeric_df.columns])
+        values = features.to_numpy(dtype=np.float64)
+        # Scale so no feature dominates the distance
+        mean = np.nanmean(values, axis=0)
+        std = np.nanstd(values, axis=0)
+        std[~(std > 0)] = 1.0
+        scaled = (values - mean) / std
+        present = ~np.isnan(scaled)
+
+        targets = [c for c in features.columns if features[c].isnull().any()]
+        with ThreadPoolExecutor(max_workers=min(self.n_jobs, max(1, len(targets)))) as pool:
+            results = pool.map(lambda col: self._impute_column(numeric_df, features, scaled, present, col), targets)
+            return self._columnar([part for part in results if part is not None])
+
+    def _impute_column(self, numeric_df, features, scaled, present, col):
+        target = numeric_df[col].to_numpy(dtype=np.float64)
+        missing = np.isnan(target)
+        if missing.all():
+            return None
+
+        # Search space: every feature except the one being predicted
+        keep = np.array([i for i, c in enumerate(features.columns) if c != col], dtype=np.int64)
+        gap_rows = np.nonzero(missing)[0]
+        predicted = np.empty(len(gap_rows))
+        confidence = np.empty(len(gap_rows))
+
+        patterns, group = np.unique(present[gap_rows][:, keep], axis=0, return_inverse=True)
+        for i, pattern in enumerate(patterns):
+            rows = np.nonzero(group.ravel() == i)[0]
+            cols = keep[pattern]
+            # Donors need the target and every feature this group searches on
+            donors = ~missing & present[:, cols].all(axis=1)
+            if not len(cols) or not donors.any():
+                # Nothing to compare on: fall back to the column mean
+                predicted[rows] = np.mean(target[~missing])
+                confidence[rows] = 0.0
                 continue
+            predicted[rows], confidence[rows] = self._knn(
+                scaled[donors][:, cols], target[donors], scaled[gap_rows[rows]][:, cols]
+            )
 
-            for idx in missing_indices:
-                pred_val = imputed_df.loc[idx, col]
-                
-                # Heuristic Confidence calculation
-                # Detailed distance metrics are hard to extract from sklearn's standard wrapper
-                # so we estimate based on variance of the feature
-                confidence = 70.0 # Baseline for KNN
-                
-                predictions.append({
-                    "id": int(idx),
-                    "column": col,
-                    "predicted_value": float(pred_val),
-                    "confidence": confidence
-                })
-                
-        return predictions
+        return numeric_df.index[gap_rows], col, predicted, confidence
+
+    def _knn(self, donor_points, donor_values, queries):
+        """Inverse-distance KNN estimate and confidence for each query point."""
+        k = min(self.n_neighbors, len(donor_values))
+        tree = KDTree(donor_points)
+
+        # Typical donor spacing: mean distance to k neighbours within the donors
+        rng = np.random.default_rng(42)
+        probe = rng.choice(len(donor_points), min(SPACING_SAMPLE, len(donor_points)), replace=False)
+        probe_dist, _ = tree.query(donor_points[probe], k=min(k + 1, len(donor_points)))
+        spacing = float(np.median(probe_dist[:, 1:].mean(axis=1))) if probe_dist.shape[1] > 1 else 0.0
+        spread = float(np.std(donor_values)) or 1.0
+
+        predicted = np.empty(len(queries))
+        confidence = np.empty(len(queries))
+        for start in range(0, len(queries), QUERY_BATCH_SIZE):
+            batch = slice(start, start + QUERY_BATCH_SIZE)
+            dist, idx = tree.query(queries[batch], k=k)
+            neighbour_values = donor_values[idx]
+
+            # Inverse-distance weights; exact matches take all the weight
+            exact = dist <= 1e-12
+            weights = np.where(exact.any(axis=1, keepdims=True), exact.astype(float), 1.0 / np.maximum(dist, 1e-12))
+            weights /= weights.sum(axis=1, keepdims=True)
+            estimate = (weights * neighbour_values).sum(axis=1)
+            dispersion = np.sqrt((weights * (neighbour_values - estimate[:, None]) ** 2).sum(axis=1))
+
+            mean_dist = dist.mean(axis=1)
+            proximity = np.where(mean_dist > spacing, spacing / np.maximum(mean_dist, 1e-12), 1.0)
+            agreement = 1.0 / (1.0 + dispersion / spread)
+            predicted[batch] = estimate
+            confidence[batch] = 100.0 * proximity * agreement
+
+        return predicted, confidence
+
+    @staticmethod
+    def _alias_columns(numeric_df):
+        """Plot alias columns (x/y/value) that duplicate another column."""
+        sources = [c for c in numeric_df.columns if c not in PLOT_ALIASES and c != 'id']
+        return [
+            alias for alias in PLOT_ALIASES if alias in numeric_df.columns
+            and any(np.array_equal(numeric_df[alias].to_numpy(dtype=np.float64, na_value=np.nan),
+                                   numeric_df[c].to_numpy(dtype=np.float64, na_value=np.nan), equal_nan=True)
+                    for c in sources)
+        ]
+
+    @staticmethod
+    def _columnar(parts):
+        """Concatenates per-column (index, col, values, confidence) parts into parallel arrays."""
+        if not parts:
+            return {"id": np.empty(0, dtype=np.int64), "column": np.empty(0, dtype=object),
+                    "predicted_value": np.empty(0), "confidence": np.empty(0)}
+        return {
+            "id": np.concatenate([np.asarray(index, dtype=np.int64) for index, _, _, _ in parts]),
+            "column": np.concatenate([np.full(len(index), col, dtype=object) for index, col, _, _ in parts]),
+            "predicted_value": np.concatenate([np.asarray(values, dtype=np.float64) for _, _, values, _ in parts]),
+            "confidence": np.round(np.concatenate([np.asarray(conf, dtype=np.float64) for _, _, _, conf in parts]), 1)
+        }
+
+    @staticmethod
+    def _prediction_rows(columnar):
+        """Row-per-cell view of columnar predictions (the original response shape)."""
+        return [
+            {"id": idx, "column": col, "predicted_value": val, "confidence": conf}
+            for idx, col, val, conf in zip(
+                columnar["id"].tolist(), columnar["column"].tolist(),
+                columnar["predicted_value"].tolist(), columnar["confidence"].tolist()
+            )
+        ]
+
+    @staticmethod
+    def _time_values(series):
+        """Numeric time axis (MJD/JD as-is, dates as seconds)."""
+        numeric = pd.to_numeric(series, errors="coerce")
+        if numeric.notnull().any():
+            return numeric.to_numpy(dtype=np.float64)
+        stamps = pd.to_datetime(series, errors="coerce")
+        return (stamps - pd.Timestamp(0)).dt.total_seconds().to_numpy()
 
 if __name__ == "__main__":
     # Test
@@ -0,0 +1,94 @@
+import json
+from typing import Dict, Any
+
+# Redis keys of a room: member sid -> user JSON, and cursor slot -> sid
+PRESENCE_KEY = "collab:presence:{room}"
+SLOTS_KEY = "collab:slots:{room}"
+# Presence of a room expires unless a worker with members in it refreshes it,
+# so rooms left behind by a crashed worker clean themselves up
+PRESENCE_TTL = 60
+MAX_SLOTS = 65536
+
+class InMemoryPresence:
+    """
+    Room membership for a single process (and tests): room -> {sid: user}.
+    Each member holds the lowest free slot of its room.
+    """
+
+    def __init__(self):
+        self.rooms: Dict[str, Dict[str, Any]] = {}
+
+    async def join(self, room, sid, user):
+        members = self.rooms.setdefault(room, {})
+        taken = {u["slot"] for u in members.values()}
+        user = dict(user, slot=next(i for i in range(len(members) + 1) if i not in taken))
+        members[sid] = user
+        return user
+
+    async def leave(self, room, sid):
+        members = self.rooms.get(room, {})
+        members.pop(sid, None)
+        if not members:
+            self.rooms.pop(room, None)
+
+    async def members(self, room):
+        return list(self.rooms.get(room, {}).values())
+
+    async def refresh(self, rooms):
+        pass
+
+class RedisPresence:
+    """
+    Room membership shared by every worker/node through a Redis-compatible
+    server (Redis, Valkey, KeyDB). Slots are claimed with HSETNX, so two
+    workers never hand out the same slot in a room.
+    """
+
+    def __init__(self, url, client=None):
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url, decode_responses=True)
+        self.redis = client
+
+    async def join(self, room, sid, user):
+        slots = SLOTS_KEY.format(room=room)
+        for slot in range(MAX_SLOTS):
+            if await self.redis.hsetnx(slots, slot, sid):
+                break
+        else:
+            raise RuntimeError(f"Room {room} is full")
+        user = dict(user, slot=slot)
+        presence = PRESENCE_KEY.format(room=room)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(presence, sid, json.dumps(user))
+            pipe.expire(presence, PRESENCE_TTL)
+            pipe.expire(slots, PRESENCE_TTL)
+            await pipe.execute()
+        return user
+
+    async def leave(self, room, sid):
+        raw = await self.redis.hget(PRESENCE_KEY.format(room=room), sid)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hdel(PRESENCE_KEY.format(room=room), sid)
+            if raw is not None:
+                pipe.hdel(SLOTS_KEY.format(room=room), json.loads(raw)["slot"])
+            await pipe.execute()
+
+    async def members(self, room):
+        values = await self.redis.hvals(PRESENCE_KEY.format(room=room))
+        return [json.loads(v) for v in values]
+
+    async def refresh(self, rooms):
+        """Extends the TTL of rooms this worker still has members in."""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for room in rooms:
+                pipe.expire(PRESENCE_KEY.format(room=room), PRESENCE_TTL)
+                pipe.expire(SLOTS_KEY.format(room=room), PRESENCE_TTL)
+            await pipe.execute()
+
+def is_redis_url(url):
+    return bool(url) and url.split("://", 1)[0] in ("redis", "rediss", "unix")
+
+def make_presence(url):
+    """RedisPresence for a redis:// bus URL, else the in-process store."""
+    return RedisPresence(url) if is_redis_url(url) else InMemoryPresence()
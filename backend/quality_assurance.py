@@ -6,11 +6,50 @@ class QualityScorer:
     Calculates a real Data Quality Score for astronomical datasets.
     """
 
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Clears the running counters used by update()/report()."""
+        self._rows = 0
+        self._total_cells = 0
+        self._missing_cells = 0
+        self._ra_out = False
+        self._dec_out = False
+
     def analyze(self, df, metadata, ai_analysis):
         """
         Calculates score based on multiple metrics.
         """
+        self.reset()
+        self.update(df)
+        return self.report(metadata, ai_analysis)
+
+    def update(self, df):
+        """
+        Accumulates the raw counts behind the metrics from one chunk of rows,
+        so a dataset can be scored without holding it in memory.
+        """
         if df.empty:
+            return
+
+        self._rows += len(df)
+        self._total_cells += df.size
+        self._missing_cells += int(df.isnull().sum().sum())
+
+        # Coordinate ranges (RA 0-360, Dec -90-90)
+        ra_cols = [c for c in df.columns if 'ra' in c.lower() or 'x' in c.lower()]
+        dec_cols = [c for c in df.columns if 'dec' in c.lower() or 'y' in c.lower()]
+        if ra_cols and not self._ra_out:
+            self._ra_out = bool(((df[ra_cols[0]] < 0) | (df[ra_cols[0]] > 360)).any())
+        if dec_cols and not self._dec_out:
+            self._dec_out = bool(((df[dec_cols[0]] < -90) | (df[dec_cols[0]] > 90)).any())
+
+    def report(self, metadata, ai_analysis):
+        """
+        Builds the score from everything passed to update() so far.
+        """
+        if self._rows == 0:
             return self._empty_report()
 
         report = {
@@ -26,8 +65,8 @@ class QualityScorer:
 
         # 1. COMPLETENESS (30 points)
         # Ratio of non-null values
-        total_cells = df.size
-        missing_cells = df.isnull().sum().sum()
+        total_cells = self._total_cells
+        missing_cells = self._missing_cells
         completeness_ratio = (total_cells - missing_cells) / total_cells if total_cells > 0 else 0
         report["metrics"]["completeness"] = completeness_ratio * 100
         
@@ -39,21 +78,14 @@ class QualityScorer:
         # 2. VALIDITY (30 points)
         # Coordinate ranges (RA 0-360, Dec -90-90)
         valid_coords = True
-        ra_cols = [c for c in df.columns if 'ra' in c.lower() or 'x' in c.lower()]
-        dec_cols = [c for c in df.columns if 'dec' in c.lower() or 'y' in c.lower()]
-
         validity_score = 100
-        if ra_cols:
-            ra_out = df[(df[ra_cols[0]] < 0) | (df[ra_cols[0]] > 360)]
-            if not ra_out.empty:
-                validity_score -= 50
-                valid_coords = False
+        if self._ra_out:
+            validity_score -= 50
+            valid_coords = False
         
-        if dec_cols:
-            dec_out = df[(df[dec_cols[0]] < -90) | (df[dec_cols[0]] > 90)]
-            if not dec_out.empty:
-                validity_score -= 50
-                valid_coords = False
+        if self._dec_out:
+            validity_score -= 50
+            valid_coords = False
 
         report["metrics"]["validity"] = max(0, validity_score)
         if valid_coords:
@@ -72,11 +104,11 @@ class QualityScorer:
              report["metrics"]["consistency"] = 70
 
         # 4. STABILITY / ANOMALIES (20 points)
-        anomaly_count = len(ai_analysis.get("anomalies", []))
+        anomaly_count = ai_analysis.get("anomalies_count", len(ai_analysis.get("anomalies", [])))
         stability_score = 100
         if anomaly_count > 0:
             # Drop score based on anomaly density
-            stability_score = max(0, 100 - (anomaly_count / len(df) * 500))
+            stability_score = max(0, 100 - (anomaly_count / self._rows * 500))
             report["checks"].append({"label": f"{anomaly_count} potential outliers detected", "status": "warn"})
         else:
             report["checks"].append({"label": "No significant outliers", "status": "pass"})
@@ -0,0 +1,274 @@
+import io
+import os
+import html
+import base64
+import textwrap
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_pdf import PdfPages
+from database import SessionLocal
+from report_generator import cached_report
+from columnar_store import open_dataset
+from sky_lod import query_lod
+from image_tiles import open_pyramid
+import models
+
+# Root of the rendered report files: dataset=<id>/v<version>.<format>
+REPORTS_DIR = os.getenv("REPORTS_DIR", "report_store")
+EXPORT_FORMATS = ("html", "pdf")
+MEDIA_TYPES = {"html": "text/html", "pdf": "application/pdf"}
+
+# Stored columns plotted as histograms (when the dataset has values for them)
+HISTOGRAM_COLUMNS = ("brightness", "temperature", "redshift", "velocity")
+HISTOGRAM_BINS = 50
+# HEALPix order the sky density map is binned from (nside 256, ~0.23 deg
+# pixels, at least ~12 per raster cell)
+SKY_MAP_ORDER = 8
+# Largest raster the map is drawn on (rows x 2*rows cells); sparse catalogs
+# get coarser cells holding SKY_MAP_PER_CELL objects on average
+SKY_MAP_MAX_ROWS = 180
+SKY_MAP_MIN_ROWS = 18
+SKY_MAP_PER_CELL = 10
+
+def artifact_name(dataset_id, version, fmt):
+    return f"report-{dataset_id}-v{version or 0}.{fmt}"
+
+def artifact_path(dataset_id, version, fmt):
+    return os.path.join(REPORTS_DIR, f"dataset={dataset_id}", f"v{version or 0}.{fmt}")
+
+def _histogram(columnar, name):
+    """
+    Fixed-bin histogram of one stored column, built region by region so only
+    one memory-mapped partition is scanned at a time. None if the column is empty.
+    """
+    lo, hi = np.inf, -np.inf
+    for region in columnar.regions:
+        values = columnar.column(name, regions=[region])
+        values = values[np.isfinite(values)]
+        if values.size:
+            lo, hi = min(lo, values.min()), max(hi, values.max())
+    if not np.isfinite(lo):
+        return None
+    edges = np.linspace(lo, hi if hi > lo else lo + 1.0, HISTOGRAM_BINS + 1)
+    counts = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+    for region in columnar.regions:
+        values = columnar.column(name, regions=[region])
+        counts += np.histogram(values[np.isfinite(values)], bins=edges)[0]
+    return counts, edges
+
+def _sky_map(folder):
+    """(caption, Figure) of the LOD pyramid's object density, or None without sky data."""
+    sky = query_lod(folder, order=SKY_MAP_ORDER)
+    if not sky or not sky["total_count"]:
+        return None
+
+    # Counts of the (much smaller) pyramid pixels are summed per raster cell,
+    # so even a compact field lands in the cells it covers. Rows are uniform
+    # in sin(dec), so every cell has the same area and polar cells never get
+    # smaller than a pixel. Mollweide longitude runs -pi..pi and RA
+    # increases to the left.
+    rows = int(np.clip(np.sqrt(sky["total_count"] / SKY_MAP_PER_CELL / 2), SKY_MAP_MIN_ROWS, SKY_MAP_MAX_ROWS))
+    cols = 2 * rows
+    lon = np.linspace(np.pi, -np.pi, cols + 1)
+    lat = np.arcsin(np.linspace(-1.0, 1.0, rows + 1))
+    ra, dec = np.asarray(sky["ra"]), np.asarray(sky["dec"])
+    # Longitude edges run from +pi down, i.e. RA -180 (180) upwards
+    col = np.clip(((ra + 180.0) % 360.0 * cols / 360.0).astype(int), 0, cols - 1)
+    row = np.clip(((np.sin(np.radians(dec)) + 1.0) * rows / 2.0).astype(int), 0, rows - 1)
+    grid = np.zeros((rows, cols))
+    np.add.at(grid, (row, col), sky["count"])
+    grid /= 4 * np.pi * np.degrees(1) ** 2 / (rows * cols)
+
+    fig = Figure(figsize=(8, 4.5))
+    ax = fig.add_subplot(projection="mollweide")
+    occupied = grid[grid > 0]
+    mesh = ax.pcolormesh(lon, lat, np.ma.masked_equal(grid, 0), cmap="viridis", shading="flat",
+                         norm="log" if occupied.max() > 10 * occupied.min() else None)
+    ax.set_xticklabels([])
+    ax.grid(True, alpha=0.3)
+    fig.colorbar(mesh, ax=ax, orientation="horizontal", pad=0.05, label="objects per deg²")
+    return f"Sky density ({sky['total_count']} objects)", fig
+
+def build_figures(dataset):
+    """(caption, Figure) pairs: column histograms, the sky density map and an image preview."""
+    figures = []
+    columnar = open_dataset(dataset)
+    if columnar is not None:
+        for name in HISTOGRAM_COLUMNS:
+            hist = _histogram(columnar, name)
+            if hist is None:
+                continue
+            counts, edges = hist
+            fig = Figure(figsize=(7, 3.5))
+            ax = fig.add_subplot()
+            ax.stairs(counts, edges, fill=True, alpha=0.7)
+            ax.set_xlabel(name)
+            ax.set_ylabel("rows")
+            figures.append((f"Distribution of {name} ({int(counts.sum())} rows)", fig))
+
+        fig = _sky_map(dataset.columnar_path)
+        if fig is not None:
+            figures.append(fig)
+
+    pyramid = open_pyramid(dataset)
+    if pyramid is not None:
+        # z=0 is the whole image in a single tile
+        image = pyramid.tile(0, 0, 0)
+        finite = image[np.isfinite(image)]
+        if finite.size:
+            lo, hi = np.percentile(finite, [1, 99])
+            fig = Figure(figsize=(5, 5))
+            ax = fig.add_subplot()
+            ax.imshow(image, origin="lower", cmap="gray", vmin=lo, vmax=hi)
+            ax.set_axis_off()
+            figures.append(("Image preview (1-99 percentile stretch)", fig))
+    return figures
+
+def _stats_rows(statistics):
+    samples = (statistics or {}).get("samples", {})
+    rows = []
+    for name, s in samples.items():
+        rows.append([name, f"{int(s.get('count') or 0)}"] + [
+            "" if s.get(key) is None or s[key] != s[key] else f"{s[key]:.4g}"
+            for key in ("mean", "std", "min", "50%", "max")
+        ])
+    return rows
+
+STATS_HEADER = ["column", "count", "mean", "std", "min", "median", "max"]
+
+def _sections(report):
+    results = report["results"]
+    return [
+        ("Abstract", report["abstract"]),
+        ("1. Introduction", report["introduction"]),
+        ("2. Data & Methodology", report["methodology"]),
+        ("3. Results", results["summary"] + "\n" + "\n".join(f"- {f}" for f in results["key_findings"])),
+        ("4. Discussion", report["discussion"]),
+        ("5. Conclusion", report["conclusion"]),
+    ]
+
+def render_html(report, figures, statistics, path):
+    """Self-contained HTML: figures are embedded as base64 PNGs."""
+    parts = [
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>",
+        f"<title>{html.escape(report['title'])}</title>",
+        "<style>body{font-family:Georgia,serif;max-width:52em;margin:2em auto;line-height:1.5}"
+        "table{border-collapse:collapse}td,th{border:1px solid #999;padding:2px 8px;text-align:right}"
+        "figure{margin:1.5em 0}img{max-width:100%}</style></head><body>",
+        f"<h1>{html.escape(report['title'])}</h1>"
+    ]
+    for heading, body in _sections(report):
+        paragraphs = "".join(f"<p>{html.escape(line)}</p>" for line in body.splitlines() if line.strip())
+        parts.append(f"<h2>{html.escape(heading)}</h2>{paragraphs}")
+
+    rows = _stats_rows(statistics)
+    if rows:
+        parts.append("<h2>Column statistics</h2><table><tr>")
+        parts.append("".join(f"<th>{h}</th>" for h in STATS_HEADER) + "</tr>")
+        for row in rows:
+            parts.append("<tr>" + "".join(f"<td>{html.escape(str(v))}</td>" for v in row) + "</tr>")
+        parts.append("</table>")
+
+    for caption, fig in figures:
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=110, bbox_inches="tight")
+        encoded = base64.b64encode(buf.getvalue()).decode("ascii")
+        parts.append(f"<figure><img src='data:image/png;base64,{encoded}'>"
+                     f"<figcaption>{html.escape(caption)}</figcaption></figure>")
+
+    parts.append("<h2>References</h2><ul>")
+    parts.extend(f"<li>{html.escape(r)}</li>" for r in report["references"])
+    parts.append("</ul></body></html>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join(parts))
+
+def _text_pages(report):
+    """A4 pages of wrapped report text (as lists of (line, size, weight))."""
+    lines = [(line, 16, "bold") for line in textwrap.wrap(report["title"], 60)] + [("", 10, "normal")]
+    for heading, body in _sections(report):
+        lines.append((heading, 12, "bold"))
+        for paragraph in body.splitlines():
+            lines.extend((line, 10, "normal") for line in textwrap.wrap(paragraph, 95) or [""])
+        lines.append(("", 10, "normal"))
+    lines.append(("References", 12, "bold"))
+    lines.extend((f"- {r}", 10, "normal") for r in report["references"])
+    per_page = 55
+    return [lines[i:i + per_page] for i in range(0, len(lines), per_page)]
+
+def render_pdf(report, figures, statistics, path):
+    """Multi-page PDF: report text, the statistics table, then one figure per page."""
+    with PdfPages(path) as pdf:
+        for page in _text_pages(report):
+            fig = Figure(figsize=(8.27, 11.69))
+            y = 0.95
+            for line, size, weight in page:
+                fig.text(0.08, y, line, fontsize=size, fontweight=weight, family="serif", va="top")
+                y -= 0.0165 * size / 10 + 0.001
+            pdf.savefig(fig)
+
+        rows = _stats_rows(statistics)
+        if rows:
+            fig = Figure(figsize=(8.27, 11.69))
+            ax = fig.add_subplot()
+            ax.set_axis_off()
+            ax.set_title("Column statistics")
+            table = ax.table(cellText=rows, colLabels=STATS_HEADER, loc="upper center")
+            table.auto_set_font_size(False)
+            table.set_fontsize(8)
+            pdf.savefig(fig)
+
+        for caption, fig in figures:
+            fig.suptitle(caption, fontsize=11)
+            pdf.savefig(fig)
+
+        info = pdf.infodict()
+        info["Title"] = report["title"]
+
+RENDERERS = {"html": render_html, "pdf": render_pdf}
+
+def run_report_export(dataset_id, fmt, job_id=None, progress_queue=None):
+    """
+    Renders a dataset's research report to HTML or PDF with its plots and
+    caches the file on disk under the dataset version, so it is rendered
+    once per set of annotations. Files of older versions in the same format
+    are removed once the new one is in place.
+
+    Runs inside a worker process (see jobs.JobManager), so it owns its session.
+
+    Returns:
+        dict: {"id", "version", "format", "path"} of the artifact.
+    """
+    def report(stage, progress):
+        if progress_queue is not None:
+            progress_queue.put({"job_id": job_id, "stage": stage, "progress": round(progress, 3)})
+
+    db = SessionLocal()
+    try:
+        dataset = db.query(models.Dataset).filter(models.Dataset.id == dataset_id).first()
+        if dataset is None:
+            raise ValueError(f"Dataset {dataset_id} not found")
+        path = artifact_path(dataset_id, dataset.version, fmt)
+        result = {"id": dataset_id, "version": dataset.version or 0, "format": fmt, "path": path}
+        if os.path.exists(path):
+            return result
+
+        report("report", 0.05)
+        content = cached_report(db, dataset)
+        report("plotting", 0.2)
+        figures = build_figures(dataset)
+        report("rendering", 0.7)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Readers never see a half-written file
+        tmp = f"{path}.{job_id or os.getpid()}.tmp"
+        RENDERERS[fmt](content, figures, dataset.statistics_json, tmp)
+        os.replace(tmp, path)
+
+        folder = os.path.dirname(path)
+        for name in os.listdir(folder):
+            stem, ext = os.path.splitext(name)
+            if ext == f".{fmt}" and stem[1:].isdigit() and int(stem[1:]) < result["version"]:
+                os.remove(os.path.join(folder, name))
+        return result
+    finally:
+        db.close()
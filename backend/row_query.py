@@ -0,0 +1,106 @@
+import base64
+import json
+from sqlalchemy import select, and_, or_
+import models
+from sky_index import zone_of
+
+# Golden-record columns exposed by GET /datasets/{id}/rows
+ROW_COLUMNS = [
+    "id", "original_id", "ra", "dec", "brightness", "temperature", "velocity",
+    "redshift", "pm_ra", "pm_dec", "epoch", "brightness_unit", "object_type", "match_group"
+]
+SORT_COLUMNS = ["id", "ra", "dec", "brightness", "temperature", "velocity", "redshift"]
+RANGE_COLUMNS = ["ra", "dec", "brightness", "redshift"]
+MAX_PAGE_SIZE = 50000
+
+class InvalidQuery(ValueError):
+    pass
+
+def encode_cursor(value, row_id):
+    raw = json.dumps({"v": value, "id": row_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return data["v"], int(data["id"])
+    except (ValueError, KeyError, TypeError):
+        raise InvalidQuery("Malformed cursor")
+
+def query_rows(db, dataset_id, columns=None, ranges=None, sort="id", descending=False,
+               cursor=None, limit=1000):
+    """
+    One keyset-paginated page of a dataset's StandardizedData rows.
+
+    Pages are ordered by (sort, id) and the cursor carries the last pair
+    seen. Every sort column has a (dataset_id, sort, id) index (migrations
+    4 and 5), so without range filters a page is read in index order from
+    the cursor on, with no OFFSET or sort step, however deep the client
+    scrolls. With range filters on other columns the planner may narrow by
+    their index instead and sort only the matching rows. Rows with a NULL
+    sort value are skipped when sorting by anything but id. ra_min > ra_max
+    wraps through RA 0.
+
+    Args:
+        columns (list): Projection (id is always included).
+        ranges (dict): {column: (min, max)}, either bound may be None.
+
+    Returns:
+        tuple: (column names, {column: list of values}, next cursor or None)
+    """
+    columns = columns or ROW_COLUMNS
+    unknown = [c for c in columns if c not in ROW_COLUMNS]
+    if unknown:
+        raise InvalidQuery(f"Unknown columns: {', '.join(unknown)}")
+    if sort not in SORT_COLUMNS:
+        raise InvalidQuery(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+    columns = ["id"] + [c for c in columns if c != "id"]
+
+    table = models.StandardizedData.__table__
+    key = table.c[sort]
+    conditions = [table.c.dataset_id == dataset_id]
+
+    for name, (lo, hi) in (ranges or {}).items():
+        if name not in RANGE_COLUMNS:
+            raise InvalidQuery(f"Range filters apply to {', '.join(RANGE_COLUMNS)}")
+        col = table.c[name]
+        if name == "ra" and lo is not None and hi is not None and lo > hi:
+            conditions.append(or_(col >= lo, col <= hi))
+            continue
+        if lo is not None:
+            conditions.append(col >= lo)
+        if hi is not None:
+            conditions.append(col <= hi)
+        if name == "dec":
+            # Lets the (sky_zone, ra) index narrow the scan
+            conditions.append(table.c.sky_zone.between(
+                int(zone_of(-90.0 if lo is None else lo)), int(zone_of(90.0 if hi is None else hi))
+            ))
+
+    if sort != "id":
+        conditions.append(key.isnot(None))
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        if sort == "id":
+            conditions.append(table.c.id < last_id if descending else table.c.id > last_id)
+        elif descending:
+            conditions.append(or_(key < value, and_(key == value, table.c.id < last_id)))
+        else:
+            conditions.append(or_(key > value, and_(key == value, table.c.id > last_id)))
+
+    if sort == "id":
+        order = [key.desc() if descending else key.asc()]
+    else:
+        order = [key.desc(), table.c.id.desc()] if descending else [key.asc(), table.c.id.asc()]
+    selected = columns + ([sort] if sort not in columns else [])
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    rows = db.execute(
+        select(*[table.c[c] for c in selected]).where(*conditions).order_by(*order).limit(limit)
+    ).all()
+
+    data = {c: [r[i] for r in rows] for i, c in enumerate(columns)}
+    next_cursor = None
+    if len(rows) == limit:
+        last = rows[-1]
+        next_cursor = encode_cursor(last[selected.index(sort)], last[0])
+    return columns, data, next_cursor
@@ -0,0 +1,220 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from sklearn.neighbors import KDTree
+from sqlalchemy import or_, bindparam
+import models
+
+# Declination strip height (deg) of the stored sky_zone key. Cone searches
+# hit the (sky_zone, ra) index for every strip overlapping the cone.
+ZONE_HEIGHT = 1.0 / 60.0
+
+# Per-dataset k-d trees kept in memory
+TREE_CACHE_SIZE = 8
+
+# Largest cone and result page the search endpoints accept
+CONE_MAX_RADIUS_ARCSEC = 3600.0
+SEARCH_MAX_LIMIT = 10000
+# Cone candidates (id, ra, dec) fetched from the database per batch
+CANDIDATE_BATCH_SIZE = 50000
+
+def valid_sky(ra, dec):
+    """Mask of values that are real ICRS coordinates (images store pixel x/y)."""
+    ra = np.asarray(ra, dtype=np.float64)
+    dec = np.asarray(dec, dtype=np.float64)
+    return (ra >= 0) & (ra <= 360) & (dec >= -90) & (dec <= 90)
+
+def zone_of(dec):
+    """Zone index of a declination (vectorized). The pole falls in the last zone."""
+    dec = np.asarray(dec, dtype=np.float64)
+    max_zone = int(np.ceil(180.0 / ZONE_HEIGHT)) - 1
+    return np.clip(np.floor((dec + 90.0) / ZONE_HEIGHT), 0, max_zone).astype(np.int64)
+
+def radec_to_xyz(ra, dec):
+    """Unit vectors for RA/Dec in degrees, shape (n, 3)."""
+    ra = np.radians(np.asarray(ra, dtype=np.float64))
+    dec = np.radians(np.asarray(dec, dtype=np.float64))
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1)
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """Great-circle distance in degrees (haversine, stable at small angles)."""
+    ra1, dec1, ra2, dec2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (ra1, dec1, ra2, dec2))
+    h = np.sin((dec2 - dec1) / 2) ** 2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2) ** 2
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(h, 0, 1))))
+
+def chord_length(radius_deg):
+    """Euclidean distance between unit vectors separated by radius_deg."""
+    return 2 * np.sin(np.radians(radius_deg) / 2)
+
+def ra_ranges(ra, dec, radius):
+    """
+    RA intervals (deg, within [0, 360]) covering a cone. Splits at the 0/360
+    wrap and returns the full circle when the cone reaches a pole.
+    """
+    if abs(dec) + radius >= 90:
+        return [(0.0, 360.0)]
+    # Widest RA half-extent of a small circle (exact, not radius / cos(dec))
+    half = np.degrees(np.arcsin(np.sin(np.radians(radius)) / np.cos(np.radians(dec))))
+    lo, hi = (ra - half) % 360.0, (ra + half) % 360.0
+    if lo <= hi:
+        return [(lo, hi)]
+    return [(lo, 360.0), (0.0, hi)]
+
+def backfill_sky_zones(db, batch_size=50000):
+    """Computes sky_zone for rows stored before the sky index existed."""
+    col = models.StandardizedData
+    while True:
+        rows = db.query(col.id, col.dec).filter(
+            col.sky_zone.is_(None),
+            col.ra.between(0, 360), col.dec.between(-90, 90)
+        ).limit(batch_size).all()
+        if not rows:
+            return
+        ids = [r.id for r in rows]
+        zones = zone_of([r.dec for r in rows])
+        db.execute(
+            col.__table__.update().where(col.__table__.c.id == bindparam("row_id")),
+            [{"row_id": i, "sky_zone": int(z)} for i, z in zip(ids, zones)]
+        )
+        db.commit()
+
+def _row_dict(row, separation=None):
+    out = {
+        "id": row.id,
+        "dataset_id": row.dataset_id,
+        "original_id": row.original_id,
+        "ra": row.ra,
+        "dec": row.dec,
+        "brightness": row.brightness,
+        "object_type": row.object_type
+    }
+    if separation is not None:
+        out["separation_arcsec"] = float(separation) * 3600.0
+    return out
+
+def cone_search(db, ra, dec, radius, dataset_id=None, limit=1000):
+    """
+    All rows within `radius` degrees of (ra, dec), nearest first.
+
+    Candidates come from the (sky_zone, ra) index as bare (id, ra, dec)
+    batches; the exact great-circle cut is applied in NumPy and only the
+    nearest `limit` rows are loaded in full.
+    """
+    zmin = int(zone_of(max(-90.0, dec - radius)))
+    zmax = int(zone_of(min(90.0, dec + radius)))
+    col = models.StandardizedData
+    query = db.query(col.id, col.ra, col.dec).filter(col.sky_zone.between(zmin, zmax))
+    ranges = ra_ranges(ra, dec, radius)
+    if ranges != [(0.0, 360.0)]:
+        query = query.filter(or_(*[col.ra.between(lo, hi) for lo, hi in ranges]))
+    if dataset_id is not None:
+        query = query.filter(col.dataset_id == dataset_id)
+
+    best_ids = np.empty(0, dtype=np.int64)
+    best_sep = np.empty(0)
+    result = db.execute(query.statement, execution_options={"yield_per": CANDIDATE_BATCH_SIZE})
+    for part in result.partitions():
+        sep = angular_separation(ra, dec, [r.ra for r in part], [r.dec for r in part])
+        inside = sep <= radius
+        best_ids = np.concatenate([best_ids, np.array([r.id for r in part], dtype=np.int64)[inside]])
+        best_sep = np.concatenate([best_sep, sep[inside]])
+        if len(best_ids) > limit:
+            keep = np.argpartition(best_sep, limit)[:limit]
+            best_ids, best_sep = best_ids[keep], best_sep[keep]
+
+    order = np.argsort(best_sep, kind="stable")
+    ids, seps = best_ids[order].tolist(), best_sep[order]
+    rows = {r.id: r for r in db.query(col).filter(col.id.in_(ids)).all()} if ids else {}
+    return [_row_dict(rows[i], s) for i, s in zip(ids, seps) if i in rows]
+
+def box_search(db, ra_min, ra_max, dec_min, dec_max, dataset_id=None, limit=1000):
+    """
+    Rows inside an RA/Dec box. ra_min > ra_max means the box wraps through RA 0.
+    """
+    col = models.StandardizedData
+    query = db.query(col).filter(
+        col.sky_zone.between(int(zone_of(dec_min)), int(zone_of(dec_max))),
+        col.dec.between(dec_min, dec_max)
+    )
+    if ra_min <= ra_max:
+        query = query.filter(col.ra.between(ra_min, ra_max))
+    else:
+        query = query.filter(or_(col.ra >= ra_min, col.ra <= ra_max))
+    if dataset_id is not None:
+        query = query.filter(col.dataset_id == dataset_id)
+    return [_row_dict(r) for r in query.order_by(col.id).limit(limit).all()]
+
+class SkyTreeCache:
+    """
+    LRU cache of per-dataset k-d trees on unit vectors, so repeated cone
+    searches inside one dataset skip SQL entirely. Chord distance on the unit
+    sphere is monotonic in angular distance, so RA wrap-around and the poles
+    need no special handling.
+
+    Trees are built from the dataset's columnar (Arrow) copy, which only
+    exists once ingestion has finished, and are keyed on its path and row
+    count, so every worker process notices a rebuilt dataset by itself.
+    Hits are resolved to rows through (dataset_id, original_id).
+    """
+
+    def __init__(self, max_datasets=TREE_CACHE_SIZE):
+        self.max_datasets = max_datasets
+        # dataset_id -> (key, tree, ra, dec, memory-mapped original_id column)
+        self._trees = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db, dataset_id):
+        """The dataset's tree entry, or None while it has no columnar copy."""
+        # columnar_store imports this module
+        from columnar_store import open_dataset, NO_SKY_REGION
+        dataset = db.get(models.Dataset, dataset_id)
+        store = open_dataset(dataset) if dataset else None
+        if store is None:
+            return None
+        key = (dataset.columnar_path, (dataset.statistics_json or {}).get("row_count"))
+        with self._lock:
+            entry = self._trees.get(dataset_id)
+            if entry is not None and entry[0] == key:
+                self._trees.move_to_end(dataset_id)
+                return entry
+
+        table = store.read(["ra", "dec", "original_id"], regions=[r for r in store.regions if r != NO_SKY_REGION])
+        ra = table.column("ra").to_numpy()
+        dec = table.column("dec").to_numpy()
+        tree = KDTree(radec_to_xyz(ra, dec)) if len(ra) else None
+        entry = (key, tree, ra, dec, table.column("original_id"))
+
+        with self._lock:
+            self._trees[dataset_id] = entry
+            self._trees.move_to_end(dataset_id)
+            while len(self._trees) > self.max_datasets:
+                self._trees.popitem(last=False)
+        return entry
+
+    def cone_search(self, db, dataset_id, ra, dec, radius, limit=1000):
+        """Same contract as cone_search() for a single dataset, served from the tree."""
+        entry = self.get(db, dataset_id)
+        if entry is None:
+            return cone_search(db, ra, dec, radius, dataset_id=dataset_id, limit=limit)
+        _, tree, ras, decs, original_ids = entry
+        if tree is None:
+            return []
+        idx = tree.query_radius(radec_to_xyz([ra], [dec]), r=chord_length(radius))[0]
+        if len(idx) == 0:
+            return []
+        sep = angular_separation(ra, dec, ras[idx], decs[idx])
+        order = np.argsort(sep)[:limit]
+        hits = idx[order]
+        hit_ids = original_ids.take(hits).to_pylist()
+
+        # original_id is not guaranteed unique, so rows are matched on position too
+        col = models.StandardizedData
+        rows = {
+            (r.original_id, r.ra, r.dec): r
+            for r in db.query(col).filter(col.dataset_id == dataset_id, col.original_id.in_(set(hit_ids))).all()
+        }
+        found = [(rows.get((o, ras[i], decs[i])), s) for o, i, s in zip(hit_ids, hits, sep[order])]
+        return [_row_dict(r, s) for r, s in found if r is not None]
+
+sky_tree_cache = SkyTreeCache()
@@ -0,0 +1,156 @@
+import os
+import numpy as np
+import pyarrow as pa
+import astropy.units as u
+from astropy_healpix import HEALPix
+from sky_index import valid_sky
+
+# Finest pyramid level (nside = 2**order; order 9 is ~6.9 arcmin pixels)
+LOD_MAX_ORDER = 9
+# Bins returned per request when the client does not pick an order
+LOD_MAX_BINS = 20000
+LOD_FILENAME = "lod.arrow"
+
+LOD_SCHEMA = pa.schema([
+    ("order", pa.int8()),
+    ("pixel", pa.int64()),
+    ("ra", pa.float64()),
+    ("dec", pa.float64()),
+    ("count", pa.int64()),
+    ("brightness_sum", pa.float64()),
+    ("brightness_count", pa.int64())
+])
+
+def n_pixels(order):
+    return 12 * 4 ** order
+
+class LodPyramid:
+    """
+    Multi-resolution HEALPix (nested) density pyramid of one dataset.
+
+    Counts and brightness sums are accumulated per pixel at LOD_MAX_ORDER as
+    chunks stream through ingestion. Coarser orders fall out of the nested
+    numbering (the parent of pixel p is p // 4), so every level is an exact
+    aggregate of the finest one.
+    """
+
+    def __init__(self, max_order=LOD_MAX_ORDER):
+        self.max_order = max_order
+        self._hp = HEALPix(nside=2 ** max_order, order="nested")
+        size = n_pixels(max_order)
+        self.count = np.zeros(size, dtype=np.int64)
+        self.brightness_sum = np.zeros(size)
+        self.brightness_count = np.zeros(size, dtype=np.int64)
+
+    def update(self, ra, dec, brightness):
+        """Adds a chunk of positions; rows off the sky are skipped."""
+        ra = np.asarray(ra, dtype=np.float64)
+        dec = np.asarray(dec, dtype=np.float64)
+        brightness = np.asarray(brightness, dtype=np.float64)
+        on_sky = valid_sky(ra, dec)
+        if not on_sky.any():
+            return
+        pixels = self._hp.lonlat_to_healpix(ra[on_sky] * u.deg, dec[on_sky] * u.deg)
+        np.add.at(self.count, pixels, 1)
+        values = brightness[on_sky]
+        finite = np.isfinite(values)
+        np.add.at(self.brightness_sum, pixels[finite], values[finite])
+        np.add.at(self.brightness_count, pixels[finite], 1)
+
+    def levels(self):
+        """Yields (order, count, brightness_sum, brightness_count) dense arrays, finest first."""
+        count, total, n_bright = self.count, self.brightness_sum, self.brightness_count
+        for order in range(self.max_order, -1, -1):
+            yield order, count, total, n_bright
+            count = count.reshape(-1, 4).sum(axis=1)
+            total = total.reshape(-1, 4).sum(axis=1)
+            n_bright = n_bright.reshape(-1, 4).sum(axis=1)
+
+    def write(self, folder):
+        """Writes the non-empty pixels of every order (coarsest first) to <folder>/lod.arrow."""
+        os.makedirs(folder, exist_ok=True)
+        tables = []
+        for order, count, total, n_bright in self.levels():
+            pixels = np.nonzero(count)[0]
+            lon, lat = HEALPix(nside=2 ** order, order="nested").healpix_to_lonlat(pixels)
+            tables.append(pa.table({
+                "order": np.full(len(pixels), order, dtype=np.int8),
+                "pixel": pixels.astype(np.int64),
+                "ra": lon.to_value(u.deg),
+                "dec": lat.to_value(u.deg),
+                "count": count[pixels],
+                "brightness_sum": total[pixels],
+                "brightness_count": n_bright[pixels]
+            }, schema=LOD_SCHEMA))
+        path = os.path.join(folder, LOD_FILENAME)
+        table = pa.concat_tables(tables[::-1])
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, LOD_SCHEMA) as writer:
+            writer.write_table(table)
+        return path
+
+def pick_order(viewport_fraction, max_bins=LOD_MAX_BINS, max_order=LOD_MAX_ORDER):
+    """Finest order whose pixels covering the viewport stay within max_bins."""
+    order = 0
+    while order < max_order and n_pixels(order + 1) * viewport_fraction <= max_bins:
+        order += 1
+    return order
+
+def viewport_fraction(ra_min, ra_max, dec_min, dec_max):
+    """Fraction of the sphere inside an RA/Dec box (ra_min > ra_max wraps)."""
+    width = (ra_max - ra_min) % 360.0 or 360.0
+    height = np.sin(np.radians(dec_max)) - np.sin(np.radians(dec_min))
+    return max(width / 360.0 * height / 2.0, 1e-12)
+
+def query_lod(folder, order=None, viewport=None, max_bins=LOD_MAX_BINS):
+    """
+    Binned counts and mean brightness for a viewport, read from the
+    memory-mapped pyramid (raw rows are never touched).
+
+    Args:
+        viewport (tuple): (ra_min, ra_max, dec_min, dec_max) or None for the whole sky.
+
+    Returns:
+        dict | None: None if the dataset has no pyramid.
+    """
+    path = os.path.join(folder, LOD_FILENAME)
+    if not os.path.exists(path):
+        return None
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    orders = table.column("order").to_numpy()
+    max_order = int(orders.max()) if len(orders) else 0
+    if order is None:
+        fraction = viewport_fraction(*viewport) if viewport else 1.0
+        order = pick_order(fraction, max_bins, max_order)
+    order = int(np.clip(order, 0, max_order))
+
+    # Levels are stored coarsest first, so one order is a contiguous slice
+    start, stop = np.searchsorted(orders, [order, order + 1])
+    level = table.slice(start, stop - start)
+    ra = level.column("ra").to_numpy()
+    dec = level.column("dec").to_numpy()
+    keep = np.ones(len(ra), dtype=bool)
+    if viewport:
+        ra_min, ra_max, dec_min, dec_max = viewport
+        # Pixels are kept by centre, padded by one pixel so edges stay covered
+        pad = np.degrees(np.sqrt(4 * np.pi / n_pixels(order)))
+        keep = (dec >= dec_min - pad) & (dec <= dec_max + pad)
+        if (ra_max - ra_min) % 360.0 + 2 * pad < 360.0 and np.abs([dec_min, dec_max]).max() + pad < 90.0:
+            offset = (ra - ra_min + pad) % 360.0
+            keep &= offset <= (ra_max - ra_min) % 360.0 + 2 * pad
+
+    count = level.column("count").to_numpy()[keep]
+    n_bright = level.column("brightness_count").to_numpy()[keep]
+    total = level.column("brightness_sum").to_numpy()[keep]
+    mean = np.divide(total, n_bright, out=np.full(len(total), np.nan), where=n_bright > 0)
+    return {
+        "order": order,
+        "nside": 2 ** order,
+        "pixel_area_deg2": float(4 * np.pi * (180 / np.pi) ** 2 / n_pixels(order)),
+        "bins": int(keep.sum()),
+        "total_count": int(count.sum()),
+        "pixel": level.column("pixel").to_numpy()[keep].tolist(),
+        "ra": ra[keep].tolist(),
+        "dec": dec[keep].tolist(),
+        "count": count.tolist(),
+        "mean_brightness": [None if np.isnan(m) else float(m) for m in mean]
+    }
@@ -1,42 +1,189 @@
+import os
+import asyncio
 import socketio
+import numpy as np
 from typing import Dict, Any
+from presence import make_presence, is_redis_url, PRESENCE_TTL
+from database import run_db
+from view_state import fold, make_view_logs
+import models
+
+# Message bus shared by all workers/nodes: a redis:// (or Valkey/KeyDB) URL,
+# or empty for the in-process bus of a single worker
+COLLAB_BUS_URL = os.getenv("COLLAB_BUS_URL", "")
 
 # Create a Socket.IO server
-# async_mode='asgi' is compatible with FastAPI/Uvicorn
-sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+# async_mode='asgi' is compatible with FastAPI/Uvicorn; with a Redis bus every
+# emit to a room is relayed to the members connected to other workers
+sio = socketio.AsyncServer(
+    async_mode='asgi', cors_allowed_origins='*',
+    client_manager=socketio.AsyncRedisManager(COLLAB_BUS_URL) if is_redis_url(COLLAB_BUS_URL) else None
+)
+
+# Room of clients that join without a session token
+DEFAULT_ROOM = "default"
+
+# Cursor/view updates are coalesced and sent to each room once per frame
+FRAME_INTERVAL = 0.033
+# Binary cursor frame entry: room slot of the user, then normalized x/y
+CURSOR_DTYPE = np.dtype([("slot", "<u2"), ("x", "<f4"), ("y", "<f4")])
 
 class CollaborationManager:
-    def __init__(self):
-        # user_id -> { "name": str, "color": str, "x": float, "y": float, "room": str }
+    """
+    Presence and fan-out for collaborative sessions (one room per
+    AnalysisSession token).
+
+    Room membership lives in a presence store shared by all workers (see
+    presence.py) and each member holds a small integer slot, so cursor
+    positions travel as packed (slot, x, y) records. Cursor and view
+    updates are not relayed one by one: the latest value per user replaces
+    any pending one and a flusher task sends each room a single frame every
+    FRAME_INTERVAL. Every worker flushes the users connected to it; the
+    Socket.IO client manager delivers the frame to members on other workers.
+
+    View updates are patches to the room's authoritative view state (see
+    view_state.py): a user's pending patches are composed where a merge
+    patch can express it, and the flush appends them to the room's live log
+    before broadcasting the numbered deltas.
+    """
+
+    def __init__(self, presence=None, views=None):
+        self.presence = presence or make_presence(COLLAB_BUS_URL)
+        self.views = views or make_view_logs(COLLAB_BUS_URL)
+        # Users connected to this worker: sid -> { "id", "name", "color", "x", "y", "room", "slot" }
         self.active_users: Dict[str, Any] = {}
-        # room_id -> [history_states]
-        self.room_history = {}  # For simple undo/redo
-        
-    async def connect_user(self, sid: str, data: dict):
-        self.active_users[sid] = {
+        # room_id -> sids connected to this worker
+        self.rooms: Dict[str, set] = {}
+        # room_id -> {sid: (slot, x, y)} latest only / {sid: [composed view patches]}
+        self._pending_cursors: Dict[str, Dict[str, tuple]] = {}
+        self._pending_views: Dict[str, Dict[str, Any]] = {}
+        self._flusher = None
+
+    async def connect_user(self, sid: str, data: dict, room: str = DEFAULT_ROOM):
+        user = await self.presence.join(room, sid, {
             "id": sid,
             "name": data.get("username", "Anonymous"),
             "color": data.get("color", "#ffffff"),
             "x": 0, "y": 0,
-            "room": "default"
-        }
-        
-    def disconnect_user(self, sid: str):
-        if sid in self.active_users:
-            del self.active_users[sid]
-            
+            "room": room
+        })
+        self.active_users[sid] = user
+        self.rooms.setdefault(room, set()).add(sid)
+        self._ensure_flusher()
+        return user
+
+    async def disconnect_user(self, sid: str):
+        """Removes a user and returns their room (None if unknown)."""
+        user = self.active_users.pop(sid, None)
+        if user is None:
+            return None
+        room = user["room"]
+        await self.presence.leave(room, sid)
+        members = self.rooms.get(room, set())
+        members.discard(sid)
+        self._pending_cursors.get(room, {}).pop(sid, None)
+        self._pending_views.get(room, {}).pop(sid, None)
+        if not members:
+            self.rooms.pop(room, None)
+            self._pending_cursors.pop(room, None)
+            self._pending_views.pop(room, None)
+            await self.views.release(room)
+        return room
+
     def update_cursor(self, sid: str, x: float, y: float):
         if sid in self.active_users:
-            self.active_users[sid]["x"] = x
-            self.active_users[sid]["y"] = y
-            return self.active_users[sid]
+            user = self.active_users[sid]
+            user["x"] = x
+            user["y"] = y
+            # Supersedes any position of this user not yet sent
+            self._pending_cursors.setdefault(user["room"], {})[sid] = (user["slot"], x, y)
+            return user
         return None
 
-    def get_room_users(self, room="default"):
-        return [u for u in self.active_users.values() if u["room"] == room]
+    def update_view(self, sid: str, patch: dict):
+        if sid in self.active_users:
+            pending = self._pending_views.setdefault(self.active_users[sid]["room"], {})
+            pending[sid] = fold(pending.get(sid, []), patch)
+            return True
+        return False
+
+    def take_pending_views(self, room):
+        """Removes the room's view patches not yet flushed, as ("update", sid, patch) operations."""
+        return view_operations(self._pending_views.pop(room, {}))
+
+    async def get_room_users(self, room=DEFAULT_ROOM):
+        """Members of a room across all workers."""
+        return await self.presence.members(room)
+
+    def room_of(self, sid: str):
+        user = self.active_users.get(sid)
+        return user["room"] if user else None
+
+    def pack_cursors(self, positions):
+        """{sid: (slot, x, y)} -> packed little-endian CURSOR_DTYPE records."""
+        return np.array(list(positions.values()), dtype=CURSOR_DTYPE).tobytes()
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    async def _flush_loop(self):
+        """Sends each room's coalesced updates once per frame while any room is open."""
+        loop = asyncio.get_running_loop()
+        refreshed = loop.time()
+        while self.rooms:
+            await asyncio.sleep(FRAME_INTERVAL)
+            await self.flush()
+            if loop.time() - refreshed > PRESENCE_TTL / 3:
+                await self.presence.refresh(list(self.rooms))
+                refreshed = loop.time()
+
+    async def flush(self):
+        cursors, self._pending_cursors = self._pending_cursors, {}
+        views, self._pending_views = self._pending_views, {}
+        # Users can disconnect while earlier rooms are being sent, and one
+        # room's failure must not stop the frames of the others (or the loop)
+        for room, positions in cursors.items():
+            positions = {sid: p for sid, p in positions.items() if sid in self.active_users}
+            if positions:
+                try:
+                    # Clients skip their own slot
+                    await sio.emit('cursor_frame', self.pack_cursors(positions), room=room)
+                except Exception as e:
+                    print(f"Cursor frame for room {room} failed: {e!r}")
+        for room, patches in views.items():
+            if patches:
+                try:
+                    await emit_view_deltas(room, await self.views.update(room, view_operations(patches)))
+                except Exception as e:
+                    print(f"View frame for room {room} failed: {e!r}")
+
+def view_operations(patches):
+    return [("update", sid, patch) for sid, pending in patches.items() for patch in pending]
 
 manager = CollaborationManager()
 
+def open_session(db, token):
+    """True if the session exists (the default room's session is created on first use)."""
+    session = db.query(models.AnalysisSession).filter(models.AnalysisSession.session_token == token).first()
+    if session is None and token == DEFAULT_ROOM:
+        session = models.AnalysisSession(session_token=token, active_users_json=[], view_state_json={})
+        db.add(session)
+        db.commit()
+    return session is not None
+
+async def emit_view_deltas(room, deltas):
+    """Numbered deltas go to the whole room, senders included, so every client tracks the room's seq."""
+    if deltas:
+        await sio.emit('view_frame', deltas, room=room)
+
+def store_active_users(db, token, users):
+    """Snapshot of a session's members for REST readers (the presence store stays authoritative)."""
+    db.query(models.AnalysisSession).filter(models.AnalysisSession.session_token == token).update(
+        {"active_users_json": [{"id": u["id"], "name": u["name"]} for u in users]}
+    )
+    db.commit()
+
 # --- Socket Event Handlers ---
 
 @sio.event
@@ -45,45 +192,85 @@ async def connect(sid, environ):
 
 @sio.event
 async def join(sid, data):
-    """User joins a specific analysis session (room)."""
+    """User joins an analysis session (room); data["session"] is its token."""
     username = data.get("username", f"User-{sid[:4]}")
-    await manager.connect_user(sid, {"username": username, "color": data.get("color")})
-    
-    room = "default" # Support multiple rooms later
-    sio.enter_room(sid, room)
-    
+    room = data.get("session") or DEFAULT_ROOM
+    if not await run_db(open_session, room):
+        await sio.emit('join_error', {"message": "Unknown session"}, to=sid)
+        return
+
+    # Switching sessions leaves the previous one
+    previous = manager.room_of(sid)
+    if previous is not None:
+        await leave_room(sid, previous)
+
+    user = await manager.connect_user(sid, {"username": username, "color": data.get("color")}, room)
+    await sio.enter_room(sid, room)
+
     # Broadcast to others that a user joined
-    await sio.emit('user_joined', manager.active_users[sid], room=room, skip_sid=sid)
-    
-    # Send current state to new user (active users list)
-    await sio.emit('sync_users', manager.get_room_users(room), to=sid)
+    await sio.emit('user_joined', user, room=room, skip_sid=sid)
+
+    # Send current state to new user (active users list, with their slots)
+    users = await manager.get_room_users(room)
+    await sio.emit('sync_users', users, to=sid)
+    await run_db(store_active_users, room, users)
+
+    # Current view: a reconnecting client sends the last seq it applied
+    # (data["view_seq"]) and only receives the deltas it missed
+    await sio.emit('view_sync', await manager.views.sync(room, data.get("view_seq")), to=sid)
+
+async def leave_room(sid, room):
+    await manager.disconnect_user(sid)
+    await sio.leave_room(sid, room)
+    await sio.emit('user_left', {"sid": sid}, room=room)
+    await run_db(store_active_users, room, await manager.get_room_users(room))
 
 @sio.event
 async def cursor_move(sid, data):
     """Real-time cursor tracking."""
-    # data: {x: 0.5, y: 0.5} (normalized coordinates)
-    user_data = manager.update_cursor(sid, data.get("x", 0), data.get("y", 0))
-    if user_data:
-        # Broadcast cursor position (volatile=True means drop if network busy)
-        await sio.emit('cursor_update', user_data, skip_sid=sid)
+    # data: {x: 0.5, y: 0.5} (normalized coordinates); sent with the room's next frame
+    manager.update_cursor(sid, float(data.get("x", 0)), float(data.get("y", 0)))
 
 @sio.event
 async def update_view(sid, data):
     """Sync camera/zoom state or filters."""
-    # Broadcast view change to everyone else to sync views (Presentation Mode)
-    await sio.emit('view_updated', data, skip_sid=sid)
+    # data is a merge patch of the room's view state (null removes a key); it
+    # reaches the room as a numbered delta with the next frame (Presentation Mode)
+    if isinstance(data, dict):
+        manager.update_view(sid, data)
+
+@sio.event
+async def undo_view(sid, data=None):
+    """Reverts the room's latest view change (shared history)."""
+    await _view_history(sid, "undo")
+
+@sio.event
+async def redo_view(sid, data=None):
+    await _view_history(sid, "redo")
+
+async def _view_history(sid, op):
+    room = manager.room_of(sid)
+    if room is None:
+        return
+    # Pending patches are logged first so undo sees the room's actual last change
+    operations = manager.take_pending_views(room)
+    await emit_view_deltas(room, await manager.views.update(room, operations + [(op, sid)]))
 
 @sio.event
 async def annotation_add(sid, data):
     """User added a note/flag."""
     # data: { data_id, text, type }
+    room = manager.room_of(sid)
+    if room is None:
+        return
     await sio.emit('annotation_broadcast', {
-        "user": manager.active_users.get(sid, {}).get("name"),
+        "user": manager.active_users[sid]["name"],
         "annotation": data
-    }, skip_sid=sid)
+    }, room=room, skip_sid=sid)
 
 @sio.event
 async def disconnect(sid):
-    manager.disconnect_user(sid)
-    await sio.emit('user_left', {"sid": sid})
+    room = manager.room_of(sid)
+    if room is not None:
+        await leave_room(sid, room)
     print(f"User disconnected: {sid}")
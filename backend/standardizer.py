@@ -1,8 +1,51 @@
-from fuzzywuzzy import process, fuzz
+import re
+import threading
+from collections import OrderedDict
+
+try:
+    # Vectorized C++ scorer: one cdist call scores every column at once
+    from rapidfuzz import process, fuzz
+    HAS_RAPIDFUZZ = True
+except ImportError:
+    from fuzzywuzzy import process, fuzz
+    HAS_RAPIDFUZZ = False
+
+# Process-wide column decisions: (normalized name, threshold) -> (standard, method, score)
+DECISION_CACHE_SIZE = 4096
+_decisions = OrderedDict()
+_decisions_lock = threading.Lock()
+
+_NON_WORD = re.compile(r"(?ui)\W")
+
+def _full_process(name):
+    """fuzzywuzzy's default preprocessing, so both backends score alike."""
+    return _NON_WORD.sub(" ", name).lower().strip()
+
+def cache_decisions(entries):
+    """
+    Stores decisions in the process-wide LRU cache.
+
+    Args:
+        entries (iterable): (original_column, threshold, standard, method, score)
+    """
+    with _decisions_lock:
+        for original, threshold, standard, method, score in entries:
+            key = (original.lower().strip(), threshold)
+            _decisions[key] = (standard, method, score)
+            _decisions.move_to_end(key)
+        while len(_decisions) > DECISION_CACHE_SIZE:
+            _decisions.popitem(last=False)
+
+def clear_decisions():
+    with _decisions_lock:
+        _decisions.clear()
 
 class ColumnStandardizer:
     """
     Standardizes astronomical column names using dictionary lookups and fuzzy matching.
+
+    Decisions are memoized process-wide, so repeated schemas skip matching
+    entirely; columns that miss the cache are fuzzy-matched as one batch.
     """
 
     # 1. Dictionary mapping common variations to standard names
@@ -27,17 +70,38 @@ class ColumnStandardizer:
         ],
         "error": [
             "err", "error", "uncertainty", "sigma", "std_dev"
+        ],
+        "proper_motion_ra": [
+            "pmra", "pm_ra", "mu_ra", "mu_alpha", "pmra_cosdec"
+        ],
+        "proper_motion_dec": [
+            "pmdec", "pm_dec", "mu_dec", "mu_delta"
+        ],
+        "epoch": [
+            "epoch", "ref_epoch", "epoch_year"
         ]
     }
 
+    LOOKUP_MAP = None
+    LOOKUP_KEYS = None
+
     def __init__(self, fuzzy_threshold=80):
         self.threshold = fuzzy_threshold
-        # Invert the map for faster lookup: { 'ra': 'position_ra', 'alpha': 'position_ra', ... }
-        self.lookup_map = {}
-        for standard, variations in self.STANDARD_MAP.items():
-            for var in variations:
-                self.lookup_map[var.lower()] = standard
-            self.lookup_map[standard] = standard # Add the standard name itself
+        self.lookup_map = self._lookup_map()
+
+    @classmethod
+    def _lookup_map(cls):
+        # Built once per process, not per upload
+        if cls.LOOKUP_MAP is None:
+            # Invert the map for faster lookup: { 'ra': 'position_ra', 'alpha': 'position_ra', ... }
+            lookup_map = {}
+            for standard, variations in cls.STANDARD_MAP.items():
+                for var in variations:
+                    lookup_map[var.lower()] = standard
+                lookup_map[standard] = standard # Add the standard name itself
+            cls.LOOKUP_KEYS = list(lookup_map.keys())
+            cls.LOOKUP_MAP = lookup_map
+        return cls.LOOKUP_MAP
 
     def standardize(self, columns, overrides=None):
         """
@@ -60,46 +124,74 @@ class ColumnStandardizer:
         # Safe normalize overrides
         normalized_overrides = {k.lower(): v for k, v in overrides.items()}
 
+        decided = {}
+        with _decisions_lock:
+            for col in columns:
+                cached = _decisions.get((col.lower().strip(), self.threshold))
+                if cached is not None:
+                    _decisions.move_to_end((col.lower().strip(), self.threshold))
+                    decided[col] = cached
+
+        misses = []
         for col in columns:
-            res_col = col  # Default to original if no match
-            method = "none"
-            score = 0
-            
             col_lower = col.lower().strip()
 
-            # 5. User Override Priority
+            # 5. User Override Priority (never cached)
             if col_lower in normalized_overrides:
-                res_col = normalized_overrides[col_lower]
-                mapping[col] = res_col
-                log.append(self._log_entry(col, res_col, "override", 100))
+                continue
+            if col in decided:
                 continue
 
             # 1. Exact/Dictionary Match (Case-Insensitive)
             if col_lower in self.lookup_map:
-                res_col = self.lookup_map[col_lower]
-                mapping[col] = res_col
-                log.append(self._log_entry(col, res_col, "dictionary_exact", 100))
-                continue
+                decided[col] = (self.lookup_map[col_lower], "dictionary_exact", 100)
+            else:
+                misses.append(col)
+
+        # 2. Fuzzy Matching, all misses in one batch
+        if misses:
+            fresh = []
+            for col, (best_match, best_score) in zip(misses, self._best_matches(misses)):
+                if best_score >= self.threshold:
+                    decision = (self.lookup_map[best_match], f"fuzzy_match (matched: '{best_match}')", best_score)
+                else:
+                    # No match found - keep original
+                    decision = (col, "no_match", best_score)
+                decided[col] = decision
+                fresh.append((col, self.threshold, *decision))
+            cache_decisions(fresh)
 
-            # 2. Fuzzy Matching
-            # Compare current column against all known variation keys
-            best_match, best_score = process.extractOne(col_lower, self.lookup_map.keys(), scorer=fuzz.token_sort_ratio)
-            
-            if best_score >= self.threshold:
-                standard_name = self.lookup_map[best_match]
-                res_col = standard_name
-                mapping[col] = standard_name
-                log.append(self._log_entry(col, standard_name, f"fuzzy_match (matched: '{best_match}')", best_score))
+        for col in columns:
+            col_lower = col.lower().strip()
+            if col_lower in normalized_overrides:
+                res_col, method, score = normalized_overrides[col_lower], "override", 100
             else:
-                # No match found - keep original
-                mapping[col] = col
-                log.append(self._log_entry(col, col, "no_match", best_score))
+                res_col, method, score = decided[col]
+                # A cached no_match keeps this column's own spelling
+                if method == "no_match":
+                    res_col = col
+            mapping[col] = res_col
+            log.append(self._log_entry(col, res_col, method, score))
 
         return {
             "mapping": mapping,
             "log": log
         }
 
+    def _best_matches(self, columns):
+        """(best variation key, score) for each column against every known key."""
+        keys = self.LOOKUP_KEYS
+        queries = [c.lower().strip() for c in columns]
+        if HAS_RAPIDFUZZ:
+            scores = process.cdist(
+                [_full_process(q) for q in queries], [_full_process(k) for k in keys],
+                scorer=fuzz.token_sort_ratio, workers=-1
+            )
+            best = scores.argmax(axis=1)
+            return [(keys[j], int(round(scores[i, j]))) for i, j in enumerate(best)]
+        # Compare current column against all known variation keys
+        return [process.extractOne(q, keys, scorer=fuzz.token_sort_ratio)[:2] for q in queries]
+
     def _log_entry(self, original, standard, method, score):
         return {
             "original_column": original,
@@ -0,0 +1,30 @@
+import numpy as np
+from astropy.io import fits
+
+from parsers import fits_parser
+
+
+def _write_table(path, n_rows=50):
+    columns = [
+        fits.Column(name="RA", format="D", array=np.linspace(10.0, 20.0, n_rows)),
+        fits.Column(name="DEC", format="D", array=np.linspace(-5.0, 5.0, n_rows)),
+        fits.Column(name="FLUX", format="2E", array=np.ones((n_rows, 2), dtype=np.float32)),
+        fits.Column(name="MAG", format="E", array=np.arange(n_rows, dtype=np.float32)),
+    ]
+    fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU.from_columns(columns)]).writeto(path)
+
+
+def test_vector_columns_are_skipped(tmp_path):
+    path = str(tmp_path / "vector.fits")
+    _write_table(path)
+
+    result = fits_parser.parse_fits(path)
+    assert result["statistics"]["numeric_columns"] == ["RA", "DEC", "MAG"]
+    assert len(result["preview"]) == 50
+
+    chunks = list(fits_parser.iter_table_chunks(path, chunksize=20))
+    assert [len(chunk) for chunk in chunks] == [20, 20, 10]
+    frame = chunks[-1]
+    assert "FLUX" not in frame.columns
+    assert list(frame["id"]) == list(range(40, 50))
+    assert np.allclose(frame["value"], frame["MAG"])
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from parsers.csv_parser import _pick_plot_columns, _with_plot_columns
+from predictor import DataCompleter
+
+
+def _catalog(n_rows=5000, n_gaps=200):
+    rng = np.random.default_rng(0)
+    ra = rng.uniform(0, 360, n_rows)
+    frame = pd.DataFrame({
+        "ra": ra,
+        "dec": rng.uniform(-30, 30, n_rows),
+        "flux": 3 * ra + rng.normal(0, 0.1, n_rows),
+    })
+    gaps = rng.choice(n_rows, n_gaps, replace=False)
+    truth = frame.loc[gaps, "flux"].to_numpy()
+    frame.loc[gaps, "flux"] = np.nan
+    return frame, gaps, truth
+
+
+def _predicted(result, column, rows):
+    predictions = result["predictions"]
+    selected = predictions["column"] == column
+    values = pd.Series(predictions["predicted_value"][selected], index=predictions["id"][selected])
+    return values.loc[rows].to_numpy()
+
+
+def test_plot_aliases_are_not_features_or_targets():
+    frame, gaps, truth = _catalog()
+    # The frame ingestion passes carries id/x/y/value next to the source columns
+    frame = _with_plot_columns(frame, *_pick_plot_columns(list(frame.columns)))
+
+    result = DataCompleter().analyze_and_predict(frame, columnar=True)
+
+    assert result["missing_stats"] == {"flux": 200}
+    assert set(result["predictions"]["column"]) == {"flux"}
+    rmse = np.sqrt(np.mean((_predicted(result, "flux", gaps) - truth) ** 2))
+    assert rmse < 10
+
+
+def test_missing_features_are_left_out_of_the_search():
+    frame, gaps, truth = _catalog()
+    # These gap rows have no dec: they are matched on ra alone
+    frame.loc[gaps[:50], "dec"] = np.nan
+
+    result = DataCompleter().analyze_and_predict(frame, columnar=True)
+
+    rmse = np.sqrt(np.mean((_predicted(result, "flux", gaps[:50]) - truth[:50]) ** 2))
+    assert rmse < 1
@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import uuid
+import weakref
+
+# Bytes read/written per step while receiving an upload
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+# Per-upload size cap
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 50 * 1024 ** 3))
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+class UploadTooLarge(Exception):
+    pass
+
+class UploadConflict(Exception):
+    """A chunk did not start at the session's current offset."""
+    pass
+
+class UploadSink:
+    """
+    Writes chunks into a partial file while hashing them. Disk writes and
+    hashing run in a worker thread so the event loop never blocks on I/O.
+
+    `size` is the end of the hashed prefix and the position of the next
+    write. Blocks are written at that position rather than appended, so a
+    resent chunk or a retry after a failed write never duplicates bytes.
+    """
+
+    def __init__(self, part_path, max_bytes=MAX_UPLOAD_BYTES):
+        self.part_path = part_path
+        self.max_bytes = max_bytes
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def _catch_up(self):
+        # Hashes bytes already on disk past `size`: everything after a
+        # restart, or chunks another worker process received
+        with open(self.part_path, "rb") as existing:
+            existing.seek(self.size)
+            for block in iter(lambda: existing.read(UPLOAD_CHUNK_SIZE), b""):
+                self.digest.update(block)
+                self.size += len(block)
+
+    async def catch_up(self):
+        await asyncio.to_thread(self._catch_up)
+
+    def _write(self, block):
+        with open(self.part_path, "r+b" if os.path.exists(self.part_path) else "wb") as buffer:
+            buffer.seek(self.size)
+            buffer.write(block)
+        self.digest.update(block)
+        self.size += len(block)
+
+    async def write(self, block):
+        if self.size + len(block) > self.max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+        await asyncio.to_thread(self._write, block)
+
+    def finalize(self, upload_folder, filename):
+        """
+        Moves the partial file to its content-addressed path (<sha256><ext>),
+        so same-named files never overwrite each other and identical content
+        is stored once.
+
+        Returns:
+            tuple: (stored path, hex SHA-256 digest, size in bytes)
+        """
+        content_hash = self.digest.hexdigest()
+        file_path = os.path.join(upload_folder, content_hash + os.path.splitext(filename)[1].lower())
+        if os.path.exists(file_path):
+            # Same content already stored (and possibly open in a worker)
+            os.remove(self.part_path)
+        else:
+            os.replace(self.part_path, file_path)
+        return file_path, content_hash, self.size
+
+async def receive_upload(upload, upload_folder, max_bytes=MAX_UPLOAD_BYTES, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Copies a multipart UploadFile to its content-addressed path in
+    `chunk_size` steps.
+
+    Starlette spools the multipart body to a temporary file before the
+    handler runs, so the size cap here only applies once the whole body has
+    arrived and the bytes are written to disk twice. Multi-GB files should
+    use ChunkedUploads, which streams the raw request body.
+
+    Returns:
+        tuple: (stored path, hex SHA-256 digest, size in bytes)
+    """
+    sink = UploadSink(os.path.join(upload_folder, f"{uuid.uuid4().hex}.part"), max_bytes)
+    try:
+        while True:
+            block = await upload.read(chunk_size)
+            if not block:
+                break
+            await sink.write(block)
+        return sink.finalize(upload_folder, upload.filename)
+    except BaseException:
+        if os.path.exists(sink.part_path):
+            os.remove(sink.part_path)
+        raise
+
+class ChunkedUploads:
+    """
+    Resumable uploads for multi-GB files: a session is opened with the
+    declared size, the client PATCHes the body in sequential chunks (each
+    streamed straight from the request to disk) and can ask for the current
+    offset to resume after a dropped connection or a server restart.
+
+    Session state is a small JSON sidecar next to the partial file.
+    """
+
+    def __init__(self, upload_folder, max_bytes=MAX_UPLOAD_BYTES):
+        self.upload_folder = upload_folder
+        self.max_bytes = max_bytes
+        # upload_id -> (session dict, UploadSink)
+        self._open = {}
+        # upload_id -> lock; an entry lives only while a request holds or
+        # awaits it, so abandoned sessions leave nothing behind
+        self._locks = weakref.WeakValueDictionary()
+
+    def _paths(self, upload_id):
+        base = os.path.join(self.upload_folder, upload_id)
+        return base + ".part", base + ".json"
+
+    def create(self, filename, size):
+        if size > self.max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+        upload_id = uuid.uuid4().hex
+        part_path, meta_path = self._paths(upload_id)
+        session = {"upload_id": upload_id, "filename": filename, "size": int(size)}
+        with open(meta_path, "w") as meta:
+            json.dump(session, meta)
+        open(part_path, "wb").close()
+        return self.status(upload_id)
+
+    def _load(self, upload_id):
+        if not _SESSION_ID.match(upload_id):
+            return None
+        part_path, meta_path = self._paths(upload_id)
+        if not (os.path.exists(meta_path) and os.path.exists(part_path)):
+            # Unknown, or completed by another worker process
+            self._open.pop(upload_id, None)
+            return None
+        if upload_id not in self._open:
+            # The sink's hash starts empty and catches up from disk on the
+            # next append/complete, in a worker thread
+            with open(meta_path) as meta:
+                session = json.load(meta)
+            self._open[upload_id] = (session, UploadSink(part_path, min(session["size"], self.max_bytes)))
+        return self._open[upload_id]
+
+    def _lock(self, upload_id):
+        lock = self._locks.get(upload_id)
+        if lock is None:
+            lock = self._locks[upload_id] = asyncio.Lock()
+        return lock
+
+    def status(self, upload_id):
+        """Session info with the byte offset the next chunk must start at (None if unknown)."""
+        loaded = self._load(upload_id)
+        if loaded is None:
+            return None
+        session, sink = loaded
+        # The file on disk is authoritative: other worker processes may
+        # have received chunks this one has not seen
+        return {**session, "offset": os.path.getsize(sink.part_path), "chunk_size": UPLOAD_CHUNK_SIZE}
+
+    async def append(self, upload_id, offset, stream):
+        """Writes one chunk (an async iterator of bytes) starting at `offset`. Returns the new status."""
+        async with self._lock(upload_id):
+            loaded = self._load(upload_id)
+            if loaded is None:
+                return None
+            _, sink = loaded
+            on_disk = os.path.getsize(sink.part_path)
+            if offset != on_disk:
+                raise UploadConflict(f"Expected offset {on_disk}")
+            await sink.catch_up()
+            async for block in stream:
+                if block:
+                    await sink.write(block)
+            return self.status(upload_id)
+
+    async def complete(self, upload_id):
+        """
+        Finalizes a fully received upload.
+
+        Returns:
+            tuple: (filename, stored path, hex SHA-256 digest, size in bytes)
+        """
+        async with self._lock(upload_id):
+            loaded = self._load(upload_id)
+            if loaded is None:
+                return None
+            session, sink = loaded
+            on_disk = os.path.getsize(sink.part_path)
+            if on_disk != session["size"]:
+                raise UploadConflict(f"Received {on_disk} of {session['size']} bytes")
+            await sink.catch_up()
+            file_path, content_hash, size = sink.finalize(self.upload_folder, session["filename"])
+            os.remove(self._paths(upload_id)[1])
+            self._open.pop(upload_id, None)
+        return session["filename"], file_path, content_hash, size
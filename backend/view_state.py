@@ -0,0 +1,313 @@
+import asyncio
+import copy
+import json
+import time
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm.attributes import flag_modified
+from database import run_db
+from presence import is_redis_url
+import models
+
+# A snapshot of the room state is taken every SNAPSHOT_EVERY deltas
+SNAPSHOT_EVERY = 50
+# Deltas kept for reconnect catch-up and undo (at least one snapshot interval)
+MAX_DELTAS = 200
+# Read-modify-write attempts when another worker holds the SQLite write lock
+WRITE_RETRIES = 5
+# Redis keys of a room's live log and of the lock serializing its writers
+VIEW_KEY = "collab:view:{room}"
+VIEW_LOCK_KEY = "collab:view-lock:{room}"
+# Live logs of idle rooms fall back to their last persisted copy after this
+VIEW_TTL = 24 * 3600
+
+def merge_patch(target, patch):
+    """JSON merge patch (RFC 7386): nested dicts merge, None deletes a key."""
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+def inverse_patch(target, patch):
+    """Patch that undoes merge_patch(target, patch)."""
+    inverse = {}
+    for key, value in patch.items():
+        old = target.get(key) if isinstance(target, dict) else None
+        if isinstance(value, dict) and isinstance(old, dict):
+            inverse[key] = inverse_patch(old, value)
+        else:
+            inverse[key] = copy.deepcopy(old)
+    return inverse
+
+def compose(first, second):
+    """
+    One patch with the effect of applying first, then second, or None when
+    a merge patch cannot express it: second patches a key with a dict after
+    first deleted it or set it to a scalar, which must replace the old value
+    rather than merge into it.
+    """
+    result = dict(first)
+    for key, value in second.items():
+        if isinstance(value, dict) and key in result:
+            if not isinstance(result[key], dict):
+                return None
+            nested = compose(result[key], value)
+            if nested is None:
+                return None
+            result[key] = nested
+        else:
+            result[key] = copy.deepcopy(value)
+    return result
+
+def fold(patches, patch):
+    """Appends patch to a list of pending patches, composed into the last one where possible."""
+    composed = compose(patches[-1], patch) if patches else None
+    return patches[:-1] + [composed] if composed is not None else patches + [patch]
+
+class ViewLog:
+    """
+    Authoritative view state of one room. The live log is held by a
+    ViewLogs store and copied to AnalysisSession.view_state_json whenever a
+    snapshot is taken.
+
+    Every change is a merge patch recorded as a delta with a room-wide
+    sequence number and its inverse. A snapshot of the state is taken every
+    SNAPSHOT_EVERY deltas and the log keeps the last MAX_DELTAS entries, so
+    clients sync from a snapshot plus a short tail of deltas, and undo/redo
+    replay inverses/patches from the same log.
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.seq = data.get("seq", 0)
+        self.state = data.get("state", {})
+        self.snapshot = data.get("snapshot", {"seq": 0, "state": {}})
+        self.deltas = data.get("deltas", [])
+        self.undo_stack = data.get("undo", [])
+        self.redo_stack = data.get("redo", [])
+
+    def to_json(self):
+        return {
+            "seq": self.seq, "state": self.state, "snapshot": self.snapshot,
+            "deltas": self.deltas, "undo": self.undo_stack, "redo": self.redo_stack
+        }
+
+    def _record(self, sid, patch, kind, ref=None):
+        self.seq += 1
+        delta = {"seq": self.seq, "sid": sid, "kind": kind, "patch": patch,
+                 "inverse": inverse_patch(self.state, patch)}
+        if ref is not None:
+            delta["ref"] = ref
+        self.state = merge_patch(self.state, patch)
+        self.deltas.append(delta)
+
+        if self.seq - self.snapshot["seq"] >= SNAPSHOT_EVERY:
+            self.snapshot = {"seq": self.seq, "state": copy.deepcopy(self.state)}
+        if len(self.deltas) > MAX_DELTAS:
+            self.deltas = self.deltas[-MAX_DELTAS:]
+            # Entries that fell off the log can no longer be undone/redone
+            first = self.deltas[0]["seq"]
+            self.undo_stack = [s for s in self.undo_stack if s >= first]
+            self.redo_stack = [s for s in self.redo_stack if s >= first]
+        return delta
+
+    def _delta(self, seq):
+        return next((d for d in self.deltas if d["seq"] == seq), None)
+
+    def apply(self, sid, patch):
+        delta = self._record(sid, patch, "update")
+        self.undo_stack.append(delta["seq"])
+        self.redo_stack = []
+        return delta
+
+    def undo(self, sid):
+        if not self.undo_stack:
+            return None
+        target = self._delta(self.undo_stack.pop())
+        delta = self._record(sid, target["inverse"], "undo", ref=target["seq"])
+        self.redo_stack.append(target["seq"])
+        return delta
+
+    def redo(self, sid):
+        if not self.redo_stack:
+            return None
+        target = self._delta(self.redo_stack.pop())
+        delta = self._record(sid, target["patch"], "redo", ref=target["seq"])
+        # The re-applied change is undone through its new entry
+        self.undo_stack.append(delta["seq"])
+        return delta
+
+    def run(self, operations):
+        """
+        Applies ("update", sid, patch) / ("undo", sid) / ("redo", sid)
+        operations and returns the resulting public deltas.
+        """
+        deltas = []
+        for op, sid, *args in operations:
+            delta = self.apply(sid, *args) if op == "update" else getattr(self, op)(sid)
+            if delta is not None:
+                deltas.append(public(delta))
+        return deltas
+
+    def sync(self, since=None):
+        """
+        What a client needs to reach the current state: only the missed deltas
+        if it already holds `since` and the log still covers it, else the
+        latest snapshot plus the deltas after it.
+        """
+        first = self.deltas[0]["seq"] if self.deltas else self.seq + 1
+        if since is not None and first - 1 <= since <= self.seq:
+            return {"seq": self.seq, "deltas": [public(d) for d in self.deltas if d["seq"] > since]}
+        return {
+            "seq": self.seq,
+            "snapshot": self.snapshot,
+            "deltas": [public(d) for d in self.deltas if d["seq"] > self.snapshot["seq"]]
+        }
+
+def public(delta):
+    """Delta as sent to clients (without the stored inverse)."""
+    return {k: v for k, v in delta.items() if k != "inverse"}
+
+def load_view_log(db, token):
+    """The session's persisted log (None if the session does not exist)."""
+    session = db.query(models.AnalysisSession).filter(models.AnalysisSession.session_token == token).first()
+    return None if session is None else (session.view_state_json or {})
+
+def store_view_log(db, token, data):
+    """
+    Persists a log unless the row already holds a newer one. The row is
+    locked on PostgreSQL; SQLite write conflicts between workers are retried.
+    """
+    for attempt in range(WRITE_RETRIES):
+        try:
+            session = db.query(models.AnalysisSession).filter(
+                models.AnalysisSession.session_token == token
+            ).with_for_update().first()
+            if session is None or (session.view_state_json or {}).get("seq", 0) >= data["seq"]:
+                return
+            session.view_state_json = data
+            flag_modified(session, "view_state_json")
+            db.commit()
+            return
+        except OperationalError:
+            db.rollback()
+            if attempt == WRITE_RETRIES - 1:
+                raise
+            time.sleep(0.05 * (attempt + 1))
+
+class ViewLogs:
+    """
+    Live view logs of a single process (and tests): room -> ViewLog, loaded
+    from the session row on first use.
+
+    Frames only touch memory. The log is written back to the database in
+    the background whenever a snapshot is taken, and when the room's last
+    member on this worker leaves, so the per-frame path never waits on a
+    database write.
+    """
+
+    def __init__(self):
+        self.logs = {}
+        self._locks = {}
+        self._writes = set()
+
+    def _lock(self, room):
+        return self._locks.setdefault(room, asyncio.Lock())
+
+    async def _read(self, room, keep=True):
+        if room not in self.logs:
+            data = await run_db(load_view_log, room)
+            if data is None:
+                return None
+            if not keep:
+                return ViewLog(data)
+            self.logs[room] = ViewLog(data)
+        return self.logs[room]
+
+    async def _write(self, room, log):
+        pass
+
+    def _persist(self, room, log):
+        task = asyncio.ensure_future(run_db(store_view_log, room, copy.deepcopy(log.to_json())))
+        self._writes.add(task)
+        task.add_done_callback(self._written)
+
+    def _written(self, task):
+        self._writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Persisting view log failed: {task.exception()!r}")
+
+    async def update(self, room, operations):
+        """Applies operations to the room's log and returns the public deltas ([] if unknown)."""
+        async with self._lock(room):
+            log = await self._read(room)
+            if log is None:
+                return []
+            snapshot = log.snapshot["seq"]
+            deltas = log.run(operations)
+            await self._write(room, log)
+            if log.snapshot["seq"] != snapshot:
+                self._persist(room, log)
+            return deltas
+
+    async def sync(self, room, since=None):
+        async with self._lock(room):
+            log = await self._read(room)
+        return (log or ViewLog()).sync(since)
+
+    async def state(self, room):
+        """(current state, seq) of the room's view."""
+        async with self._lock(room):
+            # Reading a room nobody is in does not keep its log loaded
+            log = await self._read(room, keep=False)
+        return (log.state, log.seq) if log else ({}, 0)
+
+    async def release(self, room):
+        """Persists and drops the log when the room's last member on this worker leaves."""
+        async with self._lock(room):
+            log = self.logs.pop(room, None)
+            if log is not None:
+                await run_db(store_view_log, room, log.to_json())
+        self._locks.pop(room, None)
+
+class RedisViewLogs(ViewLogs):
+    """
+    Live view logs shared by every worker/node through the Redis-compatible
+    bus: the log is a JSON value per room, and writers of a room take a
+    Redis lock so deltas get one room-wide sequence.
+    """
+
+    def __init__(self, url, client=None):
+        super().__init__()
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url, decode_responses=True)
+        self.redis = client
+
+    def _lock(self, room):
+        return self.redis.lock(VIEW_LOCK_KEY.format(room=room), timeout=5, blocking_timeout=5)
+
+    async def _read(self, room, keep=True):
+        raw = await self.redis.get(VIEW_KEY.format(room=room))
+        if raw is not None:
+            return ViewLog(json.loads(raw))
+        data = await run_db(load_view_log, room)
+        return None if data is None else ViewLog(data)
+
+    async def _write(self, room, log):
+        await self.redis.set(VIEW_KEY.format(room=room), json.dumps(log.to_json()), ex=VIEW_TTL)
+
+    async def release(self, room):
+        # Members on other workers keep using the shared copy
+        async with self._lock(room):
+            raw = await self.redis.get(VIEW_KEY.format(room=room))
+            if raw is not None:
+                await run_db(store_view_log, room, json.loads(raw))
+
+def make_view_logs(url):
+    """RedisViewLogs for a redis:// bus URL, else the in-process store."""
+    return RedisViewLogs(url) if is_redis_url(url) else ViewLogs()
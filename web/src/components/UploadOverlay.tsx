@@ -57,9 +57,19 @@ export function UploadOverlay({ onClose, onUploadComplete }: UploadOverlayProps)
                 headers: { 'Content-Type': 'multipart/form-data' }
             });
 
+            // Step 2: Ingestion runs as a background job; poll until it settles
+            let job = response.data;
+            while (job.status === 'queued' || job.status === 'running') {
+                await new Promise(r => setTimeout(r, 1000));
+                job = (await axios.get(`http://127.0.0.1:8000/jobs/${job.id}`)).data;
+            }
+            if (job.status === 'failed') {
+                throw { response: { data: { detail: job.error } } };
+            }
+
             setUploadStatus('success');
             setTimeout(() => {
-                onUploadComplete(response.data);
+                onUploadComplete(job.result);
                 onClose();
             }, 1000);
 
@@ -9,12 +9,18 @@ export interface UserCursor {
     color: string;
     x: number;
     y: number;
+    slot: number;
 }
 
-export const useCollaboration = (username: string | null) => {
+// Server cursor frames: packed little-endian records of (uint16 slot, float32 x, float32 y)
+const CURSOR_RECORD_BYTES = 10;
+
+export const useCollaboration = (username: string | null, session?: string) => {
     const socketRef = useRef<Socket | null>(null);
     const [cursors, setCursors] = useState<UserCursor[]>([]);
     const [activeUsers, setActiveUsers] = useState<UserCursor[]>([]);
+    // slot -> user, read by the frame handler without re-subscribing
+    const slotsRef = useRef<Map<number, UserCursor>>(new Map());
 
     useEffect(() => {
         if (!username) return;
@@ -31,44 +37,60 @@ export const useCollaboration = (username: string | null) => {
             console.log('Connected to collaboration server');
             socket.emit('join', {
                 username,
+                session,
                 color: '#' + Math.floor(Math.random() * 16777215).toString(16) // Random color
             });
         });
 
         // Event Listeners
         socket.on('sync_users', (users: UserCursor[]) => {
+            slotsRef.current = new Map(users.map(u => [u.slot, u]));
             setActiveUsers(users);
         });
 
         socket.on('user_joined', (user: UserCursor) => {
+            slotsRef.current.set(user.slot, user);
             setActiveUsers(prev => [...prev, user]);
         });
 
         socket.on('user_left', ({ sid }: { sid: string }) => {
+            slotsRef.current.forEach((u, slot) => {
+                if (u.id === sid) slotsRef.current.delete(slot);
+            });
             setActiveUsers(prev => prev.filter(u => u.id !== sid));
             setCursors(prev => prev.filter(u => u.id !== sid));
         });
 
-        socket.on('cursor_update', (data: UserCursor) => {
-            setCursors(prev => {
-                const existing = prev.find(c => c.id === data.id);
-                if (existing) {
-                    return prev.map(c => c.id === data.id ? data : c);
-                }
-                return [...prev, data];
-            });
+        // One frame per room tick with the latest position of every user who moved
+        socket.on('cursor_frame', (frame: ArrayBuffer) => {
+            const view = new DataView(frame);
+            const moved = new Map<string, UserCursor>();
+            for (let offset = 0; offset + CURSOR_RECORD_BYTES <= view.byteLength; offset += CURSOR_RECORD_BYTES) {
+                const user = slotsRef.current.get(view.getUint16(offset, true));
+                if (!user || user.id === socket.id) continue;
+                moved.set(user.id, {
+                    ...user,
+                    x: view.getFloat32(offset + 2, true),
+                    y: view.getFloat32(offset + 6, true)
+                });
+            }
+            if (moved.size === 0) return;
+            setCursors(prev => [
+                ...prev.filter(c => !moved.has(c.id)),
+                ...moved.values()
+            ]);
         });
 
         // Cleanup
         return () => {
             socket.disconnect();
         };
-    }, [username]);
+    }, [username, session]);
 
     // Helper to broadcast own movement
     const sendCursorMove = (x: number, y: number) => {
         if (socketRef.current) {
-            // Rate limit/throttle could go here
+            // The server coalesces moves into one frame per room tick
             socketRef.current.emit('cursor_move', { x, y });
         }
     };